@@ -0,0 +1,243 @@
+"""
+
+    Benchmarks of the Grid() builders and exporters
+
+Each case (method, grid size, 2.5d or 3d) runs in a separate python process,
+which reports the wall time of the call and its peak resident memory (RSS).
+The results are stored in a JSON file that can be compared to another one.
+
+usage:
+    python benchmarks/bench_grid.py -o bench.json
+    python benchmarks/bench_grid.py -o bench.json --sizes 64 --modes 3d --cases add_mag
+    python benchmarks/bench_grid.py --compare old.json new.json
+
+"""
+
+import ctts_env
+
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+wind_model = os.path.join(root, "wind_models", "sol40.dat")
+
+##########################################################################################
+
+
+def make_grid(N, mode):
+    """
+    Spherical grid of N**3 cells (3d) or N**2 cells (2.5d, Nphi = 1).
+    r is log-spaced from 1 to 60 Rstar to include the magnetosphere and the disc wind.
+    """
+    rr = np.geomspace(1.0, 60.0, N)
+    tt = np.linspace(1e-5, np.pi - 1e-5, N)
+    if mode == "3d":
+        pp = np.linspace(0, 2 * np.pi, N, endpoint=False)
+    else:
+        pp = np.array([0.0])
+    r, t, p = np.meshgrid(rr, tt, pp, indexing="ij")
+    return ctts_env.Grid(r, t, p)
+
+
+def make_star():
+    return ctts_env.Star(2.0, 0.8, 4000, 5.0, 1.0)
+
+
+def _beta(mode):
+    # oblique dipole in 3d, axisymmetric in 2.5d
+    return (0.0, 10.0)[mode == "3d"]
+
+
+def _model(g, star):
+    # cheap model for the exporters
+    g.add_conical_stellar_wind(star, Rej=1, thetao=30)
+    return
+
+
+# name: (setup, timed call). setup is not timed.
+cases = {
+    "Grid": (
+        None,
+        lambda g, star, mode, tmp: make_grid(g.shape[0], mode),
+    ),
+    "add_mag": (
+        None,
+        lambda g, star, mode, tmp: g.add_mag(
+            star, rmi=2.2, rmo=3.0, beta=_beta(mode), V0=1e3
+        ),
+    ),
+    "add_magnetosphere_v1": (
+        None,
+        lambda g, star, mode, tmp: g.add_magnetosphere_v1(
+            star, rmi=2.2, rmo=3.0, beta=_beta(mode)
+        ),
+    ),
+    "add_disc_wind_knigge95": (
+        None,
+        lambda g, star, mode, tmp: g.add_disc_wind_knigge95(star),
+    ),
+    "add_disc_wind": (
+        None,
+        lambda g, star, mode, tmp: g.add_disc_wind(star, wind_model=wind_model),
+    ),
+    "add_conical_stellar_wind": (
+        None,
+        lambda g, star, mode, tmp: g.add_conical_stellar_wind(star),
+    ),
+    "_write": (
+        _model,
+        lambda g, star, mode, tmp: g._write(os.path.join(tmp, "model.bin")),
+    ),
+    "_write_deprec_ascii": (
+        _model,
+        lambda g, star, mode, tmp: g._write_deprec_ascii(
+            os.path.join(tmp, "model.txt")
+        ),
+    ),
+}
+
+
+def _maxrss_MB():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on linux, bytes on macos
+    return rss / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def run_case(name, N, mode):
+    """
+    Run one case in the current process and return its record.
+    """
+    star = make_star()
+    g = make_grid(N, mode)
+    setup, call = cases[name]
+    with tempfile.TemporaryDirectory() as tmp:
+        if setup:
+            setup(g, star)
+        rss0 = _maxrss_MB()
+        t0 = time.perf_counter()
+        call(g, star, mode, tmp)
+        wall = time.perf_counter() - t0
+        rss = _maxrss_MB()
+    return {
+        "case": name,
+        "N": N,
+        "mode": mode,
+        "shape": list(g.shape),
+        "Ncells": int(g.Ncells),
+        "wall_s": wall,
+        "peak_rss_MB": rss,
+        "rss_before_MB": rss0,
+    }
+
+
+def run_all(names, sizes, modes, timeout=None, verbose=True):
+    """
+    Run each case in a subprocess, so that the peak RSS is the one of the case only.
+    """
+    results = []
+    for N in sizes:
+        for mode in modes:
+            for name in names:
+                with tempfile.NamedTemporaryFile(suffix=".json") as fout:
+                    cmd = [
+                        sys.executable,
+                        os.path.abspath(__file__),
+                        "--_single",
+                        name,
+                        str(N),
+                        mode,
+                        fout.name,
+                    ]
+                    try:
+                        subprocess.run(
+                            cmd,
+                            check=True,
+                            timeout=timeout,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE,
+                        )
+                        rec = json.load(open(fout.name))
+                    except subprocess.TimeoutExpired:
+                        rec = {"case": name, "N": N, "mode": mode, "error": "timeout"}
+                    except subprocess.CalledProcessError as e:
+                        rec = {
+                            "case": name,
+                            "N": N,
+                            "mode": mode,
+                            "error": e.stderr.decode().strip().split("\n")[-1],
+                        }
+                results.append(rec)
+                if verbose:
+                    if "error" in rec:
+                        print("%-26s N=%4d %4s  %s" % (name, N, mode, rec["error"]))
+                    else:
+                        print(
+                            "%-26s N=%4d %4s  %10.3f s  %10.1f MB"
+                            % (name, N, mode, rec["wall_s"], rec["peak_rss_MB"])
+                        )
+    return results
+
+
+def compare(fold, fnew):
+    """
+    Print the ratios new/old of the wall times and peak RSS of two result files.
+    """
+    old = {(r["case"], r["N"], r["mode"]): r for r in json.load(open(fold))["results"]}
+    new = json.load(open(fnew))["results"]
+    print("%-26s %4s %4s  %10s  %10s" % ("case", "N", "mode", "time", "RSS"))
+    for r in new:
+        key = (r["case"], r["N"], r["mode"])
+        if key not in old or "error" in r or "error" in old[key]:
+            continue
+        print(
+            "%-26s %4d %4s  %10.3f  %10.3f"
+            % (
+                *key,
+                r["wall_s"] / old[key]["wall_s"],
+                r["peak_rss_MB"] / old[key]["peak_rss_MB"],
+            )
+        )
+    return
+
+
+##########################################################################################
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2].strip())
+    parser.add_argument("-o", "--output", default="bench.json")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--modes", nargs="+", default=["2.5d", "3d"])
+    parser.add_argument("--cases", nargs="+", default=list(cases))
+    parser.add_argument("--timeout", type=float, default=None, help="per case (s)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--_single", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._single:
+        name, N, mode, fout = args._single
+        json.dump(run_case(name, int(N), mode), open(fout, "w"))
+    elif args.compare:
+        compare(*args.compare)
+    else:
+        results = run_all(args.cases, args.sizes, args.modes, timeout=args.timeout)
+        json.dump(
+            {
+                "version": ctts_env.__version__,
+                "numpy": np.__version__,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            },
+            open(args.output, "w"),
+            indent=1,
+        )
@@ -2,5 +2,11 @@ __version__ = "0.1"
 
 from . import constants
 from . import temperature
+from . import backend
 from . import utils
-from .classgrid import Grid, Star
+from . import shock
+from .classgrid import Grid, Star, BuildCancelled
+from . import profiling
+from . import store
+from .cache import ModelCache
+from .export import ExportQueue
@@ -0,0 +1,139 @@
+"""
+Backends of the per-cell kernels (field-line integration of the dipole and
+surface integral):
+
+    "numpy" :: vectorised numpy (default, always available)
+    "numba" :: compiled with numba, parallel loops (requires numba)
+
+The backend is selected at runtime by set_backend(), or at import by the
+environment variable CTTS_ENV_BACKEND. The backends agree to round-off
+(see tests/test_backends.py).
+"""
+
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_backend = "numpy"
+
+
+def available():
+    """
+    Names of the backends available.
+    """
+    return ["numpy"] + ["numba"] * (numba is not None)
+
+
+def get_backend():
+    return _backend
+
+
+def set_backend(name):
+    global _backend
+    if name not in available():
+        raise ValueError(
+            "Backend %s not available (available: %s)." % (name, available())
+        )
+    _backend = name
+    return
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _field_line_v2(r, st, sp, r0, phi0, axi, A, C, V0, N_fl):
+        v2 = np.zeros(r.size)
+        te = np.pi / 2
+        for i in numba.prange(r.size):
+            if axi:
+                ts = np.arcsin(np.sqrt(r[i] / r0[i]))
+                L = r0[i]
+            else:
+                s2 = np.sin(phi0[i]) ** 2
+                ts = np.arcsin(np.sqrt(r[i] / r0[i] * s2 / sp[i] ** 2))
+                L = r0[i] * sp[i] ** 2 / s2
+            step = (te - ts) / (N_fl - 1)
+            laccr = True
+            for k in range(N_fl):
+                t = k * step + ts
+                if k == N_fl - 1:
+                    t = te
+                y = np.sin(t) ** 2
+                r_fl = L * y
+                v2_fl = A * (1 / r_fl - 1 / r0[i]) + (y * r_fl**2 - r0[i] ** 2) * C
+                if not v2_fl + V0**2 > 0:
+                    laccr = False
+                    break
+            if laccr:
+                R = r[i] * st[i]
+                v2[i] = A * (1 / r[i] - 1 / r0[i]) + (R**2 - r0[i] ** 2) * C + V0**2
+        return v2
+
+    @numba.njit(parallel=True, cache=True)
+    def _surface_integral(t, p, q, axi_sym):
+        ct = np.cos(t)
+        Nt, Np = q.shape
+        if axi_sym:
+            fact = 2 * np.pi
+            if t.min() >= 0 and t.max() <= np.pi / 2:
+                fact *= 2
+            dOmega_o_4pi = 0.0
+            int_theta = 0.0
+            for j in range(1, Nt):
+                dct = abs(ct[j] - ct[j - 1])
+                dOmega_o_4pi += dct / 4 / np.pi
+                int_theta += 0.5 * (q[j, 0] + q[j - 1, 0]) * dct
+            dOmega_o_4pi *= fact
+            return int_theta * fact / dOmega_o_4pi, dOmega_o_4pi
+
+        int_theta = np.zeros(Np)
+        for i in numba.prange(Np):
+            s = 0.0
+            for j in range(1, Nt):
+                s += 0.5 * (q[j, i] + q[j - 1, i]) * abs(ct[j] - ct[j - 1])
+            int_theta[i] = s
+        dct = 0.0
+        for j in range(1, Nt):
+            dct += abs(ct[j] - ct[j - 1])
+        S = 0.0
+        dp = 0.0
+        for i in range(1, Np):
+            S += 0.5 * (int_theta[i] + int_theta[i - 1]) * (p[i] - p[i - 1])
+            dp += p[i] - p[i - 1]
+        dOmega_o_4pi = dct * dp / 4 / np.pi
+        return S / dOmega_o_4pi, dOmega_o_4pi
+
+
+def field_line_v2(r, st, sp, r0, phi0, beta, A, C, V0, N_fl):
+    """
+    Compiled version of utils.field_line_v2 (A = 2 G M / R, C = (R Omega)^2).
+    """
+    return _field_line_v2(
+        *(np.ascontiguousarray(q, dtype=float) for q in (r, st, sp, r0, phi0)),
+        beta == 0,
+        float(A),
+        float(C),
+        float(V0),
+        int(N_fl),
+    )
+
+
+def surface_integral(t, p, q, axi_sym=False):
+    """
+    Compiled version of utils.surface_integral.
+    """
+    return _surface_integral(
+        np.ascontiguousarray(t, dtype=float),
+        np.ascontiguousarray(p, dtype=float),
+        np.ascontiguousarray(q, dtype=float),
+        bool(axi_sym),
+    )
+
+
+if os.environ.get("CTTS_ENV_BACKEND"):
+    set_backend(os.environ["CTTS_ENV_BACKEND"])
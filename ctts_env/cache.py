@@ -0,0 +1,202 @@
+"""
+On-disk cache of built models, content-addressed by the grid and its recipe.
+
+The key of a model is the SHA-256 of:
+    - the version of the package and the coordinates of the grid;
+    - the content of the fields of the grid before the calls, so that changes
+      not recorded in its recipe (resample_to, project, direct edits of the
+      arrays) give another key;
+    - the ordered list of builder calls with all their arguments (stars included,
+      see classgrid._record) but those not changing the model (verbose), with
+      the numbers in canonical form (beta=0 and beta=0.0 are the same), and
+      the content of the files they read (e.g., the wind_model of add_disc_wind).
+A model is stored in the cache directory as <key>.h5 (see ctts_env.store,
+requires h5py).
+
+The size of the cache is bounded: least recently used models (by modification
+time, updated at each hit) are evicted when it exceeds max_bytes.
+
+usage:
+    cache = ModelCache("~/.cache/ctts_env", max_bytes=20 * 2**30)
+    grid = cache.build(
+        grid,
+        [
+            ("add_mag", {"star": star, "rmi": 2.2, "rmo": 3.0, "beta": 10}),
+            ("setup_dead_zone", {"star": star, "rho": 1e-12, "T": 8000}),
+        ],
+    )
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from . import __version__
+from . import store
+from .classgrid import Grid, _record, _serialize
+
+# arguments of the builders that do not change the model (not in the key)
+_presentation_args = ["verbose"]
+
+
+class ModelCache:
+    def __init__(self, directory, max_bytes=10 * 2**30, compression_opts=1):
+        """
+        directory           :: directory of the cache (created if needed)
+        max_bytes           :: maximum size of the cache (bytes)
+        compression_opts    :: gzip level of the stored models
+        """
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.compression_opts = compression_opts
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        return
+
+    def key(self, grid, calls):
+        """
+        Key of the model obtained by applying calls to grid.
+
+        calls :: list of (name of the builder, dict of its arguments), or
+                 a recipe (see Grid.get_recipe)
+        """
+        h = hashlib.sha256()
+        h.update(__version__.encode())
+        h.update(str(grid.structured).encode())
+        if grid.structured:
+            coords = grid.grid
+        else:
+            coords = (grid.r, grid.theta, grid.phi)
+        for c in coords:
+            c = np.ascontiguousarray(c, dtype=float)
+            h.update(str(c.shape).encode())
+            h.update(c.tobytes())
+        for name in store.grid_fields + store.private_fields:
+            q = getattr(grid, name, None)
+            h.update(name.encode())
+            # all zeros (e.g., a new grid) is cheaper to check than to hash
+            if q is not None and np.any(q):
+                q = np.ascontiguousarray(q)
+                h.update(str((q.shape, q.dtype.str)).encode())
+                h.update(q.tobytes())
+        recipe = _serialize(grid._recipe + self._records(grid, calls), canonical=True)
+        for record in recipe:
+            for name in _presentation_args:
+                record["args"].pop(name, None)
+        h.update(json.dumps(recipe, sort_keys=True).encode())
+        for path in sorted(self._files(recipe)):
+            with open(path, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        return h.hexdigest()
+
+    @staticmethod
+    def _files(recipe):
+        """
+        Existing files named by the string arguments of the calls of recipe.
+        """
+        return {
+            v
+            for record in recipe
+            for v in record["args"].values()
+            if isinstance(v, str) and os.path.isfile(v)
+        }
+
+    @staticmethod
+    def _records(grid, calls):
+        """
+        Calls as records of a recipe (see Grid.get_recipe).
+        """
+        return [
+            c if isinstance(c, dict) else _record(getattr(Grid, c[0]), grid, **c[1])
+            for c in calls
+        ]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".h5")
+
+    def build(self, grid, calls):
+        """
+        Apply the builder calls to grid, or read the model from the cache if it
+        has already been built.
+
+        calls :: list of (name of the builder, dict of its arguments), or
+                 a recipe (see Grid.get_recipe)
+
+        return :: grid itself, with the model built or read from the cache.
+        """
+        path = self._path(self.key(grid, calls))
+        if os.path.isfile(path):
+            try:
+                model = store.load(path)
+            except (OSError, KeyError, ValueError):
+                # unreadable (e.g., truncated or corrupt file, missing dataset or
+                # attribute, invalid JSON), evicted and built again
+                os.remove(path)
+            else:
+                os.utime(path)
+                self.hits += 1
+                store.copy_model(model, grid)
+                return grid
+
+        self.misses += 1
+        grid.replay(self._records(grid, calls))
+        # written to a temporary file first, so that concurrent readers
+        # never see a partial model
+        fd, tmp = tempfile.mkstemp(suffix=".h5", dir=self.directory)
+        os.close(fd)
+        try:
+            store.save(grid, tmp, compression_opts=self.compression_opts)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+        return grid
+
+    def entries(self):
+        """
+        Models in the cache, from the least to the most recently used.
+
+        return :: list of (path, size in bytes, last use time)
+        """
+        out = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".h5"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            out.append((path, st.st_size, st.st_mtime))
+        return sorted(out, key=lambda e: e[2])
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, max_bytes=None):
+        """
+        Remove the least recently used models until the size of the cache is
+        at most max_bytes (self.max_bytes by default).
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return
+
+    def clear(self):
+        self.evict(0)
+        return
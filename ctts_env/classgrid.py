@@ -7,11 +7,28 @@ from .constants import (
     Rsun_au,
     AMU,
 )
-from .utils import surface_integral, spherical_to_cartesian, cartesian_to_spherical
+from .utils import (
+    centres_to_limits,
+    surface_integral,
+    surface_integral_binned,
+    surface_bins,
+    spherical_to_cartesian,
+    cartesian_to_spherical,
+    dipole_foot_point,
+    field_line_v2,
+    dipole_surface_flux,
+)
 from .temperature import logRadLoss_to_T, T_to_logRadLoss
 import numpy as np
-from scipy.interpolate import CubicSpline
+from scipy.interpolate import CubicSpline, RegularGridInterpolator
+from scipy.spatial import cKDTree
+from concurrent.futures import ThreadPoolExecutor
 import sys
+import functools
+import inspect
+import json
+import threading
+import zlib
 
 # import matplotlib.pyplot as plt
 # from mpl_toolkits.axes_grid1.axes_divider import make_axes_locatable
@@ -19,6 +36,155 @@ import sys
 # from matplotlib.colors import LogNorm, Normalize, PowerNorm, SymLogNorm, TwoSlopeNorm
 
 
+class BuildCancelled(Exception):
+    """
+    Raised by a builder (add_* method) when its cancellation token is set.
+    The grid is left partially built.
+    """
+
+    pass
+
+
+# builders running in each thread (see _build_stack)
+_build_local = threading.local()
+
+
+def _build_stack():
+    """
+    Builders running in the current thread, innermost last, as
+    (grid, progress, cancel) frames.
+    """
+    if not hasattr(_build_local, "stack"):
+        _build_local.stack = []
+    return _build_local.stack
+
+
+def _builder(method):
+    """
+    Decorator for the methods building a region of a Grid() instance (add_*).
+
+    The builders accept two extra keyword arguments:
+        progress :: callable(done, total) called with the number of cells processed
+                    and the total number of cells, at least at the start and at the end.
+        cancel   :: cancellation token (e.g., threading.Event). When cancel.is_set()
+                    the builder stops and raises BuildCancelled.
+
+    The progress callbacks and cancellation tokens are kept on a per-thread stack,
+    so that a builder called by another one restores the outer ones when it
+    returns, and builders running in different threads do not share them.
+
+    If grid.validate is set, the fields are checked for nan/inf values
+    after the call ("warn" or "raise").
+
+    Each call that completes is recorded, with all its arguments, in grid._recipe.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, progress=None, cancel=None, **kwargs):
+        record = _record(method, self, *args, **kwargs)
+        stack = _build_stack()
+        stack.append((self, progress, cancel))
+        try:
+            self._check_progress(0, self.Ncells)
+            out = method(self, *args, **kwargs)
+            if progress is not None:
+                progress(self.Ncells, self.Ncells)
+        finally:
+            stack.pop()
+        self._recipe.append(record)
+        self._fields_changed()
+        if self.validate:
+            self.check_finite(raise_error=self.validate == "raise")
+        return out
+
+    wrapper._builder = True
+    wrapper._recorded = True
+    return wrapper
+
+
+def _recorded(method):
+    """
+    Decorator for the methods modifying the model that are not builders.
+    Each call that completes is recorded in grid._recipe, as for the builders.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        record = _record(method, self, *args, **kwargs)
+        out = method(self, *args, **kwargs)
+        self._recipe.append(record)
+        return out
+
+    wrapper._recorded = True
+    return wrapper
+
+
+def _deserialize(value):
+    """
+    Inverse of _serialize: parameters of a star are replaced by an instance of Star().
+    """
+    if isinstance(value, dict):
+        if list(value) == ["Star"]:
+            return Star(**value["Star"])
+        return {k: _deserialize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_deserialize(v) for v in value]
+    return value
+
+
+def _record(method, grid, *args, **kwargs):
+    """
+    Record of a call of the builder method on grid: its name and all its arguments
+    (defaults included), serializable.
+    """
+    call = inspect.signature(method).bind(grid, *args, **kwargs)
+    call.apply_defaults()
+    call.arguments.pop("self")
+    return {
+        "method": method.__name__,
+        "args": {k: _serialize(v) for k, v in call.arguments.items()},
+    }
+
+
+def _serialize(value, canonical=False):
+    """
+    JSON-serializable form of an argument of a builder.
+    Instances of Star() are replaced by their parameters.
+
+    canonical :: the numbers are converted to float, so that equal values give
+                 the same form whatever their type (e.g., beta=0 and beta=0.0).
+                 Used for hashing (see ModelCache.key); the recipes keep the
+                 types of the arguments, which the builders may rely on.
+    """
+    if isinstance(value, Star):
+        value = {"Star": value._params()}
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (list, tuple)):
+        return [_serialize(v, canonical) for v in value]
+    if isinstance(value, dict):
+        return {k: _serialize(v, canonical) for k, v in value.items()}
+    if canonical and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def _refine_axis(x, f, periodic=False):
+    """
+    Axis x (cell centres, ascending) with f - 1 points inserted between consecutive
+    centres. If periodic, also between the last centre and the first + 2 pi.
+    """
+    if f == 1 or len(x) < 2:
+        return np.copy(x)
+    xe = np.append(x, x[0] + 2 * np.pi) if periodic else x
+    xr = (xe[:-1, None] + np.arange(f)[None, :] / f * np.diff(xe)[:, None]).reshape(-1)
+    if not periodic:
+        xr = np.append(xr, x[-1])
+    return xr
+
+
 class Star:
     def __init__(self, R, M, T, P, Beq):
         self.R = R
@@ -47,6 +213,12 @@ class Star:
 
         return
 
+    def _params(self):
+        """
+        Parameters of the star (arguments of Star()).
+        """
+        return {"R": self.R, "M": self.M, "T": self.T, "P": self.P, "Beq": self.Beq}
+
     def _pinfo(self, fout=sys.stdout):
         print("** Stellar parameters:", file=fout)
         print(" ----------------------- ", file=fout)
@@ -63,8 +235,29 @@ class Star:
         return
 
 
+def _fortran_buffer(q):
+    """
+    Buffer of the 3d array q in Fortran order, without copy if q is
+    Fortran-contiguous.
+    """
+    if q.T.flags.c_contiguous:
+        return memoryview(q.T)
+    return q.T.tobytes()
+
+
 class Grid:
-    def __init__(self, r, theta, phi):
+    def __init__(self, r, theta, phi, nthreads=1, order="C"):
+        """
+        r, theta, phi   :: coordinates of the cells, 3d arrays (Nr, Nt, Np) for a
+                            structured grid or 1d arrays for an unstructured grid.
+        nthreads        :: number of threads of the array-heavy computations
+                            (see self._parallel). The results do not depend on it.
+        order           :: memory layout of the fields (rho, T, ne, v, B, regions)
+                            of a structured grid, "C" or "F". With "F", the fields
+                            are stored as (Np, Nt, Nr) arrays, the layout of the
+                            binary files of MCFOST, written without copy by
+                            self._write. The indexing [ir, it, ip] is the same.
+        """
         assert type(r) == np.ndarray, " r must be a numpy array!"
         assert type(theta) == np.ndarray, " theta must be a numpy array!"
         assert type(phi) == np.ndarray, " phi must be a numpy array!"
@@ -100,30 +293,45 @@ class Grid:
         self.r = r
         self.theta = theta
         self.phi = phi
+        self.nthreads = nthreads
+        if order not in ("C", "F"):
+            raise ValueError("order must be 'C' or 'F'.")
+        self.order = order
+
+        self._cp = np.empty(self.shape)  # cos(phi)
+        self._sp = np.empty(self.shape)  # sin(phi)
+        self._st = np.empty(self.shape)  # sin(theta)
+        self._ct = np.empty(self.shape)  # cos(theta)
+        self.x = np.empty(self.shape)  # Rstar
+        self.y = np.empty(self.shape)  # Rstar
+        self.z = np.empty(self.shape)  # Rstar
+        self._sign_z = np.empty(self.shape)
+        self.R = np.empty(self.shape)
+
+        def _slab(sl):
+            np.cos(self.phi[sl], out=self._cp[sl])
+            np.sin(self.phi[sl], out=self._sp[sl])
+            np.sin(self.theta[sl], out=self._st[sl])
+            np.cos(self.theta[sl], out=self._ct[sl])
+            self.x[sl] = self.r[sl] * self._st[sl] * self._cp[sl]
+            self.y[sl] = self.r[sl] * self._st[sl] * self._sp[sl]
+            self.z[sl] = self.r[sl] * self._ct[sl]
+            np.sign(self.z[sl], out=self._sign_z[sl])
+            self.R[sl] = self.r[sl] * self._st[sl]
+            return
+
+        self._parallel(_slab, self.shape[0])
+
+        self.v = self._zeros(3)
+        self.B = self._zeros(3)
 
-        self._cp = np.cos(self.phi)  # cos(phi)
-        self._sp = np.sin(self.phi)  # sin(phi)
-        self._st = np.sin(self.theta)  # sin(theta)
-        self._ct = np.cos(self.theta)  # cos(theta)
-        self.x = self.r * self._st * self._cp  # Rstar
-        self.y = self.r * self._st * self._sp  # Rstar
-        self.z = self.r * self._ct  # Rstar
-        self._sign_z = np.sign(self.z)
-        self.R = self.r * self._st
-
-        shape = [3]
-        for nn in self.shape:
-            shape.append(nn)
-        self.v = np.zeros(shape)
-        self.B = np.zeros(shape)
-
-        self.rho = np.zeros(self.shape)
-        self.T = np.zeros(self.shape)
-        self.ne = np.zeros(self.shape)  # electronic density
+        self.rho = self._zeros()
+        self.T = self._zeros()
+        self.ne = self._zeros()  # electronic density
 
         self.Rmax = 0
 
-        self.regions = np.zeros(self.shape, dtype=int)
+        self.regions = self._zeros(dtype=int)
         self.regions_label = [
             "",
             "Accr. Col",
@@ -139,6 +347,21 @@ class Grid:
         # 1 : accretion columns
 
         self._volume_set = False
+        self._volume = None  # external volume (Voronoi)
+        self._cells_cache = ()
+        # check for nan/inf after each add_* method: False, "warn" or "raise"
+        self.validate = False
+        # interpolators of the fields, reset when the fields change
+        self._interp_cache = {}
+        # timing and memory of the methods (see ctts_env.profiling)
+        self._profile = {}
+        # foot radius and azimuth of the dipole field lines, for the last obliquity
+        self._foot_cache = {}
+        # interpolation weights in phi of self.rotate_phase, per rotation angle
+        self._phase_cache = {}
+        self._phase = 0.0
+        # builder calls, in order (see _builder)
+        self._recipe = []
 
         return
 
@@ -159,11 +382,98 @@ class Grid:
         vR = vx * self._cp + vy * self._sp
         return vR, vz, self.v[2]
 
+    def _cells_factors(self):
+        """
+        Exact volume and surface of the cells of a structured grid, from
+        the cell limits (see utils.centres_to_limits), as 1d factors:
+            dV = (r+**3 - r-**3) / 3 * |cos(theta+) - cos(theta-)| * (phi+ - phi-)
+            dS = r**2 * |cos(theta+) - cos(theta-)| * (phi+ - phi-)
+        The factors have shapes (Nr, 1, 1), (1, Nt, 1) and (1, 1, Np).
+        Cached until the coordinates change.
+        """
+        c = self._cells_cache
+        if c and c[0] is self.r and c[1] is self.theta and c[2] is self.phi:
+            return c[3]
+        if not self.structured:
+            raise ValueError("cells volume of an unstructured grid must be given!")
+
+        r = self.r[:, 0, 0]
+        rl, tl, pl = self._cells_limits()
+        ctl = np.cos(tl)
+
+        factors = {
+            "dr3": ((rl[1:] ** 3 - rl[:-1] ** 3) / 3)[:, None, None],
+            "r2": (r**2)[:, None, None],
+            "dcost": abs(np.diff(ctl))[None, :, None],
+            "dphi": np.diff(pl)[None, None, :],
+        }
+        self._cells_cache = (self.r, self.theta, self.phi, factors)
+        return factors
+
+    def _cells_limits(self):
+        """
+        Limits of the cells of a structured grid along r, theta and phi
+        (see utils.centres_to_limits). The phi limits are periodic
+        and span 2 pi.
+        """
+        rl = centres_to_limits(self.grid[0], 0, np.inf)
+        tl = centres_to_limits(self.grid[1], 0, np.pi)
+        p = self.grid[2]
+        if len(p) > 1:
+            # periodic
+            p0 = 0.5 * (p[-1] - 2 * np.pi + p[0])
+            pl = centres_to_limits(p, p0, p0 + 2 * np.pi)
+            pl[0], pl[-1] = p0, p0 + 2 * np.pi
+        else:
+            pl = np.array([0, 2 * np.pi])
+        return rl, tl, pl
+
+    def _outer_product(self, factors):
+        """
+        Product of broadcastable factors, as a read-only array of shape self.shape.
+        Dimensions along which all the factors are constant are not stored (broadcast).
+        """
+        out = np.ones((1,) * len(self.shape))
+        for f in factors:
+            if np.ptp(f) <= 1e-12 * abs(f).max():
+                f = f.reshape(-1)[:1].reshape((1,) * len(self.shape))
+            out = out * f
+        return np.broadcast_to(out, self.shape)
+
+    @property
+    def volume(self):
+        """
+        Volume of the cells (Rstar^3), given by an external grid
+        (see self.calc_cells_volume) or computed from the cell limits.
+        """
+        if self._volume is not None:
+            return self._volume
+        f = self._cells_factors()
+        if "volume" not in f:
+            f["volume"] = self._outer_product([f["dr3"], f["dcost"], f["dphi"]])
+        return f["volume"]
+
+    @volume.setter
+    def volume(self, vol):
+        self._volume = vol
+
+    @property
+    def surface(self):
+        """
+        Surface of the cells (Rstar^2) on the sphere of radius r, from the cell limits.
+        """
+        f = self._cells_factors()
+        if "surface" not in f:
+            f["surface"] = self._outer_product([f["r2"], f["dcost"], f["dphi"]])
+        return f["surface"]
+
     def calc_cells_volume(self, vol=[]):
         """
         3d grid's cells volume calculation
-        dvolume = dS * dr
-        dvolume = np.gradient(self.r,axis=0) * self.calc_cells_surface()
+        dvolume = (r+**3 - r-**3) / 3 * |cos(theta+) - cos(theta-)| * (phi+ - phi-)
+        The volume is computed once from the cell limits (see self.volume).
+
+        vol :: volume of the cells from an external grid (e.g., Voronoi).
         """
         # if volume is set, simply return.
         if self._volume_set:
@@ -172,12 +482,6 @@ class Grid:
         # Volume from an external grid ?
         if np.any(vol):
             self.volume = np.copy(vol)
-        # Estimate the volume from this grid
-        else:
-            dr = np.gradient(self.r, axis=0)
-            dt = np.gradient(self.theta, axis=1)
-            dp = np.gradient(self.phi, axis=2)
-            self.volume = self.r**2 * dr * self._st * dt * dp
 
         self._smoothing_length = 1 / 3 * self.volume ** (1 / 3)
         self._volume_set = True
@@ -186,11 +490,9 @@ class Grid:
     def calc_cells_surface(self):
         """
         3d grid's cell surface calculation
+        Kept for compatibility, self.surface is computed on access.
         """
-        dt = np.gradient(self.theta, axis=1)
-        dp = np.gradient(self.phi, axis=2)
-        self.surface = self.r**2 * self._st * dt * dp
-        return
+        return self.surface
 
     def calc_cells_limits(self, rmin, rmax):
         """
@@ -211,11 +513,11 @@ class Grid:
         self._p_lim[-1] = 2 * np.pi
         self._p_lim[0] = 0.0
 
-        self._r_lim[0] = rmin
-        for i in range(1, self.shape[0]):
-            # self._r_lim[i] = 0.5 * (self.r[i,0,0]+self.r[i-1,0,0])
-            dr = self.r[i, 0, 0] - self.r[i - 1, 0, 0]
-            self._r_lim[i] = self._r_lim[i - 1] + dr
+        # self._r_lim[i] = 0.5 * (self.r[i,0,0]+self.r[i-1,0,0])
+        # r_lim[i] = r_lim[i-1] + dr (sequential sum)
+        self._r_lim[: self.shape[0]] = np.cumsum(
+            np.concatenate(([rmin], np.diff(self.r[:, 0, 0])))
+        )
         self._r_lim[self.shape[0]] = rmax
 
         # w = self._st[0, :, 0]
@@ -224,10 +526,7 @@ class Grid:
         # Still, theta goes from pi to 0.
         w = np.sin(self.theta[0, :, 0] - (np.pi / 2, 0)[self._2d])  # [1, -1]
         self._sint_lim[0] = 1.0
-        for j in range(1, jend):
-            self._sint_lim[j] = 0.5 * (w[j] + w[j - 1])
-            # dt = w[j] - w[j - 1]
-            # self._sint_lim[j] = self._sint_lim[j - 1] + dt
+        self._sint_lim[1:jend] = 0.5 * (w[1:jend] + w[: jend - 1])
         # print("0", self._sint_lim)
         self._sint_lim[jend] = 0
         # print("1", self._sint_lim)
@@ -238,12 +537,714 @@ class Grid:
         self._tlim = np.arcsin(self._sint_lim)  # [pi/2, -pi/2] in 3d
         # print("2", self._sint_lim)
 
-        for k in range(1, self.shape[2]):
-            self._p_lim[k] = 0.5 * (self.phi[0, 0, k] + self.phi[0, 0, k - 1])
-            # dp = self.phi[0, 0, k] - self.phi[0, 0, k - 1]
-            # self._p_lim[k] = self._p_lim[k - 1] + dp
+        p = self.phi[0, 0, :]
+        self._p_lim[1 : self.shape[2]] = 0.5 * (p[1:] + p[:-1])
+        return
+
+    def _inner_shell(self, dr=None, points_per_bin=8):
+        """
+        Cells of the inner surface of the grid (stellar surface or rmin), used to
+        normalise the density to the mass flux.
+
+        For a structured grid, it is the first radial shell (index 0).
+        For an unstructured grid, it is the mask of the points with r <= r.min() + dr.
+        These points are binned onto equal-area cells of the sphere of radius 1,
+        with on average points_per_bin points per cell (see utils.surface_bins).
+        The mask and the bins are cached for the last (dr, points_per_bin).
+
+        dr              :: width of the inner shell for unstructured grids (Rstar).
+                            If None, twice the mean distance between the points
+                            close to r.min() (see self._inner_spacing).
+        points_per_bin  :: average number of points per surface cell
+        """
+        if self.structured:
+            return 0
+        key = (dr, points_per_bin)
+        if getattr(self, "_shell_key", None) == key:
+            return self._shell_mask
+        if dr is None:
+            dr = 2 * self._inner_spacing()
+        mask = self.r <= self.r.min() + dr
+        Nt = max(1, int(np.sqrt(np.count_nonzero(mask) / points_per_bin / 2)))
+        self._shell_Nbins = 2 * Nt**2
+        self._shell_bins = surface_bins(self.theta[mask], self.phi[mask], Nt, 2 * Nt)
+        self._shell_mask = mask
+        self._shell_key = key
+        return self._shell_mask
+
+    def _inner_spacing(self, npts=1000):
+        """
+        Mean distance (Rstar) between the points of an unstructured grid close to
+        its inner surface, from the density of the npts points of lowest r
+        (assumed to fill a shell of radius r.min()).
+        """
+        rs = np.partition(self.r, min(npts, self.r.size - 1))[: npts + 1]
+        rs.sort()
+        rmin, h = rs[0], rs[-1] - rs[0]
+        if h <= 0:
+            return 0.0
+        density = (rs.size - 1) / (4 * np.pi * rmin**2 * h)
+        return density ** (-1 / 3)
+
+    def _shell_integral(self, q, min_coverage=0.9):
+        """
+        Integral of q over the inner surface of the grid (see self._inner_shell).
+        q is defined on the cells of the inner shell. For an unstructured grid,
+        a ValueError is raised if less than min_coverage of the surface is
+        covered by the points (see utils.surface_integral_binned).
+
+        return :: same as utils.surface_integral
+        """
+        if self.structured:
+            return surface_integral(self.grid[1], self.grid[2], q, axi_sym=self._2d)
+        return surface_integral_binned(
+            self._shell_bins, self._shell_Nbins, q, min_coverage=min_coverage
+        )
+
+    def _equatorial_symmetry(self):
+        """
+        True if the theta axis of a structured grid is symmetric about the
+        midplane (theta[j] + theta[Nt - 1 - j] = pi). The cell j of the northern
+        half is then the mirror of the cell Nt - 1 - j of the southern half.
+        """
+        if not self.structured or self.shape[1] < 2:
+            return False
+        t = self.grid[1]
+        return np.allclose(t + t[::-1], np.pi, rtol=0, atol=1e-10)
+
+    def _north_cells(self, lsym):
+        """
+        Index (slice) of the northern half of a structured grid, including the
+        midplane if Nt is odd, or of the whole grid if not lsym.
+        """
+        if not lsym:
+            return Ellipsis
+        return (slice(None), slice(0, (self.shape[1] + 1) // 2))
+
+    def _mirror_cells(self, idx):
+        """
+        From the indices idx of cells in the northern half, the selection of those
+        not in the midplane and the indices of their mirror cells in the southern half.
+        """
+        sel = idx[1] < self.shape[1] // 2
+        idx_m = (idx[0][sel], self.shape[1] - 1 - idx[1][sel], idx[2][sel])
+        return sel, idx_m
+
+    def _write_mirrored(self, q, idx, mirror, values, sign=1):
+        """
+        Write values in the cells idx of q (array of the shape of the grid) and
+        sign * values in their mirror cells (see self._mirror_cells), if mirror is not None.
+        """
+        q[idx] = values
+        if mirror is not None:
+            sel, idx_m = mirror
+            if np.ndim(values):
+                values = values[sel]
+            q[idx_m] = sign * values
+        return
+
+    def _phase_trig(self, phase):
+        """
+        sin and cos of phi - phase, the azimuth of the cells in the frame of a dipole
+        rotated by phase (radians, see self.rotate_phase).
+        """
+        if np.mod(phase, 2 * np.pi) == 0:
+            return self._sp, self._cp
+        sp = self._sp * np.cos(phase) - self._cp * np.sin(phase)
+        cp = self._cp * np.cos(phase) + self._sp * np.sin(phase)
+        return sp, cp
+
+    def _foot_radius(self, beta, phase=0.0):
+        """
+        Radius r0 (Rstar) and azimuth phi0 (in the frame of the dipole), at the
+        magnetic equator, of the dipole field line passing by each cell.
+        They depend only on the coordinates, on the obliquity beta (degrees)
+        and on the rotational phase of the dipole (radians, see self.rotate_phase),
+        hence are cached. Only the last (beta, phase) is kept, so that a sweep in
+        beta on one grid does not accumulate full-grid arrays.
+
+        return :: r0, phi0 (arrays of the shape of the grid)
+        """
+        try:
+            return self._foot_cache[(beta, phase)]
+        except KeyError:
+            pass
+        sp, cp = self._phase_trig(phase)
+        r0, phi0 = dipole_foot_point(self.r, self._st, self._ct, sp, cp, beta)
+        self._foot_cache.clear()
+        self._foot_cache[(beta, phase)] = (r0, phi0)
+        return r0, phi0
+
+    def _zeros(self, ncomp=0, dtype=float):
+        """
+        Field of zeros in the memory layout of the grid (self.order), of shape
+        self.shape, or (ncomp,) + self.shape for a vector field (each component
+        contiguous).
+        """
+        shape = ((ncomp,) if ncomp else ()) + tuple(self.shape)
+        if self.order == "C" or not self.structured:
+            return np.zeros(shape, dtype=dtype)
+        # (Np, Nt, Nr) buffer, indexed as (Nr, Nt, Np)
+        q = np.zeros(shape[:-3] + self.shape[::-1], dtype=dtype)
+        return q.transpose(tuple(range(q.ndim - 3)) + (-1, -2, -3))
+
+    def _layout(self, q):
+        """
+        q (field or vector field) in the memory layout of the grid, copied only
+        if needed.
+        """
+        if self.order == "C" or not self.structured:
+            return q
+        if q.T.flags.c_contiguous or (q.ndim == 4 and q[0].T.flags.c_contiguous):
+            return q
+        out = self._zeros(q.shape[0] if q.ndim == 4 else 0, dtype=q.dtype)
+        out[...] = q
+        return out
+
+    def _dead_zone(self, star, rmi, beta, V0=0):
+        """
+        Cells of the dead zone, the closed field lines with a foot radius lower
+        than rmi, and the square of their velocity (m^2/s^2), stored
+        in self._ldead_zone and self._v2_dead_zone, at the rotational phase of
+        the model (self._phase).
+        """
+        r0, _ = self._foot_radius(beta, self._phase)
+        ldz = r0 < rmi
+        self._ldead_zone = ldz
+        self._v2_dead_zone = np.zeros(self.shape)
+        self._v2_dead_zone[ldz] = abs(
+            2 * Ggrav * star.M_kg / star.R_m * (1 / self.r[ldz] - 1 / r0[ldz])
+            + (self.R[ldz] ** 2 - r0[ldz] ** 2) * (star.R_m * star._omega) ** 2
+            + V0**2
+        )
+        return
+
+    def _check_progress(self, done, total):
+        """
+        Report the progress of the innermost builder of this grid running in the
+        current thread, if it has a progress callback, and raise BuildCancelled if
+        the cancellation token of any builder of this grid running is set.
+        """
+        frames = [f for f in _build_stack() if f[0] is self]
+        for _, _, cancel in frames:
+            if cancel is not None and cancel.is_set():
+                raise BuildCancelled("cancelled after %d/%d cells" % (done, total))
+        if frames and frames[-1][1] is not None:
+            frames[-1][1](done, total)
+        return
+
+    def _parallel(self, func, N):
+        """
+        Call func(sl) for slices sl splitting range(N), on self.nthreads threads
+        (numpy releases the GIL in its array operations).
+        With N = self.shape[0], the slices are radial slabs of a structured grid.
+        func must write its results into preallocated arrays, in the cells of its
+        slice only, so that the results do not depend on the number of threads.
+        """
+        nthreads = max(1, self.nthreads)
+        n = max(1, -(-N // (4 * nthreads)))
+        slices = [slice(s, min(s + n, N)) for s in range(0, N, n)]
+        if nthreads > 1 and len(slices) > 1:
+            # the builders running in this thread, for the progress and the
+            # cancellation checks of func in the worker threads
+            frames = list(_build_stack())
+
+            def _run(sl):
+                stack = _build_stack()
+                n0 = len(stack)
+                stack.extend(frames)
+                try:
+                    func(sl)
+                finally:
+                    del stack[n0:]
+                return
+
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                list(executor.map(_run, slices))
+        else:
+            for sl in slices:
+                func(sl)
+        return
+
+    def _fields_changed(self):
+        """
+        Reset what depends on the values of the fields (not on the coordinates).
+        Called after each add_* method.
+        """
+        self._interp_cache = {}
+        return
+
+    def _cached(self, key, field):
+        """
+        Value cached in self._interp_cache under key, computed from the field (name
+        of an attribute), or None if the field has changed since: the entries are
+        valid as long as the attribute is the same array with the same content
+        (checksum). Direct edits of the arrays (e.g., grid.rho[mask] = 0) are
+        thus taken into account, at the cost of a checksum of the field per lookup.
+
+        return :: value, fingerprint of the field (to store a new value, see
+                  self._cache)
+        """
+        q = getattr(self, field)
+        fingerprint = (q, zlib.adler32(memoryview(q.ravel(order="K"))))
+        entry = self._interp_cache.get(key)
+        if entry is not None and entry[0][0] is q and entry[0][1] == fingerprint[1]:
+            return entry[1], fingerprint
+        return None, fingerprint
+
+    def _cache(self, key, fingerprint, value):
+        self._interp_cache[key] = (fingerprint, value)
+        return value
+
+    def _get_kdtree(self):
+        """
+        KD-tree of the cartesian coordinates (x, y, z) of the cells.
+        Built once, the coordinates of a grid do not change.
+        """
+        try:
+            return self._kdtree
+        except AttributeError:
+            pass
+        self._kdtree = cKDTree(
+            np.array([self.x.reshape(-1), self.y.reshape(-1), self.z.reshape(-1)]).T
+        )
+        return self._kdtree
+
+    def _get_interpolator(self, field):
+        """
+        RegularGridInterpolator of the field (name of the attribute) on the
+        structured axes (r, theta, phi), periodic in phi. The axis phi
+        is dropped for 2.5d grids.
+        Vector fields are interpolated component-wise (last dimension).
+        Cached until the field changes (see self._cached).
+        """
+        interp, fingerprint = self._cached(field, field)
+        if interp is not None:
+            return interp
+
+        q = fingerprint[0]
+        values = np.moveaxis(q.reshape(-1, *self.shape), 0, -1)
+        axes = list(self.grid)
+        if self._2d:
+            values = values[:, :, 0]
+            axes = axes[:2]
+        else:
+            p = axes[2]
+            # one ghost slice at each side for periodicity
+            if p[-1] - p[0] < 2 * np.pi:
+                values = np.concatenate(
+                    (values[:, :, -1:], values, values[:, :, :1]), axis=2
+                )
+                p = np.concatenate(([p[-1] - 2 * np.pi], p, [p[0] + 2 * np.pi]))
+            axes[2] = p
+        method = ("linear", "nearest")[field == "regions"]
+        interp = RegularGridInterpolator(
+            axes, values, method=method, bounds_error=False, fill_value=None
+        )
+        return self._cache(field, fingerprint, interp)
+
+    def resample_to(
+        self,
+        other,
+        fields=["rho", "T", "ne", "v", "B", "regions"],
+        chunk_size=2**18,
+        nthreads=1,
+    ):
+        """
+        Map the fields of this grid onto the cells of another Grid() instance.
+
+        For a structured grid, the fields are linearly interpolated in
+        (r, theta, phi) (nearest for the regions). For an unstructured grid,
+        the value of the nearest point (KD-tree in cartesian coordinates) is used.
+        Interpolators and KD-tree are cached on this grid, the interpolators until
+        the fields change, direct edits of the arrays included (see self._cached).
+        Vector fields (v, B) are interpolated component-wise in the local
+        spherical basis. Cells of other outside [r.min(), r.max()] of this
+        grid are transparent.
+
+        other       :: an instance of Grid(). Its fields are replaced.
+        fields      :: list of the fields (attributes) to map.
+        chunk_size  :: number of cells of other processed at once.
+        nthreads    :: number of threads processing the chunks.
+        """
+        Nc = other.r.size
+        tr = other.r.reshape(-1)
+        rmin, rmax = self.r.min(), self.r.max()
+
+        if self.structured:
+            interps = {f: self._get_interpolator(f) for f in fields}
+            tmin, tmax = self.grid[1].min(), self.grid[1].max()
+            p0 = interps[fields[0]].grid[-1][0]
+        else:
+            tree = self._get_kdtree()
+            src = {f: getattr(self, f).reshape(-1, self.r.size) for f in fields}
+
+        out = {
+            f: np.zeros(
+                (getattr(other, f).size // Nc, Nc), dtype=getattr(other, f).dtype
+            )
+            for f in fields
+        }
+
+        def _chunk(s):
+            e = min(s + chunk_size, Nc)
+            inside = (tr[s:e] >= rmin) * (tr[s:e] <= rmax)
+            if self.structured:
+                pts = [
+                    tr[s:e],
+                    np.clip(other.theta.reshape(-1)[s:e], tmin, tmax),
+                ]
+                if not self._2d:
+                    pts.append(p0 + np.mod(other.phi.reshape(-1)[s:e] - p0, 2 * np.pi))
+                pts = np.array(pts).T
+                for f in fields:
+                    out[f][:, s:e] = (
+                        interps[f](pts).reshape(e - s, -1) * inside[:, None]
+                    ).T
+            else:
+                pts = np.array(
+                    [
+                        other.x.reshape(-1)[s:e],
+                        other.y.reshape(-1)[s:e],
+                        other.z.reshape(-1)[s:e],
+                    ]
+                ).T
+                ind = tree.query(pts)[1]
+                for f in fields:
+                    out[f][:, s:e] = src[f][:, ind] * inside
+            return
+
+        chunks = range(0, Nc, chunk_size)
+        if nthreads > 1:
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                list(executor.map(_chunk, chunks))
+        else:
+            for s in chunks:
+                _chunk(s)
+
+        for f in fields:
+            setattr(other, f, other._layout(out[f].reshape(getattr(other, f).shape)))
+        other.Rmax = max(other.Rmax, self.Rmax)
+        other._fields_changed()
+        return
+
+    def refine(self, factor=2, rmax=None):
+        """
+        Nested patch: a finer structured grid covering the radial cells of this
+        grid with r <= rmax, and the whole theta and phi ranges. Along each axis,
+        factor - 1 points are inserted between consecutive centres, so the
+        patch keeps the centres of this grid (in particular the inner shell
+        used to normalise the density).
+
+        The builders are run on the patch as on any grid, then its fields are
+        projected onto this grid (the export mesh) by self.project(patch).
+
+        factor  :: refinement factor, int or (fr, ft, fp). fp is 1 for 2.5d grids.
+        rmax    :: outer radius of the patch (Rstar). Defaults to the whole grid.
+
+        return :: an instance of Grid()
+        """
+        if not self.structured:
+            raise NotImplementedError("refine requires a structured grid.")
+        fr, ft, fp = np.broadcast_to(factor, 3)
+        if self._2d:
+            fp = 1
+        r, t, p = self.grid
+        # the patch axes (_refine_axis) and the lookup of the parent cells
+        # (searchsorted on the cell limits) need ascending axes.
+        if any(np.any(np.diff(x) <= 0) for x in (r, t, p)):
+            raise ValueError("refine requires ascending r, theta and phi axes.")
+        n = r.size if rmax is None else max(1, np.count_nonzero(r <= rmax))
+        # the centre of the first radial cell not covered closes the patch.
+        rr = _refine_axis(r[: min(n + 1, r.size)], fr)
+        tt = _refine_axis(t, ft)
+        pp = _refine_axis(p, fp, periodic=True)
+        patch = Grid(*np.meshgrid(rr, tt, pp, indexing="ij"), order=self.order)
+
+        # index of the cell of this grid containing each cell of the patch,
+        # -1 for the radial cells not covered.
+        rl, tl, pl = self._cells_limits()
+        ir = np.searchsorted(rl, rr, side="right") - 1
+        ir[ir >= n] = -1
+        it = np.clip(np.searchsorted(tl, tt, side="right") - 1, 0, t.size - 1)
+        ip = np.searchsorted(pl, pl[0] + np.mod(pp - pl[0], 2 * np.pi), side="right")
+        ip = np.clip(ip - 1, 0, p.size - 1)
+        patch._parent = (self.shape, ir, it, ip)
+        return patch
+
+    def project(self, patch):
+        """
+        Replace the fields of the cells of this grid covered by a patch
+        (see self.refine) by the average of the fields of the patch.
+
+        The density (and ne, B) are averaged over the volume of the cells of the
+        patch, so the mass is conserved up to the difference between that volume
+        and the volume of the cell (the cells of the patch do not exactly tile
+        those of this grid, e.g. at the edges of the axes). The temperature and
+        the velocity are averaged over the mass (over the volume where there is
+        no mass). A cell takes the non-transparent region with the largest volume
+        in it, if any.
+        """
+        shape, ir, it, ip = patch._parent
+        if tuple(shape) != tuple(self.shape):
+            raise ValueError("The patch was not refined from this grid.")
+        Np, Nt = self.shape[2], self.shape[1]
+        idx = (ir[:, None, None] * Nt + it[None, :, None]) * Np + ip[None, None, :]
+        sel = np.broadcast_to(ir[:, None, None] >= 0, patch.shape)
+        idx = idx[sel]
+        vol = np.broadcast_to(patch.volume, patch.shape)[sel]
+        mass = patch.rho[sel] * vol
+
+        def _sum(w):
+            return np.bincount(idx, weights=w, minlength=self.Ncells)
+
+        V = _sum(vol)
+        M = _sum(mass)
+        cover = V > 0
+        lmass = M[cover] > 0
+
+        def _mean(q, mass_weighted):
+            out = _sum(q * vol)[cover] / V[cover]
+            if mass_weighted:
+                out[lmass] = _sum(q * mass)[cover][lmass] / M[cover][lmass]
+            return out
+
+        # boolean indexing (in C order whatever the layout of the fields)
+        lcover = cover.reshape(self.shape)
+        self.rho[lcover] = M[cover] / V[cover]
+        self.ne[lcover] = _mean(patch.ne[sel], False)
+        self.T[lcover] = _mean(patch.T[sel], True)
+        for i in range(3):
+            self.v[i][lcover] = _mean(patch.v[i][sel], True)
+            self.B[i][lcover] = _mean(patch.B[i][sel], False)
+
+        reg = patch.regions[sel]
+        regions = np.zeros(self.Ncells, dtype=self.regions.dtype)
+        vmax = np.zeros(self.Ncells)
+        for ireg in np.unique(reg[reg != 0]):
+            vreg = _sum(vol * (reg == ireg))
+            lmax = vreg > vmax
+            regions[lmax] = ireg
+            vmax[lmax] = vreg[lmax]
+        self.regions[lcover] = regions[cover]
+
+        self.Rmax = max(self.Rmax, patch.Rmax)
+        self._fields_changed()
+        return
+
+    def _sample_cartesian(self, field, x, y, z):
+        """
+        Values of the scalar field (name of an attribute) at the cartesian
+        points (x, y, z) (Rstar), 0 outside [r.min(), r.max()]. Linear
+        interpolation in (r, theta, phi) for a structured grid
+        (see self._get_interpolator), nearest point otherwise.
+        If the grid only covers the northern hemisphere (theta <= pi/2, 2d models),
+        the southern points take the values of their mirror points.
+        """
+        r = np.sqrt(x**2 + y**2 + z**2)
+        inside = (r >= self.r.min()) * (r <= self.r.max())
+        values = np.zeros(r.shape)
+        if not np.any(inside):
+            return values
+        if self.theta.max() <= np.pi / 2:
+            z = abs(z)
+        if self.structured:
+            interp = self._get_interpolator(field)
+            t = self.grid[1]
+            pts = [
+                r[inside],
+                np.clip(np.arccos(z[inside] / r[inside]), t.min(), t.max()),
+            ]
+            if not self._2d:
+                p0 = interp.grid[-1][0]
+                p = np.arctan2(y[inside], x[inside])
+                pts.append(p0 + np.mod(p - p0, 2 * np.pi))
+            values[inside] = interp(np.array(pts).T)[:, 0]
+        else:
+            pts = np.array([x[inside], y[inside], z[inside]]).T
+            ind = self._get_kdtree().query(pts)[1]
+            values[inside] = getattr(self, field).reshape(-1)[ind]
+        return values
+
+    def projected_map(
+        self,
+        incl=0.0,
+        phase=0.0,
+        quantity="rho",
+        Npix=128,
+        Rmax=None,
+        Ns=None,
+        chunk_size=2**20,
+        nthreads=1,
+    ):
+        """
+        Map of a quantity integrated along parallel lines of sight through the grid,
+        for a quick look at a model.
+
+        The rays are marched with Ns samples each from -Rmax to Rmax, the fields are
+        interpolated at the samples (see self._sample_cartesian). The samples
+        behind the star (r < 1) are hidden.
+
+        incl        :: inclination of the line of sight from the rotation axis (degrees)
+        phase       :: rotational phase (fraction of the period). The observer is at
+                        the azimuth -2 pi phase in the frame of the star.
+        quantity    :: "rho" (column density), "rhoT" (rho * T) or "rho2" (rho**2,
+                        emission measure proxy)
+        Npix        :: number of pixels along each axis of the image
+        Rmax        :: half-size of the image and of the rays (Rstar). Defaults to r.max().
+        Ns          :: number of samples along each ray. Defaults to one sample per
+                        smallest cell size along r and theta (structured grid), and
+                        at least 2 * Npix.
+        chunk_size  :: maximum number of samples processed at once
+        nthreads    :: number of threads processing the chunks
+
+        return :: image (Npix, Npix) in units of the quantity times Rstar,
+                  [i, j] is at (u[j], v[i]), and the extent (-Rmax, Rmax, -Rmax, Rmax).
+                  v is the projection of the rotation axis on the sky.
+        """
+        fields = {"rho": ("rho",), "rhoT": ("rho", "T"), "rho2": ("rho", "rho")}
+        if quantity not in fields:
+            raise ValueError(
+                "quantity must be one of %s (got %s)" % (list(fields), quantity)
+            )
+        if Rmax is None:
+            Rmax = self.r.max()
+        if Ns is None:
+            Ns = 2 * Npix
+            if self.structured:
+                # resolve the smallest cells (e.g., the accretion columns at r ~ 1)
+                r, t = self.grid[0], self.grid[1]
+                sizes = []
+                if len(r) > 1:
+                    sizes.append(abs(np.diff(r)).min())
+                if len(t) > 1:
+                    sizes.append(r.min() * abs(np.diff(t)).min())
+                if sizes:
+                    Ns = max(Ns, int(np.ceil(2 * Rmax / min(sizes))))
+        i = np.deg2rad(incl)
+        po = -2 * np.pi * phase
+        # direction of the observer and axes of the image plane
+        n = np.array([np.sin(i) * np.cos(po), np.sin(i) * np.sin(po), np.cos(i)])
+        eu = np.array([-np.sin(po), np.cos(po), 0.0])
+        ev = np.cross(n, eu)
+
+        u = (np.arange(Npix) + 0.5) / Npix * 2 * Rmax - Rmax
+        ds = 2 * Rmax / Ns
+        sa = (np.arange(Ns) + 0.5) * ds - Rmax
+        uu, vv = np.meshgrid(u, u)
+        uu = uu.reshape(-1)
+        vv = vv.reshape(-1)
+        image = np.zeros(Npix * Npix)
+
+        Nrays = max(1, chunk_size // Ns)
+        # build the cached interpolators (or KD-tree) before the threads
+        for f in fields[quantity]:
+            if self.structured:
+                self._get_interpolator(f)
+            else:
+                self._get_kdtree()
+
+        def _chunk(s):
+            e = min(s + Nrays, Npix * Npix)
+            pos = (
+                uu[s:e, None, None] * eu
+                + vv[s:e, None, None] * ev
+                + sa[None, :, None] * n
+            )
+            x, y, z = pos[..., 0], pos[..., 1], pos[..., 2]
+            values = {
+                f: self._sample_cartesian(f, x, y, z) for f in set(fields[quantity])
+            }
+            q = np.prod([values[f] for f in fields[quantity]], axis=0)
+            # occultation by the star
+            b2 = uu[s:e] ** 2 + vv[s:e] ** 2
+            q[(b2[:, None] < 1) * (sa[None, :] < 0)] = 0
+            image[s:e] = q.sum(axis=1) * ds
+            return
+
+        chunks = range(0, Npix * Npix, Nrays)
+        if nthreads > 1:
+            with ThreadPoolExecutor(max_workers=nthreads) as executor:
+                list(executor.map(_chunk, chunks))
+        else:
+            for s in chunks:
+                _chunk(s)
+
+        return image.reshape(Npix, Npix), (-Rmax, Rmax, -Rmax, Rmax)
+
+    def _phase_weights(self, delta_phi):
+        """
+        Indices and weights of the periodic linear interpolation in phi of the
+        values at phi - delta_phi, on the phi axis of a structured grid.
+        Cached per delta_phi (they only depend on the axis).
+
+        return :: i0, i1, w such that q(phi - delta_phi) = (1 - w) * q[..., i0] + w * q[..., i1]
+        """
+        if delta_phi in self._phase_cache:
+            return self._phase_cache[delta_phi]
+        p = self.grid[2]
+        Np = p.size
+        pe = np.append(p, p[0] + 2 * np.pi)
+        pt = p[0] + np.mod(p - delta_phi - p[0], 2 * np.pi)
+        ie = np.clip(np.searchsorted(pe, pt, side="right") - 1, 0, Np - 1)
+        w = (pt - pe[ie]) / (pe[ie + 1] - pe[ie])
+        # exact shifts (uniform axis and delta_phi multiple of the step)
+        eps = 1e-9
+        ie[w > 1 - eps] += 1
+        w[(w < eps) | (w > 1 - eps)] = 0
+        self._phase_cache[delta_phi] = (ie % Np, (ie + 1) % Np, w)
+        return self._phase_cache[delta_phi]
+
+    @_recorded
+    def rotate_phase(self, delta_phi):
+        """
+        Rotate the model (not the grid) by delta_phi (radians) about the rotation axis,
+        to get the model at another rotational phase without building it again.
+
+        The value in a cell at phi is the one at phi - delta_phi. If the phi axis is
+        uniform and delta_phi is a multiple of its step, this is a cyclic shift of
+        the indices. Otherwise, the fields are linearly interpolated in phi (nearest
+        for the regions), with cached weights (see self._phase_weights).
+        The spherical components of the vector fields (v, B) are invariant by
+        a rotation about z, they are shifted as the scalar fields.
+
+        The rotations are cumulative, self._phase is the total angle. The builders
+        called afterwards build the model at self._phase.
+
+        A 2.5d model is axisymmetric: the rotation is the identity and self._phase
+        is not changed.
+        """
+        if not self.structured:
+            raise NotImplementedError("rotate_phase requires a structured grid.")
+        if self._2d:
+            return
+        self._phase += delta_phi
+        # the foot radii of the dipole depend on the phase (see self._foot_radius)
+        self._foot_cache.clear()
+        i0, i1, w = self._phase_weights(delta_phi)
+        lshift = not np.any(w)
+        # fields and private arrays of the builders depending on phi (the masks
+        # are boolean, they are interpolated as nearest)
+        attrs = ["rho", "T", "ne", "v", "B", "regions"]
+        attrs += ["_laccr", "_ldead_zone", "_v2_dead_zone", "_xp", "_yp", "_zp"]
+        attrs += ["_lmag", "_mcol", "_scol", "_rho_axi"]
+        for attr in attrs:
+            q = getattr(self, attr, None)
+            if q is None:
+                continue
+            if lshift:
+                q = q[..., i0]
+            elif q.dtype.kind in "biu":
+                q = np.where(w < 0.5, q[..., i0], q[..., i1])
+            else:
+                q = (1 - w) * q[..., i0] + w * q[..., i1]
+            if attr in ("rho", "T", "ne", "v", "B", "regions"):
+                q = self._layout(q)
+            setattr(self, attr, q)
+        self._fields_changed()
         return
 
+    @_recorded
     def clean_grid(self, regions_to_clean=[]):
         """
         Clean an Grid instance by setting v, rho, T and Rmax to 0
@@ -266,6 +1267,7 @@ class Grid:
         self.rho[mask] *= 0
         self.T[mask] *= 0
         self.Rmax = 0
+        self._fields_changed()
         return
 
     def _check_overlap(self):
@@ -276,12 +1278,14 @@ class Grid:
         """
         return
 
+    @_builder
     def add_disc(self):
         """
         Dust and gas disc
         """
         return
 
+    @_builder
     def add_dark_disc(self, Rin, dwidth=0, Td=0, wall=False, phi0=0, Rwi=1, Aw=1, Tw=0):
         """
         Optically thick and ultra-cool disc.
@@ -335,6 +1339,7 @@ class Grid:
             self.rho[mask] = 1e-5
         return
 
+    @_builder
     def add_mag(
         self,
         star,
@@ -345,6 +1350,7 @@ class Grid:
         Tmax=8000,
         verbose=False,
         V0=0,
+        Nsurf=0,
     ):
         """
         star    :: An instance of the class Star
@@ -359,6 +1365,10 @@ class Grid:
         verbose :: print info if True
         Tmax    :: value of the temperature maximum in the magnetosphere
         V0      :: value of the velocity at the injection point (m/s)
+        Nsurf   :: if > 0, the mass flux and the shock area are computed on the stellar
+                    surface sampled with Nsurf x 2 Nsurf points, independently of
+                    the grid (see utils.dipole_surface_flux). Otherwise, on the inner
+                    shell of the grid.
         """
         self._beta = beta
         ma = np.deg2rad(self._beta)
@@ -366,12 +1376,11 @@ class Grid:
 
         Rt_on_Rco = (2 / (2 + np.cos(ma) ** 2)) ** (1 / 3)
         if rmo > Rt_on_Rco * star.Rco:
-            print("(ERROR) Outer truncation radius cannot be larger than alpha * Rco !")
-            print(
+            raise ValueError(
+                "Outer truncation radius cannot be larger than alpha * Rco ! "
                 "rmo = %.3f R*; alpha = %.3f; Rco = %.3f R*"
                 % (rmo, Rt_on_Rco, star.Rco)
             )
-            exit()
 
         if self._beta != 0 and self._2d:
             print(
@@ -382,10 +1391,13 @@ class Grid:
         self._Rt = rmi
         self._dr = rmo - rmi
 
+        # azimuth in the frame of the dipole, at the rotational phase of the model
+        # (see self.rotate_phase): the model is built as it is at self._phase.
+        sp, cp = self._phase_trig(self._phase)
         # coordinates tilted about z, in F'
-        self._xp = self.r * (self._cp * self._st * np.cos(ma) - self._ct * np.sin(ma))
-        self._yp = self.r * (self._sp * self._st)
-        self._zp = self.r * (self._cp * self._st * np.sin(ma) + self._ct * np.cos(ma))
+        self._xp = self.r * (cp * self._st * np.cos(ma) - self._ct * np.sin(ma))
+        self._yp = self.r * (sp * self._st)
+        self._zp = self.r * (cp * self._st * np.sin(ma) + self._ct * np.cos(ma))
         Rp = np.sqrt(self._xp**2 + self._yp**2)
 
         cpp = self._xp / Rp
@@ -419,8 +1431,8 @@ class Grid:
         ##### TMP #####
         # ##self._laccr *= cpp * self.z >= 0
         ###############
-        self._ldead_zone = np.zeros(self.shape)
-        self._v2_dead_zone = np.zeros(self.shape)
+        self._dead_zone(star, rmi, self._beta, V0=V0)
+        r0_all, phi0_all = self._foot_radius(self._beta, self._phase)
         # to test
         # check the points for which the field line passing by these points accrete
         v_square = np.zeros(self.shape)
@@ -430,94 +1442,48 @@ class Grid:
         N_fl = 10000
         # record the valid values of R0
         # R0 = np.zeros(self.shape)
-        for k in range(self.shape[2]):
-            for j in range(self.shape[1]):
-                for i in range(self.shape[0]):
-                    tanphi0 = (
-                        np.cos(ma)
-                        * self._st[i, j, k]
-                        * self._sp[i, j, k]
-                        / (
-                            np.cos(ma) * self._st[i, j, k] * self._cp[i, j, k]
-                            - np.sin(ma) * self._ct[i, j, k]
-                        )
-                    )
-                    phi0 = np.arctan(tanphi0)
-                    if self._beta == 0:  # avoid 0 division error
-                        r0 = self.r[i, j, k] / self._st[i, j, k] ** 2
-                        ts = np.arcsin(np.sqrt(self.r[i, j, k] / r0))
-                    else:  # non-zero obliquity
-                        r0 = (
-                            self.r[i, j, k]
-                            * np.sin(phi0) ** 2
-                            / self._st[i, j, k] ** 2
-                            / self._sp[i, j, k] ** 2
-                        )
-                        ts = np.arcsin(
-                            np.sqrt(
-                                self.r[i, j, k]
-                                / r0
-                                * np.sin(phi0) ** 2
-                                / self._sp[i, j, k] ** 2
-                            )
-                        )
-                    if r0 >= rmi and r0 <= rmo:
-                        # R0[i, j, k] = r0
-                        # ts = np.arcsin(
-                        #     np.sqrt(
-                        #         self.r[i, j, k]
-                        #         / r0
-                        #         * np.sin(phi0) ** 2
-                        #         / self._sp[i, j, k] ** 2
-                        #     )
-                        # )
-                        te = np.pi / 2  # * (0.99, 1)[beta == 0]
-                        # if self.z[i, j, k] < 0:
-                        #     ts = np.pi - ts
-                        t_fl = np.linspace(ts, te, N_fl)
-
-                        # build the field line the point (i,j,k) belongs to, from the disc to the stellar surface
-                        y_fl = np.sin(t_fl) ** 2
-                        if self._beta == 0:
-                            r_fl = r0 * y_fl
-                        else:  # non-zero obliquity
-                            r_fl = (
-                                r0 * self._sp[i, j, k] ** 2 / np.sin(phi0) ** 2 * y_fl
-                            )
-                        v2_fl = (
-                            2 * Ggrav * star.M_kg / star.R_m * (1 / r_fl - 1 / r0)
-                            + (y_fl * r_fl**2 - r0**2)
-                            * (star.R_m * star._omega) ** 2
-                            + V0**2
-                        )
-                        # compute invariant # TO DO!
-                        # need B field because need v
-                        # e_minus_lomegastar = self._calc_invariant()
-
-                        if np.alltrue(v2_fl > 0):
-                            v_square[i, j, k] = (
-                                2
-                                * Ggrav
-                                * star.M_kg
-                                / star.R_m
-                                * (1 / self.r[i, j, k] - 1 / r0)
-                                + (self.R[i, j, k] ** 2 - r0**2)
-                                * (star.R_m * star._omega) ** 2
-                                + V0**2
-                            )
-                    elif r0 < rmi:
-                        self._ldead_zone[i, j, k] = 1
-                        self._v2_dead_zone[i, j, k] = abs(
-                            2
-                            * Ggrav
-                            * star.M_kg
-                            / star.R_m
-                            * (1 / self.r[i, j, k] - 1 / r0)
-                            + (self.R[i, j, k] ** 2 - r0**2)
-                            * (star.R_m * star._omega) ** 2
-                            + V0**2
-                        )
+        # Axisymmetric model (beta = 0) on a 3d structured grid: the field lines
+        # do not depend on phi. They are computed on the plane phi = phi[0] only,
+        # and the results broadcast to the other phi.
+        laxi = self._beta == 0 and self.structured and not self._2d
+        # Moreover, if theta is symmetric about the midplane, only the northern half
+        # is computed and mirrored.
+        lsym = self._beta == 0 and self._equatorial_symmetry()
+        loop_shape = list(self.shape)
+        if laxi:
+            loop_shape[2] = 1
+        if lsym:
+            loop_shape[1] = (self.shape[1] + 1) // 2
+        # cells whose field line is anchored in the disc between rmi and rmo,
+        # any grid shape (structured or unstructured)
+        box = tuple(slice(0, n) for n in loop_shape)
+        r0_box = r0_all[box]
+        icol = np.nonzero((r0_box >= rmi) * (r0_box <= rmo))
+        # check the field line of each of them, by chunks
+        chunk = max(1, 2**20 // N_fl)
+        for s in range(0, icol[0].size, chunk):
+            self._check_progress(s * self.Ncells // max(1, icol[0].size), self.Ncells)
+            ijk = tuple(i[s : s + chunk] for i in icol)
+            v_square[ijk] = field_line_v2(
+                self.r[ijk],
+                self._st[ijk],
+                sp[ijk],
+                r0_all[ijk],
+                phi0_all[ijk],
+                self._beta,
+                star,
+                V0=V0,
+                N_fl=N_fl,
+            )
+            # compute invariant # TO DO!
+            # need B field because need v
+            # e_minus_lomegastar = self._calc_invariant()
         #############################################################################
+        if lsym:
+            Nt = self.shape[1]
+            v_square[:, (Nt + 1) // 2 :] = v_square[:, Nt // 2 - 1 :: -1]
+        if laxi:
+            v_square[:] = v_square[:, :, :1]
 
         # ###self._laccr = (v_square >= 0) * (r0 >= rmi) * (r0 <= rmo)
         self._laccr = v_square > 0
@@ -527,17 +1493,15 @@ class Grid:
         # m is the magnetic moment at the pole and at r=1.
         # - because vr must be negative around the pole. x2 because _m0 is at the equator.
         m = -2.0 * star._m0 / self.r[self._laccr] ** 3
-        self.B = np.zeros(self.v.shape)
+        self.B = self._zeros(3)
         # (Br, Btheta, Bphi)
         self.B[0, self._laccr] = (
-            m * (self._st * self._cp * np.sin(ma) + self._ct * np.cos(ma))[self._laccr]
+            m * (self._st * cp * np.sin(ma) + self._ct * np.cos(ma))[self._laccr]
         )
         self.B[1, self._laccr] = (
-            -m
-            / 2
-            * (self._ct * self._cp * np.sin(ma) - self._st * np.cos(ma))[self._laccr]
+            -m / 2 * (self._ct * cp * np.sin(ma) - self._st * np.cos(ma))[self._laccr]
         )
-        self.B[2, self._laccr] = m / 2 * (self._sp * np.sin(ma))[self._laccr]
+        self.B[2, self._laccr] = m / 2 * (sp * np.sin(ma))[self._laccr]
         B = self.get_B_module()
 
         sig_z = self._sign_z[self._laccr]
@@ -579,40 +1543,44 @@ class Grid:
 
         self.rho[self._laccr] = eta * B[self._laccr] / v
         # normalisation of the density
-        if self.structured:
-            # takes values at the stellar surface or at rmin.
-            # multiply mass_flux by rmin**2 ?
-            rhovr = self.rho[0] * self.v[0, 0] * (self.regions[0] == 1)
-            # integrate over the shock area
-            # mass_flux in units of rhovr
-            mass_flux, dOmega = surface_integral(
-                self.grid[1], self.grid[2], -rhovr, axi_sym=self._2d
+        # takes values at the stellar surface or at rmin.
+        # multiply mass_flux by rmin**2 ?
+        shell = self._inner_shell()
+        rhovr = self.rho[shell] * self.v[0][shell] * (self.regions[shell] == 1)
+        # integrate over the shock area
+        # mass_flux in units of rhovr
+        if Nsurf > 0:
+            # on the stellar surface, independently of the grid
+            mass_flux, self._f_shock = dipole_surface_flux(
+                star, rmi, rmo, self._beta, V0, Nt=Nsurf, Np=2 * Nsurf, N_fl=N_fl
             )
-            # similar to
-            # mf = (0.5*(-rhovr[0,1:,1:] - rhovr[0,:-1,:-1]) * abs(ct[:,:-1]) * dp[1:,:]).sum()
-            # with ct = np.diff(self._ct[0],axis=0); dp = np.diff(self.phi[0],axis=1)
-            if verbose:
-                print("dOmega = %.4f" % (dOmega))
-                print("mass flux (before norm) = %.4e [v_r B/v]" % mass_flux)
-            eta = self._Macc / mass_flux / star.R_m**2
+            # dOmega / 4pi as returned by _shell_integral: the quadrature covers
+            # the whole sphere
+            dOmega = 1.0
         else:
-            print("Error unstructured grid not yet")
+            mass_flux, dOmega = self._shell_integral(-rhovr)
+        # similar to
+        # mf = (0.5*(-rhovr[0,1:,1:] - rhovr[0,:-1,:-1]) * abs(ct[:,:-1]) * dp[1:,:]).sum()
+        # with ct = np.diff(self._ct[0],axis=0); dp = np.diff(self.phi[0],axis=1)
+        if verbose:
+            print("dOmega = %.4f" % (dOmega))
+            print("mass flux (before norm) = %.4e [v_r B/v]" % mass_flux)
+        eta = self._Macc / mass_flux / star.R_m**2
         self.rho[self._laccr] *= eta
         # shock area
-        self._f_shock = surface_integral(
-            self.grid[1], self.grid[2], 1.0 * (rhovr < 0), axi_sym=self._2d
-        )[0] / (4 * np.pi)
+        if Nsurf <= 0:
+            self._f_shock = self._shell_integral(1.0 * (rhovr < 0))[0] / (4 * np.pi)
         if verbose:
             print(
                 "The shock covers a fraction  %.3f %s of the stellar surface"
                 % (self._f_shock * 100, "%")
             )
 
-        # recompute mass flux after normalisation
+        # recompute mass flux after normalisation (on the inner shell of the grid,
+        # only a check with Nsurf > 0)
+        min_coverage = 0.9 if Nsurf <= 0 else 0.0
         mass_flux_check = (
-            surface_integral(
-                self.grid[1], self.grid[2], -rhovr * eta, axi_sym=self._2d
-            )[0]
+            self._shell_integral(-rhovr * eta, min_coverage=min_coverage)[0]
             * star.R_m**2
         )
         if verbose:
@@ -621,7 +1589,9 @@ class Grid:
                 % (mass_flux_check / Msun_per_year_to_SI)
             )
             print("(check) Mdot/Mdot_input = %.3f" % (mass_flux_check / self._Macc))
-        if abs(mass_flux_check / self._Macc - 1.0) > 1e-5:
+        # with Nsurf > 0, the mass flux through the inner shell of the grid differs
+        # by the discretisation error of the grid.
+        if Nsurf <= 0 and abs(mass_flux_check / self._Macc - 1.0) > 1e-5:
             print(mass_flux_check, self._Macc)
             print(
                 "WARNING : problem of normalisation of mass flux in self.add_magnetosphere()."
@@ -635,7 +1605,8 @@ class Grid:
 
         return
 
-    def setup_dead_zone(self, star, rho, T):
+    @_builder
+    def setup_dead_zone(self, star, rho, T, rmi=None, beta=None):
         """
         ** building **
         The density and the temperature are assumed to be
@@ -643,15 +1614,23 @@ class Grid:
 
         The dead zone is in solid body rotation only.
 
+        rmi     :: inner radius of the magnetosphere (Rstar). If None, the dead zone
+                    of the last call to add_mag is used.
+        beta    :: obliquity of the magnetic dipole (degrees), if rmi is not None.
+                    Defaults to the one of add_mag, or 0.
         """
-        try:
-            b = np.deg2rad(self._beta)
-        except:
-            print("Cannot add a dead zone if no accreting magnetosphere present!")
-            exit()
-            return
+        if rmi is not None:
+            if beta is None:
+                beta = getattr(self, "_beta", 0.0)
+            self._beta = beta
+            self._dead_zone(star, rmi, beta)
+        elif not hasattr(self, "_ldead_zone"):
+            raise RuntimeError(
+                "Cannot add a dead zone if no accreting magnetosphere present!"
+            )
+        b = np.deg2rad(self._beta)
 
-        ldz = self._ldead_zone > 0
+        ldz = self._ldead_zone.astype(bool)
         # v = np.sqrt(self._v2_dead_zone[ldz])
         # sig_z = self._sign_z[ldz]
         # m = -2.0 * star._m0 / self.r[ldz] ** 3
@@ -670,6 +1649,7 @@ class Grid:
 
         return
 
+    @_builder
     def add_magnetosphere_v1(
         self,
         star,
@@ -720,10 +1700,12 @@ class Grid:
             / np.sqrt(2.0 * Ggrav * star.M_kg)
         )
 
+        # azimuth in the frame of the dipole, at the rotational phase of the model
+        sp, cp = self._phase_trig(self._phase)
         # coordinates tilted about z, in F'
-        self._xp = self.r * (self._cp * self._st * np.cos(ma) - self._ct * np.sin(ma))
-        self._yp = self.r * (self._sp * self._st)
-        self._zp = self.r * (self._cp * self._st * np.sin(ma) + self._ct * np.cos(ma))
+        self._xp = self.r * (cp * self._st * np.cos(ma) - self._ct * np.sin(ma))
+        self._yp = self.r * (sp * self._st)
+        self._zp = self.r * (cp * self._st * np.sin(ma) + self._ct * np.cos(ma))
         Rp = np.sqrt(self._xp**2 + self._yp**2)  # + tiny_val
 
         cpp = self._xp / Rp
@@ -735,7 +1717,10 @@ class Grid:
         yp = stp**2
         # In the Frame of the disc (i.e., not tilted)
         y = self._st**2  # Note: y is 0 if theta = 0 +- pi
-        dtheta = self.grid[1][1] - self.grid[1][0]
+        if self.structured:
+            dtheta = self.grid[1][1] - self.grid[1][0]
+        else:
+            dtheta = self.theta[self.theta % np.pi > 0].min()
         y[self.theta % np.pi == 0.0] = np.sin(dtheta) ** 2
         rM = self.r / y
         rMp = self.r / yp
@@ -775,19 +1760,16 @@ class Grid:
 
         # smaller arrays, only where accretion takes place
         m = star._m0 / self.r[lmag] ** 3  # magnetic moment at r
-        self.B = np.zeros(self.v.shape)
+        self.B = self._zeros(3)
         self.B[0, lmag] = (
             2.0
             * m
-            * (
-                np.cos(ma) * self._ct[lmag]
-                + np.sin(ma) * self._cp[lmag] * self._st[lmag]
-            )
+            * (np.cos(ma) * self._ct[lmag] + np.sin(ma) * cp[lmag] * self._st[lmag])
         )
         self.B[1, lmag] = m * (
-            np.cos(ma) * self._st[lmag] - np.sin(ma) * self._cp[lmag] * self._ct[lmag]
+            np.cos(ma) * self._st[lmag] - np.sin(ma) * cp[lmag] * self._ct[lmag]
         )
-        self.B[2, lmag] = m * np.sin(ma) * self._sp[lmag]
+        self.B[2, lmag] = m * np.sin(ma) * sp[lmag]
         B = self.get_B_module()
 
         sig_z = self._sign_z[lmag]
@@ -804,36 +1786,27 @@ class Grid:
         V = self.get_v_module()
         self.rho[lmag] = B[lmag] / V[lmag]
         # normalisation of the density
-        if self.structured:
-            # takes values at the stellar surface or at rmin.
-            # multiply mass_flux by rmin**2 ?
-            rhovr = self.rho[0] * self.v[0, 0] * (self.regions[0] == 1)
-            # integrate over the shock area
-            # mass_flux in units of rhovr
-            mass_flux, dOmega = surface_integral(
-                self.grid[1], self.grid[2], -rhovr, axi_sym=self._2d
-            )
-            # similar to
-            # mf = (0.5*(-rhovr[0,1:,1:] - rhovr[0,:-1,:-1]) * abs(ct[:,:-1]) * dp[1:,:]).sum()
-            # with ct = np.diff(self._ct[0],axis=0); dp = np.diff(self.phi[0],axis=1)
-            if verbose:
-                print("dOmega = %.4f" % (dOmega))
-                print("mass flux (before norm) = %.4e [v_r B/V]" % mass_flux)
-            rho0 = self._Macc / mass_flux / star.R_m**2
-        else:
-            print("Error unstructured grid not yet")
+        # takes values at the stellar surface or at rmin.
+        # multiply mass_flux by rmin**2 ?
+        shell = self._inner_shell()
+        rhovr = self.rho[shell] * self.v[0][shell] * (self.regions[shell] == 1)
+        # integrate over the shock area
+        # mass_flux in units of rhovr
+        mass_flux, dOmega = self._shell_integral(-rhovr)
+        # similar to
+        # mf = (0.5*(-rhovr[0,1:,1:] - rhovr[0,:-1,:-1]) * abs(ct[:,:-1]) * dp[1:,:]).sum()
+        # with ct = np.diff(self._ct[0],axis=0); dp = np.diff(self.phi[0],axis=1)
+        if verbose:
+            print("dOmega = %.4f" % (dOmega))
+            print("mass flux (before norm) = %.4e [v_r B/V]" % mass_flux)
+        rho0 = self._Macc / mass_flux / star.R_m**2
 
         self.rho[lmag] *= rho0
         vrot = self.r[lmag] * np.sqrt(y[lmag]) * star._veq
         self.v[2, lmag] += vrot
 
         # recompute mass flux after normalisation
-        mass_flux_check = (
-            surface_integral(
-                self.grid[1], self.grid[2], -rhovr * rho0, axi_sym=self._2d
-            )[0]
-            * star.R_m**2
-        )
+        mass_flux_check = self._shell_integral(-rhovr * rho0)[0] * star.R_m**2
         if verbose:
             print(
                 "Mass flux (after norm) = %.4e Msun.yr^-1"
@@ -845,9 +1818,7 @@ class Grid:
             print(
                 "WARNING : problem of normalisation of mass flux in self.add_magnetosphere()."
             )
-        self._f_shock = surface_integral(
-            self.grid[1], self.grid[2], 1.0 * (rhovr < 0), axi_sym=self._2d
-        )[0]
+        self._f_shock = self._shell_integral(1.0 * (rhovr < 0))[0]
 
         # Computes the temperature of the form Lambda_cool = Qheat / nH^2
         Q = B[lmag]
@@ -867,6 +1838,7 @@ class Grid:
 
         return
 
+    @_builder
     def add_disc_wind_knigge95(
         self,
         star,
@@ -908,19 +1880,25 @@ class Grid:
         z_cutoff     :: (bool) if True the wind starts at abs(z) > z_limit (default 0 == midplane).
         """
         Td_min = 100  # K, minimum temperature allowed in the disc
+        # The disc wind is symmetric about the midplane. If the grid is too,
+        # the wind is computed in the northern half only and mirrored.
+        lsym = self._equatorial_symmetry()
+        north = self._north_cells(lsym)
         ## condition to be in the disc wind region ##
-        ldw = (self.R >= Rin * (abs(self.z) + zs) / zs) * (
-            self.R <= Rout * (abs(self.z) + zs) / zs
-        )
+        R = self.R[north]
+        abs_z = abs(self.z[north])
+        ldw = (R >= Rin * (abs_z + zs) / zs) * (R <= Rout * (abs_z + zs) / zs)
         if z_cutoff:
-            ldw *= abs(self.z) >= z_limit
+            ldw *= abs_z >= z_limit
+        ldw = np.nonzero(ldw)
+        mirror = self._mirror_cells(ldw) if lsym else None
         # -> special condition with a cut-off in z
         # ldw = (
         #     (self.R >= Rin * (abs(self.z) + zs) / zs)
         #     * (self.R <= Rout * (abs(self.z) + zs) / zs)
         #     * (abs(self.z) >= z_limit)
         # )  #            * (abs(self.z) / self.R >= z_limit)
-        self.regions[ldw] = 2
+        self._write_mirrored(self.regions, ldw, mirror, 2)
         ## disc wind length scale ##
         Rs = ls * Rin
         Mloss_SI = Mloss * Msun_per_year_to_SI
@@ -932,8 +1910,7 @@ class Grid:
         # proportional R**gamma. therefore, mdot \propto R**p with p = 4 * alpha * gamma
         p_ml = 4.0 * gamma * alpha
         if p_ml > 0:
-            print("(ERROR) p_ml must be negative!")
-            exit()
+            raise ValueError("p_ml = 4 * gamma * alpha must be negative!")
 
         # mloss_surf in kg/s/m2 prop to integral over RdR of R^p_ml to check
         # here it is the inverse of the integral R^(p_ml+1)dR
@@ -944,86 +1921,100 @@ class Grid:
                 (Rout ** (p_ml + 2) - Rin ** (p_ml + 2)) * star.R_m ** (p_ml + 2)
             )  # m^-(p_ml + 2)
         norm_mloss = Mloss_SI * fact  # in kg/s/m^(p_ml + 2)
-        # mass-loss on the disc surface
-        mloss_loc = (
-            norm_mloss * (star.R_m * self.R[ldw]) ** p_ml / (4 * np.pi)
-        )  # kg/s/m^2 : norm_mloss in kg/s/m^(p_ml+2)--> m^p_ml * m^(-p_ml - 2) = m^-2
-
-        ## temperature of the disc ##
-        Tdisc = np.maximum(Td_in * (self.R[ldw] / Rin) ** gamma, Td_min)
-        sound_speed_disc = 1e4 * np.sqrt(Tdisc * 1e-4)  # m/s
-
-        ## velocities ##
-        # the escape velocity is star._vff
-        # for each R found the corresponding wi i.e., R for z=0
-        wi = zs / (abs(self.z[ldw]) + zs) * self.R[ldw]
-        # sqrt(G * M / wi_in_m), _vff is at the stellar surface in m.
-        vkep = (
-            star._vff / np.sqrt(2.0) / np.sqrt(wi)
-        )  # keplerian velocity express from escape velocity
-        vphi = vkep * (wi / self.R[ldw])  # angular momentum conservation along z
-
-        # distance from the source point where the field lines diverge
-        q = np.sqrt(self.R**2 + (abs(self.z) + zs) ** 2)[ldw]
-        cos_delta = (abs(self.z)[ldw] + zs) / q
-        l = q - zs / cos_delta
-        vesc = star._vff / np.sqrt(self.R[ldw])
-        cs = sound_speed_disc  # 1e4 * (Rin / wi) ** 0.5  # m/s
-        vq = cs + (fesc * vesc - cs) * (1.0 - Rs / (l + Rs)) ** beta
-
-        # beta for each field lines, such that at z_limit, vq = 200 km/s
-        # r0 = np.sqrt((q - l) ** 2 - zs**2)
-        # l0 = np.sqrt(r0**2 + (z_limit + zs) ** 2) * (1.0 - zs / (z_limit + zs))
-        # y = Rs / (Rs + l0)
-        # beta_R0 = np.log((200e3 - cs) / (fesc * vesc - cs)) / np.log(1 - y)
-        # print(beta_R0)
-        # print(cs + (fesc * vesc - cs) * (1.0 - Rs / (l0 + Rs)) ** beta_R0)
-        # vq = cs + (fesc * vesc - cs) * (1.0 - Rs / (l + Rs)) ** beta_R0
-
-        ########################################################################
-        # needed because oorigin in z shifted by zs #
-        rp = np.sqrt(
-            self.x[ldw] ** 2
-            + self.y[ldw] ** 2
-            + (self.z[ldw] + np.sign(self.z[ldw]) * zs) ** 2
-        )
-        tdw = np.arccos((np.abs(self.z[ldw]) + zs) / rp)
-        pdw = self.phi[ldw]
-        vx = vq * np.sin(tdw) * np.cos(pdw) - vphi * np.sin(pdw)
-        vy = vq * np.sin(tdw) * np.sin(pdw) + vphi * np.cos(pdw)
-        vz = np.sign(self.z[ldw]) * vq * np.cos(tdw)
-        self.v[0, ldw], self.v[1, ldw], self.v[2, ldw] = cartesian_to_spherical(
-            vx,
-            vy,
-            vz,
-            self._ct[ldw],
-            self._st[ldw],
-            self._cp[ldw],
-            self._sp[ldw],
-        )
-        ########################################################################
-
-        ## density ##
-        rho_dw = mloss_loc / (vq * cos_delta) * (zs / (q * cos_delta)) ** 2  # kg/m3
-        self.rho[ldw] = rho_dw
 
-        ## temperature ##
-        self.T[ldw] = Tmax
-        if z_cutoff:
+        # by chunks of the cells of the wind, i.e. radial slabs (see self._parallel)
+        def _chunk(sl):
+            self._check_progress(sl.start * self.Ncells // ldw[0].size, self.Ncells)
+            idx = tuple(i[sl] for i in ldw)
+            mir = self._mirror_cells(idx) if lsym else None
+            # mass-loss on the disc surface
+            mloss_loc = (
+                norm_mloss * (star.R_m * self.R[idx]) ** p_ml / (4 * np.pi)
+            )  # kg/s/m^2 : norm_mloss in kg/s/m^(p_ml+2)--> m^p_ml * m^(-p_ml - 2) = m^-2
+
+            ## temperature of the disc ##
+            Tdisc = np.maximum(Td_in * (self.R[idx] / Rin) ** gamma, Td_min)
+            sound_speed_disc = 1e4 * np.sqrt(Tdisc * 1e-4)  # m/s
+
+            ## velocities ##
+            # the escape velocity is star._vff
+            # for each R found the corresponding wi i.e., R for z=0
+            wi = zs / (abs(self.z[idx]) + zs) * self.R[idx]
+            # sqrt(G * M / wi_in_m), _vff is at the stellar surface in m.
+            vkep = (
+                star._vff / np.sqrt(2.0) / np.sqrt(wi)
+            )  # keplerian velocity express from escape velocity
+            vphi = vkep * (wi / self.R[idx])  # angular momentum conservation along z
+
+            # distance from the source point where the field lines diverge
+            q = np.sqrt(self.R[idx] ** 2 + (abs(self.z[idx]) + zs) ** 2)
+            cos_delta = (abs(self.z[idx]) + zs) / q
+            l = q - zs / cos_delta
+            vesc = star._vff / np.sqrt(self.R[idx])
+            cs = sound_speed_disc  # 1e4 * (Rin / wi) ** 0.5  # m/s
+            vq = cs + (fesc * vesc - cs) * (1.0 - Rs / (l + Rs)) ** beta
+
+            # beta for each field lines, such that at z_limit, vq = 200 km/s
+            # r0 = np.sqrt((q - l) ** 2 - zs**2)
+            # l0 = np.sqrt(r0**2 + (z_limit + zs) ** 2) * (1.0 - zs / (z_limit + zs))
+            # y = Rs / (Rs + l0)
+            # beta_R0 = np.log((200e3 - cs) / (fesc * vesc - cs)) / np.log(1 - y)
+            # print(beta_R0)
+            # print(cs + (fesc * vesc - cs) * (1.0 - Rs / (l0 + Rs)) ** beta_R0)
+            # vq = cs + (fesc * vesc - cs) * (1.0 - Rs / (l + Rs)) ** beta_R0
+
+            ########################################################################
+            # needed because oorigin in z shifted by zs #
+            rp = np.sqrt(
+                self.x[idx] ** 2
+                + self.y[idx] ** 2
+                + (self.z[idx] + np.sign(self.z[idx]) * zs) ** 2
+            )
+            tdw = np.arccos((np.abs(self.z[idx]) + zs) / rp)
+            pdw = self.phi[idx]
+            vx = vq * np.sin(tdw) * np.cos(pdw) - vphi * np.sin(pdw)
+            vy = vq * np.sin(tdw) * np.sin(pdw) + vphi * np.cos(pdw)
+            vz = np.sign(self.z[idx]) * vq * np.cos(tdw)
+            vr, vt, vp = cartesian_to_spherical(
+                vx,
+                vy,
+                vz,
+                self._ct[idx],
+                self._st[idx],
+                self._cp[idx],
+                self._sp[idx],
+            )
+            # v_theta changes sign in the southern half
+            self._write_mirrored(self.v[0], idx, mir, vr)
+            self._write_mirrored(self.v[1], idx, mir, vt, sign=-1)
+            self._write_mirrored(self.v[2], idx, mir, vp)
+            ########################################################################
+
+            ## density ##
+            rho_dw = mloss_loc / (vq * cos_delta) * (zs / (q * cos_delta)) ** 2  # kg/m3
+            self._write_mirrored(self.rho, idx, mir, rho_dw)
+
+            ## temperature ##
+            self._write_mirrored(self.T, idx, mir, Tmax)
+            if z_cutoff:
+                return
+
+            zz0 = z_limit  # / np.sqrt((q - l) ** 2 - zs**2)
+            if scale_as_zoR0:
+                zz = self.z[idx] / np.sqrt((q - l) ** 2 - zs**2)  # / self.R[idx]
+            # print("R0=",np.sqrt((q - l) ** 2 - zs**2))
+            # z_limit / R0
+            else:
+                zz = self.z[idx]
+            tt = np.minimum((Tmax - Tdisc) * (abs(zz) / zz0) ** beta_temp + Tdisc, Tmax)
+            self._write_mirrored(self.T, idx, mir, tt)
             return
 
-        zz0 = z_limit  # / np.sqrt((q - l) ** 2 - zs**2)
-        if scale_as_zoR0:
-            zz = self.z[ldw] / np.sqrt((q - l) ** 2 - zs**2)  # / self.R[ldw]
-        # print("R0=",np.sqrt((q - l) ** 2 - zs**2))
-        # z_limit / R0
-        else:
-            zz = self.z[ldw]
-        tt = np.minimum((Tmax - Tdisc) * (abs(zz) / zz0) ** beta_temp + Tdisc, Tmax)
-        self.T[ldw] = tt
+        self._parallel(_chunk, ldw[0].size)
 
         return
 
+    @_builder
     def add_disc_wind_BP82(self, star):
         """
         Disc wind model of Blandford & Payne 1982
@@ -1032,6 +2023,7 @@ class Grid:
 
         return
 
+    @_builder
     def add_disc_wind(
         self,
         star,
@@ -1184,6 +2176,7 @@ class Grid:
 
         return
 
+    @_builder
     def add_conical_stellar_wind(
         self, star, Rej=1, Mloss=1e-8, thetao=30, v0=0, vinf=1e6, beta=0.5, Tmax=1e4
     ):
@@ -1204,23 +2197,31 @@ class Grid:
         oa = min(np.deg2rad(thetao), np.pi / 2)
         cos_top = np.cos(oa)
 
-        lsw = (self.r > Rej) * (np.abs(self._ct) > cos_top)
-        self.regions[lsw] = 5
-
         Mloss_SI = Mloss * Msun_per_year_to_SI
 
-        vr = (vinf - v0) * (1 - Rej / self.r[lsw]) ** beta + v0  # m/s
-        # 4*pi*star.R_m^2
-        rho_sw = Mloss_SI / (star.S_m2 * self.r[lsw] ** 2 * (1 - cos_top))
+        # by radial slabs (see self._parallel)
+        def _slab(sl):
+            self._check_progress(sl.start * self.Ncells // self.shape[0], self.Ncells)
+            r = self.r[sl]
+            lsw = (r > Rej) * (np.abs(self._ct[sl]) > cos_top)
+            self.regions[sl][lsw] = 5
+
+            vr = (vinf - v0) * (1 - Rej / r[lsw]) ** beta + v0  # m/s
+            # 4*pi*star.R_m^2
+            rho_sw = Mloss_SI / (star.S_m2 * r[lsw] ** 2 * (1 - cos_top))
 
-        self.rho[lsw] = rho_sw
-        self.T[lsw] = Tmax
-        self.v[0, lsw] = vr
+            self.rho[sl][lsw] = rho_sw
+            self.T[sl][lsw] = Tmax
+            self.v[0][sl][lsw] = vr
+            return
+
+        self._parallel(_slab, self.shape[0])
 
         return
 
     # building not working properly because density is normalised only for
     # spherically symmetric flows
+    @_builder
     def add_stellar_wind(
         self,
         star,
@@ -1235,32 +2236,59 @@ class Grid:
         Adding a stellar wind.
         ** building: density not well normalised if not spherically symmetric **
         """
-        tmp = np.copy(self.regions)
+        if not self.structured:
+            raise NotImplementedError(
+                "The shadowing of the stellar wind requires a structured grid."
+            )
+        # The wind is shadowed in the (theta, phi) columns where there is
+        # any other region (or the dead zone) at any r.
+        lshadow = np.any(self.regions > 0, axis=0)
         try:
-            tmp[self._ldead_zone == 1] = 1
-        except:
+            lshadow |= np.any(self._ldead_zone, axis=0)
+        except AttributeError:
             print("No (accreting) magnetosphere associated to the stellar wind.")
-        theta_max = np.amin(self.theta, where=tmp > 0, axis=0, initial=2 * np.pi)
-        lwind = ((self.regions == 0) * (self.r >= Rmin)) * (
-            self.theta < theta_max[None, :, :]
+        lwind = (
+            (self.regions == 0)
+            * (self.grid[0] >= Rmin)[:, None, None]
+            * ~lshadow[None, :, :]
         )
+        # fill only the wind cells
+        iwind = np.nonzero(lwind)
+        r = self.r[iwind]
 
-        vr = 1e3 * (v0 + (vinf - v0) * (1.0 - Rmin / self.r[lwind]) ** beta)
-        self.v[0, lwind] = vr
+        vr = 1e3 * (v0 + (vinf - v0) * (1.0 - Rmin / r) ** beta)
+        self.v[0][iwind] = vr
 
-        self.rho[lwind] = (
-            Mloss
-            * Msun_per_year_to_SI
-            / (4 * np.pi * self.r[lwind] ** 2 * vr)
-            / star.R_m**2
+        self.rho[iwind] = (
+            Mloss * Msun_per_year_to_SI / (4 * np.pi * r**2 * vr) / star.R_m**2
         )
         # TO DO: Normalize density
         #
-        self.T[lwind] = Tmax
-        self.regions[lwind] = 5
+        self.T[iwind] = Tmax
+        self.regions[iwind] = 5
 
         return
 
+    def save(self, path, star=None, **kwargs):
+        """
+        Write the grid to a chunked and compressed HDF5 file (see ctts_env.store.save).
+        """
+        from .store import save
+
+        save(self, path, star=star, **kwargs)
+        return
+
+    @staticmethod
+    def load(path, **kwargs):
+        """
+        Read a grid written by Grid.save (see ctts_env.store.load).
+
+        return :: an instance of Grid()
+        """
+        from .store import load
+
+        return load(path, **kwargs)
+
     def _write(
         self,
         filename,
@@ -1309,21 +2337,22 @@ class Grid:
         f.write(np.array(Thp, dtype=float).tobytes())
         f.write(np.array(Tpre_shock, dtype=float).tobytes())
 
-        f.write(self.T[:, :, :].T.tobytes())
-        f.write(self.rho[:, :, :].T.tobytes())
-        f.write(self.ne[:, :, :].T.tobytes())
-        v3d = np.zeros((3, self.shape[2], self.shape[1], self.shape[0]))
+        # (Np, Nt, Nr) buffers, without copy if self.order == "F"
+        f.write(_fortran_buffer(self.T))
+        f.write(_fortran_buffer(self.rho))
+        f.write(_fortran_buffer(self.ne))
+        # float 32 for real and float for double precision kind=dp
+        v3d = np.empty((3, self.shape[2], self.shape[1], self.shape[0]), np.float32)
         v3d[0] = self.v[0, :, :, :].T
         v3d[1] = self.v[2, :, :, :].T
         v3d[2] = self.v[1, :, :, :].T
-        # float 32 for real and float for double precision kind=dp
-        f.write(np.float32(v3d).tobytes())
+        f.write(memoryview(v3d))
+        del v3d
         # vturb -> 0
-        f.write(np.zeros(np.product(self.shape)).tobytes())
+        f.write(memoryview(np.zeros(np.product(self.shape))))
         #
-        dz = np.copy(self.regions[:, :, :])
-        dz[dz > 0] = 1
-        f.write(np.int32(dz).T.tobytes())
+        dz = np.minimum(self.regions, 1).astype(np.int32)
+        f.write(_fortran_buffer(dz))
         f.close()
         return
 
@@ -1458,8 +2487,7 @@ class Grid:
             elif vfield_coord == 3:
                 v1, v2, v3 = self.v
             else:
-                print("Error vfield_coord %d not allowed ! " % vfield_coord)
-                exit()
+                raise ValueError("vfield_coord %d not allowed ! " % vfield_coord)
             x1 = self.R.flatten()
             x2 = self.z.flatten()
             x3 = self.phi.flatten()
@@ -1535,6 +2563,66 @@ class Grid:
 
     #     return
 
+    def _preview_points(self, field="rho", max_points=200000, voxels=0, seed=0):
+        """
+        Cells with rho > 0 reduced to a point budget, for a fast 3d preview.
+
+        field       :: name of the scalar field returned with the points
+        max_points  :: if there are more cells, a random subset of max_points cells
+                        is drawn uniformly, which preserves the density of points.
+        voxels      :: if > 0, the cells are binned onto voxels**3 cartesian voxels
+                        of the box [-Rmax, Rmax]**3 instead. One point per occupied
+                        voxel, at its centre, with the mean value of the field.
+        seed        :: seed of the random subset
+
+        return :: x, y, z, values (1d arrays)
+        """
+        icell = np.flatnonzero(self.rho > 0)
+        q = getattr(self, field).reshape(-1)
+        x, y, z = (c.reshape(-1) for c in (self.x, self.y, self.z))
+        if voxels > 0:
+            Rmax = self.r.reshape(-1)[icell].max()
+            ijk = [
+                np.clip(
+                    ((c[icell] + Rmax) / (2 * Rmax) * voxels).astype(int),
+                    0,
+                    voxels - 1,
+                )
+                for c in (x, y, z)
+            ]
+            ivox = np.ravel_multi_index(ijk, (voxels,) * 3)
+            count = np.bincount(ivox, minlength=voxels**3)
+            total = np.bincount(ivox, weights=q[icell], minlength=voxels**3)
+            iocc = np.flatnonzero(count)
+            centres = (np.arange(voxels) + 0.5) / voxels * 2 * Rmax - Rmax
+            i, j, k = np.unravel_index(iocc, (voxels,) * 3)
+            return centres[i], centres[j], centres[k], total[iocc] / count[iocc]
+        if icell.size > max_points:
+            rng = np.random.default_rng(seed)
+            icell = np.sort(rng.choice(icell, max_points, replace=False))
+        return x[icell], y[icell], z[icell], q[icell]
+
+    def _cartesian_volume(self, field, Ng, Rmax):
+        """
+        Field (name of a scalar attribute) sampled on a cartesian grid of Ng**3 points
+        of the box [-Rmax, Rmax]**3, 0 outside the grid. Linear interpolation for
+        a structured grid (see self._get_interpolator), nearest point otherwise.
+        Cached until the field changes (see self._cached).
+
+        return :: X, Y, Z, values (arrays of shape (Ng, Ng, Ng))
+        """
+        key = ("cartesian", field, Ng, Rmax)
+        out, fingerprint = self._cached(key, field)
+        if out is not None:
+            return out
+        Xm, Ym, Zm = np.mgrid[
+            -Rmax : Rmax : Ng * 1j,
+            -Rmax : Rmax : Ng * 1j,
+            -Rmax : Rmax : Ng * 1j,
+        ]
+        values = self._sample_cartesian(field, Xm, Ym, Zm)
+        return self._cache(key, fingerprint, (Xm, Ym, Zm, values))
+
     def _plot_3d(
         self,
         Ng=50,
@@ -1548,16 +2636,22 @@ class Grid:
         view=(0, 0),
         logscale=False,
         p_scale=0.5,
+        max_points=200000,
+        voxels=0,
     ):
         """
         *** Building ***
         to do: colors, add different regions
         view = (incl,az) incl = 0, z axis pointing toward the obs. incl = 90, z is up
+
+        max_points  :: maximum number of cells drawn by the matplotlib scatter plot
+        voxels      :: if > 0, the scatter plot shows the cells binned onto voxels**3
+                        cartesian voxels instead (see self._preview_points).
+        The volume rendered by mayavi (Ng**3 points) is cached until the fields change.
         """
         if _mayavi:
             try:
                 from mayavi import mlab
-                from scipy.interpolate import RegularGridInterpolator
 
             except:
                 _mayavi = False
@@ -1578,11 +2672,14 @@ class Grid:
         Rmax = self.r[mask].max()
         mask_surf = mask.reshape(-1, self.shape[-1])
         lmag = np.any(self.regions == 1)
-        # smaller array
-        if show_T:
-            data_to_plot = self.T[mask]
+        # smaller arrays
+        field = ("rho", "T")[show_T]  # self.get_B_module()[mask]
+        if not _mayavi:
+            xs, ys, zs, data_to_plot = self._preview_points(
+                field, max_points=max_points, voxels=voxels
+            )
         else:
-            data_to_plot = self.rho[mask]  # self.get_B_module()[mask]
+            data_to_plot = getattr(self, field)[mask]
         # Color scale scaling for the scatter density
         if logscale:
             data_to_plot = np.log10(data_to_plot)
@@ -1669,14 +2766,9 @@ class Grid:
 
                 mlab.orientation_axes()
 
-                Xm, Ym, Zm = np.mgrid[
-                    -Rmax : Rmax : Ng * 1j,
-                    -Rmax : Rmax : Ng * 1j,
-                    -Rmax : Rmax : Ng * 1j,
-                ]
-                finterp = RegularGridInterpolator(self.grid, self.rho, method="linear")
+                Xm, Ym, Zm, vol = self._cartesian_volume("rho", Ng, Rmax)
                 vol_density = mlab.pipeline.scalar_field(
-                    Xm, Ym, Zm, finterp((Xm, Ym, Zm))
+                    Xm, Ym, Zm, vol
                 )  # ,vmin=,vmax=)
                 #     vol_density = ChangeVolColormap(vol_density,cmapName="Reds",vmin=vmin,vmax=vmax,alpha=1.0)
                 mlab.pipeline.volume(vol_density)
@@ -1696,9 +2788,9 @@ class Grid:
             #     alpha=1,
             # )
             ax3d.scatter(
-                self.x[mask],
-                self.y[mask],
-                self.z[mask],
+                xs,
+                ys,
+                zs,
                 c=data_to_plot,
                 cmap=cmap,
             )
@@ -1756,6 +2848,79 @@ class Grid:
 
         return
 
+    def region_stats(self, regions=[]):
+        """
+        Statistics of the different regions of the grid, computed in a single pass.
+
+        The cells are sorted once by region and all the reductions (extent, density,
+        temperature and velocities in every basis) are grouped reductions over
+        contiguous segments of that ordering. Minimums of r, rho and T are taken
+        over cells with rho > 0, as in self._pinfo().
+
+        regions :: list of region ids to return. All regions present if empty.
+
+        return :: dict of dict, keyed by region id. Each item contains the number
+                  of cells (Ncells), the extent (rmin, rmax), the density (rho_min,
+                  rho_mean, rho_max), the temperature (T_min, T_avg_rho, T_max) and
+                  for each velocity component the min and max of its absolute value
+                  (e.g., vx_min, vx_max) in m/s.
+        """
+        reg = self.regions.ravel()
+        order = np.argsort(reg, kind="stable")
+        ids, starts, counts = np.unique(
+            reg[order], return_index=True, return_counts=True
+        )
+
+        def _sorted(q):
+            return q.ravel()[order]
+
+        def _reduce(ufunc, q):
+            return ufunc.reduceat(q, starts)
+
+        rho = _sorted(self.rho)
+        lrho = rho > 0
+        r = _sorted(self.r)
+        T = _sorted(self.T)
+        rho_sum = _reduce(np.add, rho)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            T_avg = _reduce(np.add, T * rho) / rho_sum
+
+        stats = {
+            "Ncells": counts,
+            "rmin": _reduce(np.minimum, np.where(lrho, r, np.inf)),
+            "rmax": _reduce(np.maximum, r),
+            "rho_min": _reduce(np.minimum, np.where(lrho, rho, np.inf)),
+            "rho_mean": rho_sum / counts,
+            "rho_max": _reduce(np.maximum, rho),
+            "T_min": _reduce(np.minimum, np.where(lrho, T, np.inf)),
+            "T_avg_rho": T_avg,
+            "T_max": _reduce(np.maximum, T),
+        }
+
+        # velocities, cartesian and cylindrical computed once for the whole grid.
+        vx, vy, vz = self.get_v_cart()
+        vR = self._cp * vx + self._sp * vy
+        velocities = {
+            "vx": vx,
+            "vy": vy,
+            "vz": vz,
+            "vR": vR,
+            "vr": self.v[0],
+            "vtheta": self.v[1],
+            "vphi": self.v[2],
+        }
+        for key, vel in velocities.items():
+            av = abs(_sorted(vel))
+            stats[key + "_min"] = _reduce(np.minimum, av)
+            stats[key + "_max"] = _reduce(np.maximum, av)
+
+        out = {}
+        for n, ir in enumerate(ids):
+            if np.any(regions) and ir not in regions:
+                continue
+            out[int(ir)] = {key: val[n] for key, val in stats.items()}
+        return out
+
     def _pinfo(self, fout=sys.stdout):
         """
         Print info about the grid and the different regions to fout.
@@ -1766,115 +2931,213 @@ class Grid:
         print("** Grid's regions:", file=fout)
         print(" ----------------------- ", file=fout)
         print("Rmax = %lf Rstar" % self.Rmax, file=fout)
+        # Don't print transparent and dark regions at the moment.
+        stats = self.region_stats(regions=[ir for ir in self.regions_id if ir > 0])
         for ir in self.regions_id:
-            # Don't print transparent and dark regions at the moment.
-            if ir == 0 or ir == -1:
+            if ir not in stats:
                 continue
-            cond = self.regions == ir
-            if np.any(cond):
-                r = self.r[cond]
-                rho = self.rho[cond]
-                T = self.T[cond]
-                Tavg = np.average(T, weights=rho)
-                vr, vtheta, vphi = self.v[:, cond]
-                vx, vy, vz = self.get_v_cart()
-                vx = vx[cond]
-                vy = vy[cond]
-                vz = vz[cond]
-                vR = self._cp[cond] * vx + self._sp[cond] * vy
-                print(" <//> %s" % self.regions_label[ir], file=fout)
-                # Info. specific to a regions, existing only if the proper method has been called.
-                if ir == 1:
-                    print(
-                        "   rmi = %lf Rstar; rmo = %lf Rstar"
-                        % (self._Rt, self._Rt + self._dr),
-                        file=fout,
-                    )
-                    # with new mag, there is no main/sec columns
-                    try:  # tmp
-                        print(
-                            "   no sec. columns ? %s" % ("No", "Yes")[self._no_sec],
-                            file=fout,
-                        )
-                    except:
-                        pass
-                    print("   beta_ma = %lf deg" % self._beta, file=fout)
+            s = stats[ir]
+            print(" <//> %s" % self.regions_label[ir], file=fout)
+            # Info. specific to a regions, existing only if the proper method has been called.
+            if ir == 1:
+                print(
+                    "   rmi = %lf Rstar; rmo = %lf Rstar"
+                    % (self._Rt, self._Rt + self._dr),
+                    file=fout,
+                )
+                # with new mag, there is no main/sec columns
+                try:  # tmp
                     print(
-                        "   Macc = %.3e Msun/yr" % (self._Macc / Msun_per_year_to_SI),
+                        "   no sec. columns ? %s" % ("No", "Yes")[self._no_sec],
                         file=fout,
                     )
-                    print("   S_shock = %.4f %s" % (self._f_shock, "%"), file=fout)
-                    print("", file=fout)
-
-                print("  --  Extent -- ", file=fout)
+                except:
+                    pass
+                print("   beta_ma = %lf deg" % self._beta, file=fout)
                 print(
-                    "   min(r) = %.4f R*; max(r) = %.4f R*"
-                    % (r[rho > 0].min(), r.max()),
+                    "   Macc = %.3e Msun/yr" % (self._Macc / Msun_per_year_to_SI),
                     file=fout,
                 )
+                print("   S_shock = %.4f %s" % (self._f_shock, "%"), file=fout)
+                print("", file=fout)
 
-                print("  -- Density -- ", file=fout)
-                print(
-                    "   min(rho) = %.4e kg/m3; <rho> = %.4e kg/m3; max(rho) = %.4e kg/m3"
-                    % (rho[rho > 0].min(), np.mean(rho), rho.max()),
-                    file=fout,
-                )
+            print("  --  Extent -- ", file=fout)
+            print(
+                "   min(r) = %.4f R*; max(r) = %.4f R*" % (s["rmin"], s["rmax"]),
+                file=fout,
+            )
 
-                print("  -- Temperature -- ", file=fout)
-                print(
-                    "   min(T) = %.4e K; <T>_rho = %.4e K; max(T) = %.4e K"
-                    % (T[rho > 0].min(), Tavg, T.max()),
-                    file=fout,
-                )
+            print("  -- Density -- ", file=fout)
+            print(
+                "   min(rho) = %.4e kg/m3; <rho> = %.4e kg/m3; max(rho) = %.4e kg/m3"
+                % (s["rho_min"], s["rho_mean"], s["rho_max"]),
+                file=fout,
+            )
 
-                print("  -- Velocities -- ", file=fout)
-                print(
-                    "   |Vx| %lf km/s %lf km/s"
-                    % (1e-3 * abs(vx).max(), 1e-3 * abs(vx).min()),
-                    file=fout,
-                )
-                print(
-                    "   |Vy| %lf km/s %lf km/s"
-                    % (1e-3 * abs(vy).max(), 1e-3 * abs(vy).min()),
-                    file=fout,
-                )
-                print(
-                    "   |Vz| %lf km/s %lf km/s"
-                    % (1e-3 * abs(vz).max(), 1e-3 * abs(vz).min()),
-                    file=fout,
-                )
-                print(
-                    "   |VR| %lf km/s %lf km/s"
-                    % (1e-3 * abs(vR).max(), 1e-3 * abs(vR).min()),
-                    file=fout,
-                )
-                print(
-                    "   |Vr| %lf km/s %lf km/s"
-                    % (1e-3 * abs(vr).max(), 1e-3 * abs(vr).min()),
-                    file=fout,
-                )
-                print(
-                    "   |Vtheta| %lf km/s %lf km/s"
-                    % (1e-3 * abs(vtheta).max(), 1e-3 * abs(vtheta).min()),
-                    file=fout,
-                )
+            print("  -- Temperature -- ", file=fout)
+            print(
+                "   min(T) = %.4e K; <T>_rho = %.4e K; max(T) = %.4e K"
+                % (s["T_min"], s["T_avg_rho"], s["T_max"]),
+                file=fout,
+            )
+
+            print("  -- Velocities -- ", file=fout)
+            for key, lab in zip(
+                ["vx", "vy", "vz", "vR", "vr", "vtheta", "vphi"],
+                ["Vx", "Vy", "Vz", "VR", "Vr", "Vtheta", "Vphi"],
+            ):
                 print(
-                    "   |Vphi| %lf km/s %lf km/s"
-                    % (1e-3 * abs(vphi).max(), 1e-3 * abs(vphi).min()),
+                    "   |%s| %lf km/s %lf km/s"
+                    % (lab, 1e-3 * s[key + "_max"], 1e-3 * s[key + "_min"]),
                     file=fout,
                 )
 
-                print("", file=fout)
+            print("", file=fout)
+
+        if self._profile:
+            self._pprofile(fout=fout)
+        return
+
+    def _pprofile(self, fout=sys.stdout):
+        """
+        Print the profile of the methods of the grid (see ctts_env.profiling).
+        """
+        print("** Profile:", file=fout)
+        print(" ----------------------- ", file=fout)
+        print(
+            "  %-26s %6s %10s %12s %12s"
+            % ("method", "calls", "time (s)", "cells", "peak (MB)"),
+            file=fout,
+        )
+        for name, p in sorted(self._profile.items(), key=lambda x: -x[1]["time_s"]):
+            print(
+                "  %-26s %6d %10.4f %12d %12.3f"
+                % (name, p["calls"], p["time_s"], p["cells"], p["alloc_peak_B"] / 1e6),
+                file=fout,
+            )
+        print("", file=fout)
+        return
+
+    def write_profile(self, filename):
+        """
+        Write the profile of the methods of the grid (see ctts_env.profiling)
+        to a JSON file.
+        """
+        with open(filename, "w") as f:
+            json.dump(self._profile, f, indent=1)
+        return
+
+    def get_recipe(self):
+        """
+        The recipe of the model: the list of the calls of the builders (and of the
+        other methods modifying the model, e.g. rotate_phase), in order, with all
+        their arguments. It is serializable (JSON) and does not depend on the
+        resolution of the grid (see self.replay).
+        """
+        return json.loads(json.dumps(self._recipe))
+
+    def write_recipe(self, filename):
+        """
+        Write the recipe of the model (see self.get_recipe) to a JSON file.
+        """
+        with open(filename, "w") as f:
+            json.dump(self._recipe, f, indent=1)
         return
 
+    def replay(self, recipe):
+        """
+        Apply a recipe (see self.get_recipe) to this grid, e.g. to build the same
+        model at another resolution. The calls are made in the order of the recipe.
+
+        recipe :: list of calls, or name of a JSON file written by self.write_recipe
+        """
+        if isinstance(recipe, str):
+            with open(recipe) as f:
+                recipe = json.load(f)
+        for call in recipe:
+            method = getattr(self, call["method"], None)
+            if not getattr(method, "_recorded", False):
+                raise ValueError(
+                    "%s is not a method that can be replayed." % call["method"]
+                )
+            method(**_deserialize(call["args"]))
+        return
+
+    def check_finite(
+        self,
+        attrs=["rho", "T", "v", "B", "ne"],
+        raise_error=False,
+        Nfirst=5,
+        chunk_size=2**20,
+        verbose=True,
+    ):
+        """
+        Check that the fields attrs of the grid are finite (no nan/inf values).
+
+        All the fields are tested in a single sweep over the cells, by chunks
+        of chunk_size cells, so that the temporary arrays remain small.
+
+        attrs       :: list of the fields to check.
+        raise_error :: if True, raise a ValueError if non-finite values are found.
+        Nfirst      :: number of offending cells (i, j, k) recorded per region.
+        chunk_size  :: number of cells tested at once.
+        verbose     :: print a warning for each field with non-finite values.
+
+        return :: dict keyed by field name, of dict keyed by region id, with
+                  the number of offending cells ("count") and the indices of
+                  the first of them in the memory order of the fields ("first").
+                  Empty if all values are finite.
+        """
+        Nc = self.regions.size
+        # cells swept in the memory order of the fields (see self.order), so that
+        # the flat views below are not copies
+        order = ("C", "F")[self.order == "F" and self.structured]
+        reg = self.regions.reshape(-1, order=order)
+        # flat view of each component (one for a scalar field)
+        fields = []
+        for attr in attrs:
+            q = getattr(self, attr)
+            comps = q if q.ndim > self.regions.ndim else [q]
+            fields.append([c.reshape(-1, order=order) for c in comps])
+        bad = {}
+        for s in range(0, Nc, chunk_size):
+            e = min(s + chunk_size, Nc)
+            for attr, comps in zip(attrs, fields):
+                lbad = ~np.isfinite(comps[0][s:e])
+                for c in comps[1:]:
+                    lbad |= ~np.isfinite(c[s:e])
+                if not lbad.any():
+                    continue
+                icells = s + np.flatnonzero(lbad)
+                info = bad.setdefault(attr, {})
+                for ir in np.unique(reg[icells]):
+                    ic = icells[reg[icells] == ir]
+                    d = info.setdefault(int(ir), {"count": 0, "first": []})
+                    d["count"] += len(ic)
+                    Nmiss = Nfirst - len(d["first"])
+                    if Nmiss > 0:
+                        d["first"] += np.transpose(
+                            np.unravel_index(ic[:Nmiss], self.shape, order=order)
+                        ).tolist()
+
+        if verbose:
+            for attr, info in bad.items():
+                print("WARNING : self.%s has some nan/inf values!" % attr)
+                for ir, d in info.items():
+                    print(
+                        "  region %d (%s): %d cells, first at %s"
+                        % (ir, self.regions_label[ir], d["count"], d["first"])
+                    )
+        if raise_error and bad:
+            raise ValueError(
+                "Non-finite values in %s (regions %s)"
+                % (
+                    ", ".join(bad),
+                    sorted(set(ir for info in bad.values() for ir in info)),
+                )
+            )
+        return bad
+
     def _check_naninf(self, _attrs=["rho", "T", "v"]):
-        # list_attr = [
-        #     [getattr(self, attr), attr]
-        #     for attr in dir(self)
-        #     if (not attr.startswith("_") and type(getattr(self, attr)) != np.ndarray)
-        # ]
-        list_attr = [[getattr(self, attr), attr] for attr in _attrs]
-        for l in list_attr:
-            if np.any(np.isnan(l[0])) or np.any(np.isinf(l[0])):
-                print("WARNING : self.%s has some nan/inf values!" % l[1])
+        self.check_finite(attrs=_attrs)
         return
@@ -0,0 +1,183 @@
+"""
+Background export of built models.
+
+An ExportQueue hands the finished Grid() instances to writer threads, so that
+the next model can be built while the previous ones are written to disk. The
+queue is bounded: submit() blocks when maxsize models are already waiting,
+which caps the memory held by the models not yet written.
+
+By default, a snapshot of the grid is queued (see snapshot), so the fields
+of the grid can be modified (or rebuilt) as soon as submit() returns. Only
+the fields and the builder arrays are copied. With snapshot=False, the grid
+itself is queued (no copy) and it must not be modified until its export
+is done.
+
+usage:
+    with ExportQueue(maxsize=2) as queue:
+        for rmi in [2.0, 3.0, 4.0]:
+            grid = ctts_env.Grid(r, t, p)
+            grid.add_mag(star, rmi=rmi, rmo=rmi + 1)
+            queue.submit(grid, "model_%.1f.bin" % rmi, Tpre_shock=8000.0)
+
+    # or from asyncio:
+    future = await queue.asubmit(grid, "model.h5", method="save", star=star)
+    await future
+
+submit() returns a concurrent.futures.Future, done when the model is written.
+The exceptions raised by the exporters are set on the futures, printed, and
+the first one is raised again by close().
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import copy
+import functools
+import queue
+import threading
+
+import numpy as np
+
+from . import store
+
+
+def snapshot(grid):
+    """
+    Copy of grid for the exporters, with read-only arrays.
+
+    The fields and the builder arrays written by the exporters (see
+    store.grid_fields and store.private_fields) are copied. The other arrays
+    (coordinates, trigonometry, ...) are not modified by the builders, they are
+    shared as read-only views.
+    """
+    snap = copy.copy(grid)
+    for name, value in vars(grid).items():
+        if isinstance(value, np.ndarray):
+            if name in store.grid_fields + store.private_fields:
+                value = value.copy(order="K")
+            else:
+                value = value.view()
+            value.flags.writeable = False
+        elif isinstance(value, (dict, list)):
+            value = copy.copy(value)
+        else:
+            continue
+        setattr(snap, name, value)
+    # the cached interpolators refer to the fields of grid
+    snap._fields_changed()
+    return snap
+
+
+class ExportQueue:
+    def __init__(self, maxsize=2, snapshot=True, nworkers=1):
+        """
+        maxsize     :: maximum number of models waiting to be written
+        snapshot    :: queue read-only copies of the grids (True) or the grids
+                       themselves (False)
+        nworkers    :: number of writer threads
+        """
+        self.maxsize = maxsize
+        self.snapshot = snapshot
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._errors = []
+        self._workers = [
+            threading.Thread(target=self._work, name="ctts_env-export-%d" % i)
+            for i in range(nworkers)
+        ]
+        for w in self._workers:
+            w.daemon = True
+            w.start()
+        # write what is queued at exit if close() was not called.
+        atexit.register(self.close, raise_errors=False)
+        self._closed = False
+        return
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                future, grid, path, method, kwargs = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if callable(method):
+                        out = method(grid, path, **kwargs)
+                    else:
+                        out = getattr(grid, method)(path, **kwargs)
+                except BaseException as e:
+                    print("Export of %s failed: %r" % (path, e))
+                    self._errors.append(e)
+                    future.set_exception(e)
+                else:
+                    future.set_result(out)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, grid, path, method="_write", **kwargs):
+        """
+        Queue the export of grid to path, blocking while the queue is full.
+
+        method :: name of the exporter of Grid() ("_write", "save",
+                  "_write_deprec_ascii", ...) or function(grid, path, **kwargs)
+        kwargs :: passed to the exporter
+
+        return :: concurrent.futures.Future of the export
+        """
+        if self._closed:
+            raise RuntimeError("ExportQueue is closed.")
+        if self.snapshot:
+            grid = snapshot(grid)
+        future = concurrent.futures.Future()
+        self._queue.put((future, grid, path, method, kwargs))
+        return future
+
+    async def asubmit(self, grid, path, method="_write", **kwargs):
+        """
+        submit() from an asyncio task: waits for a free slot in the queue
+        without blocking the event loop.
+
+        return :: asyncio future of the export
+        """
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(
+            None, functools.partial(self.submit, grid, path, method, **kwargs)
+        )
+        return asyncio.wrap_future(future)
+
+    def pending(self):
+        """
+        Number of models waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def join(self):
+        """
+        Wait until all the queued models are written.
+        """
+        self._queue.join()
+        return
+
+    def close(self, raise_errors=True):
+        """
+        Write the queued models and stop the writer threads. The first exception
+        raised by an exporter, if any, is raised again.
+        """
+        if not self._closed:
+            self._closed = True
+            atexit.unregister(self.close)
+            for _ in self._workers:
+                self._queue.put(None)
+            for w in self._workers:
+                w.join()
+        if raise_errors and self._errors:
+            raise self._errors[0]
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(raise_errors=exc_type is None)
+        return False
@@ -0,0 +1,207 @@
+"""
+Opt-in instrumentation of the methods of Grid() and of utils.surface_integral.
+
+When enabled, each call records its elapsed time, the number of cells it
+touched and the memory it allocated (tracemalloc) into the profile of the
+Grid() instance (grid._profile), printed by grid._pinfo() or written to
+a JSON file by grid.write_profile().
+
+The methods are wrapped only while the instrumentation is enabled, so there
+is no overhead otherwise. It is enabled by the context manager
+
+    with ctts_env.profiling.profile():
+        grid.add_mag(star)
+
+by enable() / disable(), or at import if the environment variable
+CTTS_ENV_PROFILE is set (to anything but "" or "0").
+
+Touched cells are the number of surface points for surface_integral and 0
+for the other methods. For the builders (add_* methods), the cells whose
+density or region changed are counted if enabled with count_cells=True
+(or CTTS_ENV_PROFILE=cells): this copies rho and regions before each call,
+which costs memory and time, so it is off by default.
+
+The calls in progress are tracked per thread, so that the calls made from
+different threads (e.g., the writer threads of an ExportQueue) are charged
+to their own profile entries. tracemalloc is global to the process: the
+memory figures of calls running concurrently include each other's
+allocations.
+"""
+
+import functools
+import inspect
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from . import utils
+from . import classgrid
+from .classgrid import Grid
+
+# profile of the calls not made from a Grid() method (e.g., surface_integral)
+global_profile = {}
+
+_originals = {}
+_local = threading.local()
+_options = {"count_cells": False}
+
+
+def _stack():
+    """
+    Calls in progress in the current thread.
+    """
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _instrumented_methods():
+    """
+    Public methods of Grid(), the exporters and plotting methods (_write*, _plot*)
+    and _pinfo.
+    """
+    for name, method in vars(Grid).items():
+        if not inspect.isfunction(method) or name.startswith("__"):
+            continue
+        if name.startswith("_") and not name.startswith(("_write", "_plot", "_pinfo")):
+            continue
+        yield name, method
+
+
+def _enter(grid):
+    stack = _stack()
+    cur, peak = tracemalloc.get_traced_memory()
+    for frame in stack:
+        frame["peak"] = max(frame["peak"], peak)
+    tracemalloc.reset_peak()
+    frame = {"grid": grid, "mem0": cur, "peak": cur, "t0": time.perf_counter()}
+    stack.append(frame)
+    return frame
+
+
+def _exit(frame, name, cells):
+    dt = time.perf_counter() - frame["t0"]
+    cur, peak = tracemalloc.get_traced_memory()
+    stack = _stack()
+    stack.pop()
+    frame["peak"] = max(frame["peak"], peak)
+    for f in stack:
+        f["peak"] = max(f["peak"], frame["peak"])
+
+    grid = frame["grid"]
+    profile = global_profile if grid is None else grid._profile
+    p = profile.setdefault(
+        name,
+        {"calls": 0, "time_s": 0.0, "cells": 0, "alloc_peak_B": 0, "alloc_net_B": 0},
+    )
+    p["calls"] += 1
+    p["time_s"] += dt
+    p["cells"] += int(cells)
+    p["alloc_peak_B"] = max(p["alloc_peak_B"], frame["peak"] - frame["mem0"])
+    p["alloc_net_B"] += cur - frame["mem0"]
+    return
+
+
+def _wrap_method(name, method):
+    lbuilder = getattr(method, "_builder", False)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lcount = lbuilder and _options["count_cells"]
+        if lcount:
+            rho0 = np.copy(self.rho)
+            regions0 = np.copy(self.regions)
+        frame = _enter(self)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            cells = 0
+            if lcount:
+                cells = np.count_nonzero(
+                    (self.rho != rho0) | (self.regions != regions0)
+                )
+            _exit(frame, name, cells)
+
+    return wrapper
+
+
+def _wrap_surface_integral(func):
+    @functools.wraps(func)
+    def wrapper(t, p, q, *args, **kwargs):
+        # attributed to the innermost Grid() call in progress
+        stack = _stack()
+        frame = _enter(stack[-1]["grid"] if stack else None)
+        try:
+            return func(t, p, q, *args, **kwargs)
+        finally:
+            _exit(frame, "surface_integral", np.size(q))
+
+    return wrapper
+
+
+def is_enabled():
+    return bool(_originals)
+
+
+def enable(count_cells=False):
+    """
+    Wrap the methods of Grid() and utils.surface_integral, and start tracemalloc.
+
+    count_cells :: count the cells changed by the builders (copies rho and regions
+                   before each call)
+    """
+    _options["count_cells"] = count_cells
+    if is_enabled():
+        return
+    for name, method in list(_instrumented_methods()):
+        _originals[(Grid, name)] = method
+        setattr(Grid, name, _wrap_method(name, method))
+    func = utils.surface_integral
+    wrapped = _wrap_surface_integral(func)
+    # classgrid imports surface_integral by name.
+    for module in (utils, classgrid):
+        _originals[(module, "surface_integral")] = func
+        setattr(module, "surface_integral", wrapped)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _originals["tracemalloc"] = True
+    return
+
+
+def disable():
+    """
+    Restore the original methods and stop tracemalloc if started by enable().
+    """
+    if _originals.pop("tracemalloc", False):
+        tracemalloc.stop()
+    for (owner, name), func in _originals.items():
+        setattr(owner, name, func)
+    _originals.clear()
+    _stack().clear()
+    return
+
+
+class profile:
+    """
+    Context manager enabling the instrumentation (see enable).
+    """
+
+    def __init__(self, count_cells=False):
+        self.count_cells = count_cells
+
+    def __enter__(self):
+        self._was_enabled = is_enabled()
+        enable(count_cells=self.count_cells)
+        return self
+
+    def __exit__(self, *exc):
+        if not self._was_enabled:
+            disable()
+        return False
+
+
+if os.environ.get("CTTS_ENV_PROFILE", "0") not in ("", "0"):
+    enable(count_cells=os.environ["CTTS_ENV_PROFILE"] == "cells")
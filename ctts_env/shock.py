@@ -0,0 +1,137 @@
+"""
+Footprint of the accretion shock of a dipolar magnetosphere, computed on the
+stellar surface only (no Grid), for arrays of obliquities and truncation radii.
+
+The surface is sampled with an equal-area quadrature (see utils.surface_quadrature).
+A point is in the shock if the gas flows into the star there (-Br sign(z) > 0)
+and if the foot point r0 of its field line at the magnetic equator is between
+rmi and rmo (see utils.dipole_foot_point), as in Grid.add_mag.
+
+For a given obliquity, r0 does not depend on (rmi, rmo): the foot points of
+the inflow points are sorted once and the shock area of any (rmi, rmo) is
+then the number of points with rmi <= r0 <= rmo (two binary searches).
+
+usage:
+    table = ctts_env.shock.shock_table(np.linspace(0, 89, 90), rmi=2.2, rmo=3.0)
+    plt.plot(table["beta"], table["area"], table["beta"], table["area_kulkarni"])
+"""
+
+import numpy as np
+
+from .utils import (
+    surface_quadrature,
+    dipole_foot_point,
+    field_line_v2,
+    Gamma,
+    shock_area,
+)
+
+
+def mahdavi_kenyon98(Rt, beta):
+    """
+    Fraction of the stellar surface covered by the shock,
+    approximation for Rt >> 1 from Mahdavi & Kenyon 98.
+    """
+    return 1 / Rt * np.cos(np.deg2rad(beta)) * 0.25
+
+
+def kulkarni13(rmi, rmo, beta):
+    """
+    Fraction of the stellar surface covered by the shock,
+    Kulkarni & Romanova, MNRAS 433, 3048–3061 (2013), § 4.2.1, Eqs. 2 and 3.
+    """
+    sin2 = np.sin(np.pi / 2 - np.deg2rad(beta)) ** 2
+    sto2 = 1 / rmo * sin2
+    sti2 = 1 / rmi * sin2
+    return np.sqrt(1.0 - sto2) - np.sqrt(1.0 - sti2)
+
+
+def footprint(beta, Nt=200, Np=400, star=None, V0=0, rmax=np.inf, N_fl=10000):
+    """
+    Foot points of the field lines of the inflow points of the stellar surface,
+    for one obliquity.
+
+    beta    :: obliquity of the dipole (degrees)
+    Nt, Np  :: size of the surface quadrature (Np = 1 if beta = 0)
+    star    :: if given, with a rotation period, the points whose field line
+                does not allow the gas to flow (see utils.field_line_v2) are
+                removed. Only the lines with r0 <= rmax are checked.
+    V0      :: velocity at the injection point (m/s), with star.
+
+    return :: r0 (sorted), cumulative sums (with a leading 0) of the solid angle
+              and of the mass flux (-Br sign(z) for eta = 1, see Grid.add_mag)
+              of the points, in units of 4 pi and 4 pi Rstar^2.
+    """
+    if beta == 0:
+        Np = 1
+    ct, st, cp, sp, dOmega = surface_quadrature(Nt, Np)
+    ma = np.deg2rad(beta)
+    # Br / (2 m0) at r = 1
+    flux = (st * cp * np.sin(ma) + ct * np.cos(ma)) * np.sign(ct)
+    lin = flux > 0
+    ct, st, cp, sp, flux = ct[lin], st[lin], cp[lin], sp[lin], flux[lin]
+    r = np.ones(ct.size)
+    r0, phi0 = dipole_foot_point(r, st, ct, sp, cp, beta)
+    if star is not None and star.P:
+        lchk = r0 <= rmax
+        v2 = field_line_v2(
+            r[lchk], st[lchk], sp[lchk], r0[lchk], phi0[lchk], beta, star, V0, N_fl
+        )
+        r0[np.flatnonzero(lchk)[v2 <= 0]] = np.inf
+        flux = flux * 2 * star._m0
+    else:
+        flux = flux * 2
+    order = np.argsort(r0, kind="stable")
+    w = dOmega / (4 * np.pi)
+    area = np.concatenate(([0], np.full(r0.size, w).cumsum()))
+    mflux = np.concatenate(([0], np.cumsum(flux[order] * w)))
+    return r0[order], area, mflux
+
+
+def shock_table(beta, rmi, rmo, Nt=200, Np=400, star=None, V0=0, N_fl=10000):
+    """
+    Shock area for arrays of obliquities and truncation radii, broadcast
+    against each other, and the analytic estimates.
+
+    beta        :: obliquity of the dipole (degrees)
+    rmi, rmo    :: inner and outer truncation radii (Rstar)
+    Nt, Np      :: size of the surface quadrature
+    star, V0    :: see footprint. Without a star (or a rotation period), every
+                    field line between rmi and rmo accretes. The mass flux is
+                    then in units of m0 = 1.
+
+    return :: dict of arrays of the broadcast shape:
+                beta, rmi, rmo      :: parameters
+                area                :: fraction of the stellar surface covered by the shock
+                mass_flux           :: mass flux for eta = 1 (see Grid.add_mag),
+                                        units of Br Rstar^2
+                area_axisym         :: utils.Gamma(rmi, rmo - rmi)
+                area_analytic       :: utils.shock_area(rmi, rmo - rmi, beta)
+                area_kulkarni       :: kulkarni13(rmi, rmo, beta)
+                area_MK             :: mahdavi_kenyon98(rmo, beta)
+    """
+    beta, rmi, rmo = (
+        np.array(q, dtype=float) for q in np.broadcast_arrays(beta, rmi, rmo)
+    )
+    area = np.zeros(beta.shape)
+    mass_flux = np.zeros(beta.shape)
+    rmax = rmo.max() if rmo.size else 0
+    for b in np.unique(beta):
+        sel = beta == b
+        r0, a, mf = footprint(b, Nt, Np, star=star, V0=V0, rmax=rmax, N_fl=N_fl)
+        lo = np.searchsorted(r0, rmi[sel], side="left")
+        hi = np.maximum(lo, np.searchsorted(r0, rmo[sel], side="right"))
+        area[sel] = a[hi] - a[lo]
+        mass_flux[sel] = (mf[hi] - mf[lo]) * 4 * np.pi
+
+    return {
+        "beta": beta,
+        "rmi": rmi,
+        "rmo": rmo,
+        "area": area,
+        "mass_flux": mass_flux,
+        "area_axisym": Gamma(rmi, rmo - rmi),
+        "area_analytic": shock_area(rmi, rmo - rmi, beta=beta),
+        "area_kulkarni": kulkarni13(rmi, rmo, beta),
+        "area_MK": mahdavi_kenyon98(rmo, beta),
+    }
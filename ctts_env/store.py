@@ -0,0 +1,220 @@
+"""
+Chunked and compressed HDF5 store of Grid() instances (requires h5py).
+
+Layout of a file:
+    /axes/r, /axes/theta, /axes/phi   the structured axes (1d), or the coordinates
+                                      of the points of an unstructured grid
+    /fields/<name>                    rho, T, ne, v, B, regions (shape of the grid,
+                                      (3,) + shape for the vector fields)
+    /private/<name>                   arrays of the builders needed afterwards
+                                      (e.g. the dead zone, see setup_dead_zone)
+    /regions/<id>                     flat indices of the cells of each region
+    attributes of /                   version, structured, the scalar state of
+                                      the grid (JSON), the recipe (builder calls with
+                                      their arguments and stars, JSON), the star (JSON)
+
+The fields are chunked, so that reading a subvolume or a single field
+only reads and decompresses the chunks needed.
+"""
+
+import json
+
+import numpy as np
+
+from . import __version__
+
+grid_fields = ["rho", "T", "ne", "v", "B", "regions"]
+private_fields = ["_laccr", "_ldead_zone", "_v2_dead_zone"]
+vector_fields = ["v", "B"]
+# attributes of a Grid() computed from the coordinates, or referring to
+# arrays not stored (not restored by load)
+_not_stored = ["Ncells", "structured", "_2d", "_volume_set"]
+# attributes of the state of a grid describing how it is set up, not the model
+# (not copied by copy_model)
+setup_state = ["order", "nthreads", "validate"]
+
+
+def _h5py():
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("ctts_env.store requires h5py (pip install h5py).")
+    return h5py
+
+
+def _state(grid):
+    """
+    Scalar attributes of a Grid() instance (float, int, bool, str).
+    """
+    state = {}
+    for key, val in vars(grid).items():
+        if key in _not_stored:
+            continue
+        if isinstance(val, np.generic):
+            val = val.item()
+        if isinstance(val, (bool, int, float, str)):
+            state[key] = val
+    return state
+
+
+def save(grid, path, star=None, compression="gzip", compression_opts=4, chunks=True):
+    """
+    Write a Grid() instance to the HDF5 file path (overwritten).
+
+    star                :: optional instance of Star() stored as an attribute, in
+                            addition to the stars of the recipe.
+    compression         :: compression filter of h5py (None to disable)
+    compression_opts    :: options of the filter (level for gzip)
+    chunks              :: chunk shape of the fields, or True for the h5py default.
+    """
+    h5py = _h5py()
+    kw = {"compression": compression, "compression_opts": compression_opts}
+    if compression is None:
+        kw = {}
+    with h5py.File(path, "w") as f:
+        f.attrs["version"] = __version__
+        f.attrs["structured"] = grid.structured
+        f.attrs["state"] = json.dumps(_state(grid))
+        f.attrs["recipe"] = json.dumps(grid._recipe)
+        if star is not None:
+            f.attrs["star"] = json.dumps(star._params())
+
+        axes = f.create_group("axes")
+        if grid.structured:
+            coords = grid.grid
+        else:
+            coords = (grid.r, grid.theta, grid.phi)
+        for name, c in zip(("r", "theta", "phi"), coords):
+            axes.create_dataset(name, data=c)
+
+        group = f.create_group("fields")
+        for name in grid_fields:
+            q = getattr(grid, name)
+            cshape = chunks
+            if chunks is not True and name in vector_fields:
+                cshape = (1,) + tuple(chunks)
+            group.create_dataset(name, data=q, chunks=cshape, shuffle=True, **kw)
+
+        group = f.create_group("private")
+        for name in private_fields:
+            if hasattr(grid, name):
+                group.create_dataset(
+                    name, data=getattr(grid, name), chunks=chunks, shuffle=True, **kw
+                )
+
+        group = f.create_group("regions")
+        reg = grid.regions.reshape(-1)
+        for ir in np.unique(reg):
+            group.create_dataset(
+                str(ir), data=np.flatnonzero(reg == ir), shuffle=True, **kw
+            )
+    return
+
+
+def load(path, fields=grid_fields, subvolume=None):
+    """
+    Read a Grid() instance from the HDF5 file path.
+
+    fields      :: fields to read, the others are left to 0. The private arrays of
+                    the builders are read only if all fields are read and subvolume is None.
+    subvolume   :: tuple of slices of the axes (r, theta, phi) for a structured
+                    grid, or a slice of the points for an unstructured grid.
+                    Only this part of the grid is read.
+
+    return :: an instance of Grid(), with its state and recipe.
+    """
+    from .classgrid import Grid
+
+    h5py = _h5py()
+    with h5py.File(path, "r") as f:
+        structured = bool(f.attrs["structured"])
+        if subvolume is None:
+            subvolume = (slice(None),) * (1, 3)[structured]
+        elif not isinstance(subvolume, tuple):
+            subvolume = (subvolume,)
+        axes = f["axes"]
+        state = json.loads(f.attrs["state"])
+        order = state.get("order", "C")
+        if structured:
+            rr, tt, pp = (axes[n][s] for n, s in zip(("r", "theta", "phi"), subvolume))
+            grid = Grid(*np.meshgrid(rr, tt, pp, indexing="ij"), order=order)
+        else:
+            grid = Grid(*(axes[n][subvolume] for n in ("r", "theta", "phi")))
+
+        for key, val in state.items():
+            setattr(grid, key, val)
+        grid._recipe = json.loads(f.attrs["recipe"])
+
+        for name in fields:
+            sel = subvolume
+            if name in vector_fields:
+                sel = (slice(None),) + subvolume
+            setattr(grid, name, grid._layout(f["fields"][name][sel]))
+
+        lfull = all(subvolume[i] == slice(None) for i in range(len(subvolume)))
+        if lfull and set(fields) >= set(grid_fields):
+            for name in f["private"]:
+                setattr(grid, name, f["private"][name][()])
+    grid._fields_changed()
+    return grid
+
+
+def copy_model(model, grid):
+    """
+    Copy the model of a Grid() instance read by load (fields, builder arrays,
+    scalar state and recipe) into grid, which has the same coordinates.
+    The attributes setting up grid (setup_state) are kept.
+    """
+    for name in grid_fields + private_fields:
+        if hasattr(model, name):
+            setattr(grid, name, grid._layout(getattr(model, name)))
+    for key, val in _state(model).items():
+        if key not in setup_state:
+            setattr(grid, key, val)
+    grid._recipe = model._recipe
+    grid._fields_changed()
+    return
+
+
+def load_region(path, region, fields=["rho", "T", "v"]):
+    """
+    Read the cells of one region only.
+
+    The indices of the cells of the region are read first, then only the
+    bounding box of these cells in each field.
+
+    region  :: id of the region (see Grid.regions_id)
+    fields  :: fields to read
+
+    return :: dict with the coordinates r, theta, phi of the cells and the fields
+              (1d arrays, (3, N) for the vector fields).
+    """
+    h5py = _h5py()
+    out = {}
+    with h5py.File(path, "r") as f:
+        shape = f["fields"]["rho"].shape
+        if str(region) not in f["regions"]:
+            raise KeyError("No region %s in %s." % (region, path))
+        idx = np.unravel_index(f["regions"][str(region)][()], shape)
+        if idx[0].size == 0:
+            box = tuple(slice(0, 0) for i in idx)
+        else:
+            box = tuple(slice(i.min(), i.max() + 1) for i in idx)
+        local = tuple(i - b.start for i, b in zip(idx, box))
+
+        axes = f["axes"]
+        if f.attrs["structured"]:
+            coords = [
+                axes[n][b][i] for n, b, i in zip(("r", "theta", "phi"), box, local)
+            ]
+        else:
+            coords = [axes[n][box[0]][local[0]] for n in ("r", "theta", "phi")]
+        out.update(zip(("r", "theta", "phi"), coords))
+        for name in fields:
+            if name in vector_fields:
+                out[name] = f["fields"][name][(slice(None),) + box][
+                    (slice(None),) + local
+                ]
+            else:
+                out[name] = f["fields"][name][box][local]
+    return out
@@ -1,5 +1,8 @@
 import numpy as np
 
+from .constants import Ggrav
+from . import backend
+
 
 def surface_integral(t, p, q, axi_sym=False):
     """
@@ -14,41 +17,97 @@ def surface_integral(t, p, q, axi_sym=False):
 
         dOmega/4pi : the total area of the sphere in units of 4pi * 1^2
     """
-    ct = np.cos(t)
-    S = 0
-    dOmega_o_4pi = 0
+    if backend.get_backend() == "numba":
+        return backend.surface_integral(t, p, q, axi_sym)
+
+    q = np.asarray(q)
+    dct = abs(np.diff(np.cos(t)))
+    # integral over theta, trapezoidal in cos(theta)
+    q_theta = 0.5 * (q[1:] + q[:-1]) * dct[:, None]
     if axi_sym:
         # 2.5d
         fact = 2 * np.pi
         # 2d ? Can be done better
         if t.min() >= 0 and t.max() <= np.pi / 2:
             fact *= 2
-        i = 0
-        int_theta = 0
-        for j in range(1, len(t)):
-            dOmega_o_4pi += abs(ct[j] - ct[j - 1]) / 4 / np.pi
-            int_theta += 0.5 * (q[j, i] + q[j - 1, i]) * abs(ct[j] - ct[j - 1])
-        S = int_theta * fact
-        dOmega_o_4pi *= fact
-
+        dOmega_o_4pi = dct.sum() / 4 / np.pi * fact
+        S = q_theta[:, 0].sum() * fact
         S *= 1.0 / dOmega_o_4pi
         return S, dOmega_o_4pi
 
-    int_phi = 0
-    for i in range(len(p)):
-        int_theta = 0
-        for j in range(1, len(t)):
-            if i:
-                dOmega_o_4pi += abs(ct[j] - ct[j - 1]) * (p[i] - p[i - 1]) / 4 / np.pi
-            int_theta += 0.5 * (q[j, i] + q[j - 1, i]) * abs(ct[j] - ct[j - 1])
-        if i:
-            S += 0.5 * (int_theta + int_phi) * (p[i] - p[i - 1])
-        int_phi = int_theta
+    int_theta = q_theta.sum(axis=0)
+    dp = np.diff(p)
+    dOmega_o_4pi = dct.sum() * dp.sum() / 4 / np.pi
+    S = (0.5 * (int_theta[1:] + int_theta[:-1]) * dp).sum()
 
     S *= 1.0 / dOmega_o_4pi
     return S, dOmega_o_4pi
 
 
+def centres_to_limits(x, xmin, xmax):
+    """
+    Limits of the cells from the cell centres x (1d array, ascending or descending).
+    The inner limits are the midpoints between centres and the outer limits
+    are half a cell away from the first and last centres, bounded to [xmin, xmax].
+    There is one more point than in x.
+    """
+    if len(x) == 1:
+        return np.array([xmin, xmax])
+    xl = np.zeros(len(x) + 1)
+    xl[1:-1] = 0.5 * (x[1:] + x[:-1])
+    xl[0] = np.clip(1.5 * x[0] - 0.5 * x[1], xmin, xmax)
+    xl[-1] = np.clip(1.5 * x[-1] - 0.5 * x[-2], xmin, xmax)
+    return xl
+
+
+def surface_bins(t, p, Nt, Np):
+    """
+    Index of the equal-area cells of the surface of a sphere that
+    the points (t, p) belong to. The cells are uniform in cos(theta) (Nt cells)
+    and in phi (Np cells).
+
+    t :: theta coordinates of the points
+    p :: phi coordinates of the points
+
+    return :: index of the cells, in [0, Nt * Np)
+    """
+    it = np.minimum(((1.0 - np.cos(t)) / 2 * Nt).astype(int), Nt - 1)
+    ip = np.minimum((np.mod(p, 2 * np.pi) / (2 * np.pi) * Np).astype(int), Np - 1)
+    return it * Np + ip
+
+
+def surface_integral_binned(ibin, Nbins, q, min_coverage=0.9):
+    """
+    derive the integral for unstructured points with values q close
+    to the surface of a sphere of radius 1.0.
+
+    The values are averaged in the equal-area cells of the surface (see surface_bins).
+    Empty cells are not counted in the area covered by the points: as for
+    surface_integral(), S is divided by the covered fraction dOmega/4pi, which
+    amounts to giving the empty cells the mean value of the occupied ones.
+    This extrapolation is only reliable if most cells are occupied: a ValueError
+    is raised if the covered fraction is lower than min_coverage.
+
+    ibin         :: index of the surface cells of each point
+    Nbins        :: total number of surface cells
+    min_coverage :: minimum covered fraction (0 to accept any coverage)
+
+    return :: same as surface_integral()
+    """
+    counts = np.bincount(ibin, minlength=Nbins)
+    lfull = counts > 0
+    q_avg = np.bincount(ibin, weights=q, minlength=Nbins)[lfull] / counts[lfull]
+    dOmega_o_4pi = np.count_nonzero(lfull) / Nbins
+    if dOmega_o_4pi < min_coverage:
+        raise ValueError(
+            "Only %.1f%% of the surface cells contain points (minimum %.1f%%): "
+            "the surface integral would be extrapolated over the empty cells."
+            % (100 * dOmega_o_4pi, 100 * min_coverage)
+        )
+    S = q_avg.sum() * 4 * np.pi / Nbins / dOmega_o_4pi
+    return S, dOmega_o_4pi
+
+
 def spherical_to_cartesian(r, t, p, ct, st, cp, sp):
     x = r * st * cp + t * ct * cp - sp * p
     y = r * st * sp + t * ct * sp + cp * p
@@ -91,6 +150,128 @@ def shock_area(Rt, dr, beta=0, f=1):
     return f * Gamma(Rt, dr) * np.cos(np.deg2rad(beta))
 
 
+def surface_quadrature(Nt, Np):
+    """
+    Centres of Nt x Np equal-area cells of the sphere of radius 1, uniform in
+    cos(theta) and phi.
+
+    return :: cos(theta), sin(theta), cos(phi), sin(phi) (1d arrays) and the
+              solid angle of a cell
+    """
+    ct = 1 - (np.arange(Nt) + 0.5) * 2 / Nt
+    p = (np.arange(Np) + 0.5) * 2 * np.pi / Np
+    ct, p = (q.reshape(-1) for q in np.meshgrid(ct, p, indexing="ij"))
+    return ct, np.sqrt(1 - ct**2), np.cos(p), np.sin(p), 4 * np.pi / ct.size
+
+
+def dipole_foot_point(r, st, ct, sp, cp, beta):
+    """
+    Radius r0 (Rstar) and azimuth phi0 (in the frame of the dipole), at the
+    magnetic equator, of the dipole field line passing by the points (r, theta, phi).
+
+    st, ct, sp, cp  :: sin(theta), cos(theta), sin(phi), cos(phi)
+    beta            :: obliquity of the dipole (degrees)
+    """
+    ma = np.deg2rad(beta)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tanphi0 = np.cos(ma) * st * sp / (np.cos(ma) * st * cp - np.sin(ma) * ct)
+        phi0 = np.arctan(tanphi0)
+        if beta == 0:  # avoid 0 division error
+            r0 = r / st**2
+        else:  # non-zero obliquity
+            r0 = r * np.sin(phi0) ** 2 / st**2 / sp**2
+    return r0, phi0
+
+
+def field_line_v2(r, st, sp, r0, phi0, beta, star, V0=0, N_fl=10000, chunk_size=2**20):
+    """
+    Square of the velocity (m^2/s^2) of the gas accreting along the dipole field
+    line passing by the points (r, theta, phi), or 0 if the velocity is not
+    positive everywhere along the line, from the disc to the stellar surface
+    (ballistic motion in the frame rotating with the star).
+
+    r, st, sp   :: radius (Rstar), sin(theta) and sin(phi) of the points (1d arrays)
+    r0, phi0    :: foot point of the field lines (see dipole_foot_point)
+    beta        :: obliquity of the dipole (degrees)
+    star        :: instance of Star()
+    V0          :: velocity at the injection point (m/s)
+    N_fl        :: number of points along each field line
+    chunk_size  :: maximum number of points x N_fl processed at once
+    """
+    A = 2 * Ggrav * star.M_kg / star.R_m
+    C = (star.R_m * star._omega) ** 2
+    if backend.get_backend() == "numba":
+        return backend.field_line_v2(r, st, sp, r0, phi0, beta, A, C, V0, N_fl)
+    v2 = np.zeros(np.shape(r))
+    n = max(1, chunk_size // N_fl)
+    k = np.arange(N_fl)
+    te = np.pi / 2
+    for s in range(0, v2.size, n):
+        e = min(s + n, v2.size)
+        rc, r0c = r[s:e, None], r0[s:e, None]
+        if beta == 0:
+            ts = np.arcsin(np.sqrt(rc / r0c))
+        else:  # non-zero obliquity
+            ts = np.arcsin(
+                np.sqrt(rc / r0c * np.sin(phi0[s:e, None]) ** 2 / sp[s:e, None] ** 2)
+            )
+        # as np.linspace(ts, te, N_fl) for each point
+        t_fl = k * ((te - ts) / (N_fl - 1)) + ts
+        t_fl[:, -1] = te
+        # field line the point belongs to, from the disc to the stellar surface
+        y_fl = np.sin(t_fl) ** 2
+        if beta == 0:
+            r_fl = r0c * y_fl
+        else:  # non-zero obliquity
+            r_fl = r0c * sp[s:e, None] ** 2 / np.sin(phi0[s:e, None]) ** 2 * y_fl
+        v2_fl = A * (1 / r_fl - 1 / r0c) + (y_fl * r_fl**2 - r0c**2) * C + V0**2
+        laccr = np.all(v2_fl > 0, axis=1)
+        R = r[s:e] * st[s:e]
+        v2[s:e] = np.where(
+            laccr,
+            A * (1 / r[s:e] - 1 / r0[s:e]) + (R**2 - r0[s:e] ** 2) * C + V0**2,
+            0,
+        )
+    return v2
+
+
+def dipole_surface_flux(star, rmi, rmo, beta=0, V0=0, Nt=400, Np=400, N_fl=10000):
+    """
+    Mass flux and shock area of the accretion columns of a dipole, computed on the
+    stellar surface (r = 1) only, with a quadrature independent of any grid.
+
+    The surface is sampled at the centres of Nt x Np equal-area cells (uniform in
+    cos(theta) and phi, Np = 1 if beta = 0). Each point accretes if the foot point
+    of its field line is between rmi and rmo and if the gas can flow
+    along the line (see field_line_v2). The mass flux of the accretion
+    columns at the surface is then -rho vr = -eta Br sign(z) (see Grid.add_mag),
+    with eta the mass-to-magnetic flux ratio.
+
+    return :: mass flux for eta = 1 (units of Br Rstar^2), fraction of the
+              stellar surface covered by the shock
+    """
+    if beta == 0:
+        Np = 1
+    ct, st, cp, sp, dOmega = surface_quadrature(Nt, Np)
+    r = np.ones(ct.size)
+
+    r0, phi0 = dipole_foot_point(r, st, ct, sp, cp, beta)
+    lcol = (r0 >= rmi) * (r0 <= rmo)
+    v2 = np.zeros(r.size)
+    v2[lcol] = field_line_v2(
+        r[lcol], st[lcol], sp[lcol], r0[lcol], phi0[lcol], beta, star, V0, N_fl
+    )
+    laccr = v2 > 0
+
+    ma = np.deg2rad(beta)
+    # Br at r = 1, as in Grid.add_mag
+    Br = -2.0 * star._m0 * (st * cp * np.sin(ma) + ct * np.cos(ma))
+    flux = -Br * np.sign(ct) * laccr
+    mass_flux = flux.sum() * dOmega
+    f_shock = np.count_nonzero(flux > 0) * dOmega / (4 * np.pi)
+    return mass_flux, f_shock
+
+
 def _old_bin_format_to_new(fold, fnew):
     """
     *** Not tested yet ***
@@ -13,6 +13,7 @@ setup(
     author="Benjamin Tessore",
     license="MIT",
     packages=["ctts_env"],
+    extras_require={"store": ["h5py"], "numba": ["numba"]},
     zip_safe=False,
 )
 
@@ -22,23 +22,8 @@ from matplotlib.colors import LogNorm, Normalize, PowerNorm, SymLogNorm, TwoSlop
 ##########################################################################################
 
 
-def shock_surface_MK(Rt, beta):
-    """
-    Approximation for Rt >> 1
-    from Mahdavi & Kenyon 98
-    """
-    return 1 / Rt * np.cos(np.deg2rad(beta)) * 0.25
-
-
-def shock_surface_kulkarni(rmi, rmo, beta):
-    """
-    Kulkarni & Romanova, MNRAS 433, 3048–3061 (2013)
-    \S 4.2.1, Eqs. 2 and 3.
-    """
-    sin2 = np.sin(np.pi / 2 - np.deg2rad(beta)) ** 2
-    sto2 = 1 / rmo * sin2
-    sti2 = 1 / rmi * sin2
-    return np.sqrt(1.0 - sto2) - np.sqrt(1.0 - sti2)
+shock_surface_MK = ctts_env.shock.mahdavi_kenyon98
+shock_surface_kulkarni = ctts_env.shock.kulkarni13
 
 
 def T_kin(rho, vr, f=3 / 4):
@@ -78,10 +63,7 @@ def plot_shock_surface(
     r, t, p = np.meshgrid(rr, tt, pp, indexing="ij")
 
     g = ctts_env.Grid(r, t, p)
-    g.calc_cells_surface()
-
-    S_cells = g.surface
-    S_cells *= 4 * np.pi / S_cells.sum()
+    S_cells = g.surface * 4 * np.pi / g.surface.sum()
 
     beta_ma = np.linspace(obliquity_limits[0], obliquity_limits[1], Nobliquity)
 
@@ -90,6 +72,8 @@ def plot_shock_surface(
 
     analytical_surf = 100 * ctts_env.utils.shock_area(rmi, rmo - rmi, beta=beta_ma)
     kulkarni = shock_surface_kulkarni(rmi, rmo, beta_ma)
+    # numeric shock area on the stellar surface only, for all obliquities at once
+    S_surf = 100 * ctts_env.shock.shock_table(beta_ma, rmi, rmo, star=star)["area"]
 
     for k, tilt in enumerate(beta_ma):
         # g.add_magnetosphere_v1(star, rmi=rmi, rmo=rmo, Mdot=Mdot, beta=tilt)
@@ -154,6 +138,7 @@ def plot_shock_surface(
     )
     ax.plot(beta_ma, S, ".-b", label="")
     ax.plot(beta_ma, S_check, "xb", label="")
+    ax.plot(beta_ma, S_surf, "-r", label="surface quadrature")
     ax.set_ylabel("Shock area (% stellar surface)")
     ax.legend()
     ax.set_xlabel("magnetic obliquity [deg]")
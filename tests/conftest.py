@@ -0,0 +1,31 @@
+"""
+Shared helpers of the tests: a star and a factory of small structured grids.
+"""
+
+import ctts_env
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+def make_grid(Nr=16, Nt=16, Np=8, rmax=10.0, **kwargs):
+    """
+    Structured grid (Nr, Nt, Np), logarithmic in r from 1 to rmax, covering the
+    whole sphere. kwargs are passed to Grid().
+    """
+    rr = np.geomspace(1.0, rmax, Nr)
+    tt = np.linspace(1e-5, np.pi - 1e-5, Nt)
+    pp = np.linspace(0, 2 * np.pi, Np, endpoint=False)
+    return ctts_env.Grid(*np.meshgrid(rr, tt, pp, indexing="ij"), **kwargs)
+
+
+@pytest.fixture(name="make_grid")
+def make_grid_fixture():
+    return make_grid
+
+
+@pytest.fixture
+def star():
+    return ctts_env.Star(2.0, 0.8, 4000, 5.0, 1.0)
@@ -0,0 +1,90 @@
+"""
+The numpy and numba backends give the same results (skipped without numba).
+"""
+
+from ctts_env import backend, utils
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+requires_numba = pytest.mark.skipif(
+    "numba" not in backend.available(), reason="numba is not installed"
+)
+
+
+def _both(func, *args, **kwargs):
+    """
+    Results of func with the numpy and numba backends.
+    """
+    b0 = backend.get_backend()
+    out = []
+    try:
+        for name in ["numpy", "numba"]:
+            backend.set_backend(name)
+            out.append(func(*args, **kwargs))
+    finally:
+        backend.set_backend(b0)
+    return out
+
+
+@requires_numba
+def test_field_line_v2(star):
+    rng = np.random.default_rng(1)
+    n = 5000
+    r = rng.uniform(1, 6, n)
+    theta = rng.uniform(0, np.pi, n)
+    phi = rng.uniform(0, 2 * np.pi, n)
+    st, ct, sp, cp = np.sin(theta), np.cos(theta), np.sin(phi), np.cos(phi)
+    for beta in [0, 10, 30]:
+        r0, phi0 = utils.dipole_foot_point(r, st, ct, sp, cp, beta)
+        mask = (r0 >= 2) & (r0 <= 6)
+        a, b = _both(
+            utils.field_line_v2,
+            r[mask],
+            st[mask],
+            sp[mask],
+            r0[mask],
+            phi0[mask],
+            beta,
+            star,
+            V0=1e3,
+            N_fl=1000,
+        )
+        assert np.array_equal(a > 0, b > 0)
+        assert np.allclose(a, b, rtol=1e-10, atol=0)
+    return
+
+
+@requires_numba
+def test_surface_integral():
+    rng = np.random.default_rng(2)
+    t = np.linspace(1e-5, np.pi - 1e-5, 51)
+    p = np.linspace(0, 2 * np.pi, 33)
+    q = rng.uniform(0, 1, (t.size, p.size))
+    for args in [
+        (t, p, q),
+        (t, p[:1], q[:, :1], True),
+        (t[:26], p[:1], q[:26, :1], True),
+    ]:
+        (S0, dO0), (S1, dO1) = _both(utils.surface_integral, *args)
+        assert np.allclose([S0, dO0], [S1, dO1], rtol=1e-12, atol=0)
+    return
+
+
+@requires_numba
+def test_add_mag(make_grid, star):
+
+    def build(beta, Np):
+        g = make_grid(32, 32, Np)
+        g.add_mag(star, rmi=2.2, rmo=3.0, beta=beta, V0=1e3)
+        return g
+
+    for beta, Np in [(0, 1), (10, 24)]:
+        g0, g1 = _both(build, beta, Np)
+        assert np.array_equal(g0._laccr, g1._laccr)
+        for field in ["rho", "T", "v"]:
+            assert np.allclose(getattr(g0, field), getattr(g1, field), rtol=1e-8)
+    return
@@ -0,0 +1,46 @@
+"""
+The benchmark suite (benchmarks/bench_grid.py) runs on small grids.
+"""
+
+import importlib.util
+import json
+import os
+
+import pytest
+
+##########################################################################################
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def bench():
+    path = os.path.join(root, "benchmarks", "bench_grid.py")
+    spec = importlib.util.spec_from_file_location("bench_grid", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize("mode", ["2.5d", "3d"])
+def test_cases(bench, mode):
+    for name in bench.cases:
+        rec = bench.run_case(name, 12, mode)
+        assert rec["case"] == name and rec["wall_s"] >= 0
+        assert rec["Ncells"] == 12 * 12 * (1, 12)[mode == "3d"]
+    return
+
+
+def test_run_all_and_compare(bench, tmp_path, monkeypatch, capsys):
+    # the cases run in subprocesses, which import ctts_env from the tree
+    monkeypatch.setenv("PYTHONPATH", root)
+    results = bench.run_all(["add_mag", "_write"], [8], ["3d"], verbose=False)
+    assert [r["case"] for r in results] == ["add_mag", "_write"]
+    assert not any("error" in r for r in results)
+    path = tmp_path / "bench.json"
+    json.dump({"results": results}, open(path, "w"))
+    bench.compare(path, path)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3 and lines[1].split()[-2:] == ["1.000", "1.000"]
+    return
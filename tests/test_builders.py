@@ -0,0 +1,83 @@
+"""
+Builders: progress callbacks, cancellation and thread-parallel execution.
+"""
+
+import ctts_env
+
+import numpy as np
+import pytest
+import threading
+
+##########################################################################################
+
+
+def test_progress(make_grid, star):
+    g = make_grid(24, 24, 16)
+    calls = []
+    g.add_mag(star, beta=10, V0=1e3, progress=lambda d, t: calls.append((d, t)))
+    assert calls[0] == (0, g.Ncells) and calls[-1] == (g.Ncells, g.Ncells)
+    assert len(calls) > 2
+    return
+
+
+def test_cancel(make_grid, star):
+    g = make_grid(24, 24, 16, nthreads=3)
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(ctts_env.BuildCancelled):
+        g.add_mag(star, beta=10, V0=1e3, cancel=cancel)
+
+    # cancelled from the worker threads of _parallel
+    cancel = threading.Event()
+
+    def progress(done, total):
+        if done > 0:
+            cancel.set()
+
+    with pytest.raises(ctts_env.BuildCancelled):
+        g.add_conical_stellar_wind(
+            star, Rej=4, thetao=20, progress=progress, cancel=cancel
+        )
+    return
+
+
+def test_nested_builders(make_grid, star):
+    g = make_grid(24, 24, 16)
+    cancel = threading.Event()
+    outer = []
+
+    def progress(done, total):
+        outer.append(done)
+        if len(outer) == 1:
+            # a builder called during the build, without callback nor token
+            inner = []
+            g.add_dark_disc(5.0, progress=lambda d, t: inner.append(d))
+            assert inner == [0, g.Ncells]
+            cancel.set()
+
+    # the outer callback and token are restored after the inner builder
+    with pytest.raises(ctts_env.BuildCancelled):
+        g.add_mag(star, beta=10, V0=1e3, progress=progress, cancel=cancel)
+    assert outer == [0]
+    return
+
+
+def test_concurrent_builders(make_grid, star):
+    # a builder runs in another thread on the same grid during add_mag
+    g = make_grid(24, 24, 16)
+    calls = {"mag": [], "disc": []}
+
+    def build_disc():
+        g.add_dark_disc(5.0, progress=lambda d, t: calls["disc"].append(d))
+
+    def progress(done, total):
+        calls["mag"].append(done)
+        if len(calls["mag"]) == 1:
+            thread = threading.Thread(target=build_disc)
+            thread.start()
+            thread.join()
+
+    g.add_mag(star, beta=10, V0=1e3, progress=progress)
+    assert calls["disc"] == [0, g.Ncells]
+    assert len(calls["mag"]) > 2 and calls["mag"][-1] == g.Ncells
+    return
@@ -0,0 +1,72 @@
+"""
+On-disk model cache (ctts_env.ModelCache).
+"""
+
+import ctts_env
+
+import numpy as np
+import os
+import pytest
+
+h5py = pytest.importorskip("h5py")
+
+##########################################################################################
+
+
+def _calls(star, **kwargs):
+    return [("add_mag", dict(star=star, rmi=2.2, rmo=3.0, V0=1e3, **kwargs))]
+
+
+def test_hit_and_miss(tmp_path, make_grid, star):
+    cache = ctts_env.ModelCache(tmp_path)
+    a = cache.build(make_grid(), _calls(star, beta=10))
+    assert (cache.hits, cache.misses) == (0, 1)
+    b = make_grid()
+    assert cache.build(b, _calls(star, beta=10.0, verbose=True)) is b
+    assert (cache.hits, cache.misses) == (1, 1)
+    for name in ["rho", "T", "v", "regions", "_laccr"]:
+        assert np.array_equal(getattr(a, name), getattr(b, name))
+    assert b._recipe == a._recipe
+
+    # another model, another grid or a grid already modified
+    cache.build(make_grid(), _calls(star, beta=20))
+    cache.build(make_grid(rmax=8.0), _calls(star, beta=10))
+    c = make_grid()
+    c.rho[0] = 1.0
+    cache.build(c, _calls(star, beta=10))
+    assert (cache.hits, cache.misses) == (1, 4)
+    return
+
+
+def test_corrupt_entry(tmp_path, make_grid, star):
+    cache = ctts_env.ModelCache(tmp_path)
+    grid = make_grid()
+    path = cache._path(cache.key(grid, _calls(star)))
+    for content in [b"not an hdf5 file", None]:
+        if content is None:
+            # valid HDF5 file without the model
+            h5py.File(path, "w").close()
+        else:
+            with open(path, "wb") as f:
+                f.write(content)
+        cache.build(make_grid(), _calls(star))
+    assert (cache.hits, cache.misses) == (0, 2)
+    cache.build(make_grid(), _calls(star))
+    assert cache.hits == 1
+    return
+
+
+def test_evict(tmp_path, make_grid, star):
+    cache = ctts_env.ModelCache(tmp_path)
+    for beta in [0, 10, 20]:
+        cache.build(make_grid(), _calls(star, beta=beta))
+    entries = cache.entries()
+    assert len(entries) == 3
+    # the least recently used first
+    os.utime(entries[0][0], (0, 0))
+    cache.evict(cache.size() - 1)
+    assert len(cache.entries()) == 2
+    assert entries[0][0] not in [e[0] for e in cache.entries()]
+    cache.clear()
+    assert cache.entries() == []
+    return
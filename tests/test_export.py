@@ -0,0 +1,74 @@
+"""
+Background export of the models: snapshots, bounded queue and errors.
+"""
+
+from ctts_env.export import ExportQueue, snapshot
+
+import numpy as np
+import pytest
+import threading
+
+##########################################################################################
+
+
+def test_snapshot(make_grid):
+    g = make_grid()
+    g.rho[:] = 1.0
+    snap = snapshot(g)
+    # fields copied, coordinates shared, all read-only
+    assert not np.shares_memory(snap.rho, g.rho)
+    assert np.shares_memory(snap.r, g.r)
+    assert not snap.rho.flags.writeable and not snap.r.flags.writeable
+    g.rho[:] = 2.0
+    assert np.all(snap.rho == 1.0)
+    return
+
+
+def test_bounded_queue(make_grid):
+    release = threading.Event()
+    started = threading.Event()
+
+    def export(grid, path):
+        started.set()
+        release.wait(10)
+        return path
+
+    queue = ExportQueue(maxsize=1, snapshot=False)
+    futures = [queue.submit(make_grid(), "0", method=export)]
+    # the writer holds the first model, the second one waits in the queue
+    assert started.wait(10)
+    futures.append(queue.submit(make_grid(), "1", method=export))
+    assert queue.pending() == 1
+
+    # the queue is full: a third submit blocks until a model is written
+    blocked = threading.Thread(
+        target=lambda: futures.append(queue.submit(make_grid(), "2", method=export))
+    )
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    assert len(futures) == 2
+
+    release.set()
+    blocked.join(10)
+    assert not blocked.is_alive()
+    queue.close()
+    assert [f.result() for f in futures] == ["0", "1", "2"]
+    return
+
+
+def test_error_raised_by_close(make_grid):
+    def export(grid, path):
+        raise ValueError("cannot write %s" % path)
+
+    queue = ExportQueue(maxsize=2, snapshot=False)
+    future = queue.submit(make_grid(), "model.bin", method=export)
+    with pytest.raises(ValueError):
+        queue.close()
+    assert isinstance(future.exception(), ValueError)
+
+    # with the context manager
+    with pytest.raises(ValueError):
+        with ExportQueue() as queue:
+            queue.submit(make_grid(), "model.bin", method=export)
+    return
@@ -0,0 +1,33 @@
+"""
+Geometry of the cells: exact volumes and surfaces.
+"""
+
+from ctts_env.utils import centres_to_limits
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+def test_volume_and_surface(make_grid):
+    g = make_grid(16, 12, 8)
+    rl = centres_to_limits(g.grid[0], 0, np.inf)
+    # the cells tile the spherical shell and each sphere exactly
+    assert g.volume.sum() == pytest.approx(4 * np.pi / 3 * (rl[-1] ** 3 - rl[0] ** 3))
+    assert np.allclose(g.surface.sum(axis=(1, 2)), 4 * np.pi * g.grid[0] ** 2)
+    assert np.all(g.volume > 0)
+    # computed once, read-only, without storing the constant axes (phi)
+    assert g.volume is g.volume
+    assert not g.volume.flags.writeable
+    assert g.volume.strides[2] == 0
+    return
+
+
+def test_external_volume(make_grid):
+    g = make_grid(8, 8, 4)
+    vol = np.full(g.shape, 2.0)
+    g.calc_cells_volume(vol)
+    assert np.all(g.volume == 2.0)
+    assert np.allclose(g._smoothing_length, 2.0 ** (1 / 3) / 3)
+    return
@@ -0,0 +1,70 @@
+"""
+Memory layout of the fields (Grid(..., order="F")) and the MCFOST export.
+"""
+
+from ctts_env import store
+from ctts_env.classgrid import _fortran_buffer
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+def _fields_f(g):
+    for name in ["rho", "T", "ne", "regions"]:
+        assert getattr(g, name).T.flags.c_contiguous, name
+    for name in ["v", "B"]:
+        assert all(q.T.flags.c_contiguous for q in getattr(g, name)), name
+    return True
+
+
+def test_order(make_grid, star):
+    with pytest.raises(ValueError):
+        make_grid(order="A")
+    c = make_grid(order="C")
+    f = make_grid(order="F")
+    assert _fields_f(f) and c.rho.flags.c_contiguous
+    for g in (c, f):
+        g.add_mag(star, rmi=2.2, rmo=3.0, beta=10, V0=1e3)
+        g.add_disc_wind_knigge95(star, Rin=4, Rout=8)
+        g.rotate_phase(0.25)
+    assert _fields_f(f) and _fields_f(f.refine(2, rmax=3.0))
+    for name in ["rho", "T", "ne", "v", "B", "regions"]:
+        assert np.array_equal(getattr(c, name), getattr(f, name))
+
+    # resampled onto a Fortran-ordered grid
+    other = make_grid(8, 8, 4, order="F")
+    c.resample_to(other, fields=["rho", "v"])
+    assert _fields_f(other)
+    return
+
+
+def test_write(tmp_path, make_grid, star):
+    files = []
+    for order in ["C", "F"]:
+        g = make_grid(order=order)
+        g.add_mag(star, rmi=2.2, rmo=3.0, V0=1e3)
+        path = tmp_path / ("model_%s.bin" % order)
+        g._write(str(path))
+        files.append(path.read_bytes())
+    assert files[0] == files[1]
+
+    # (Np, Nt, Nr) buffers, without copy for the Fortran layout
+    assert _fortran_buffer(g.rho).tobytes() == g.rho.T.tobytes()
+    assert np.shares_memory(np.asarray(_fortran_buffer(g.rho)), g.rho)
+    tail = np.frombuffer(files[0][-g.Ncells * 4 :], dtype=np.int32)
+    assert np.array_equal(tail, np.minimum(g.regions, 1).T.ravel())
+    return
+
+
+def test_store(tmp_path, make_grid, star):
+    pytest.importorskip("h5py")
+    g = make_grid(order="F")
+    g.add_mag(star, rmi=2.2, rmo=3.0, V0=1e3)
+    path = tmp_path / "model.h5"
+    store.save(g, path)
+    h = store.load(path)
+    assert h.order == "F" and _fields_f(h)
+    assert np.array_equal(h.rho, g.rho) and np.array_equal(h.v, g.v)
+    return
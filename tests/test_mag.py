@@ -0,0 +1,156 @@
+"""
+Accreting magnetosphere (add_mag): normalisation, fast paths and dead zone.
+"""
+
+import ctts_env
+from ctts_env import utils
+from ctts_env.constants import Msun_per_year_to_SI
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+def _cloud(make_grid, mask=Ellipsis):
+    """
+    Unstructured grid of the cells of a structured grid.
+    """
+    g = make_grid(40, 60, 32)
+    return ctts_env.Grid(g.r.ravel()[mask], g.theta.ravel()[mask], g.phi.ravel()[mask])
+
+
+def test_surface_integral_binned():
+    Nt = 8
+    t = np.arccos(1 - (np.arange(Nt) + 0.5) * 2 / Nt)
+    t, p = (q.ravel() for q in np.meshgrid(t, (np.arange(2 * Nt) + 0.5) * np.pi / Nt))
+    ibin = utils.surface_bins(t, p, Nt, 2 * Nt)
+    S, dOmega = utils.surface_integral_binned(ibin, 2 * Nt**2, np.ones(t.size))
+    assert np.isclose(S, 4 * np.pi) and dOmega == 1
+    # half of the sphere empty
+    north = t < np.pi / 2
+    with pytest.raises(ValueError):
+        utils.surface_integral_binned(ibin[north], 2 * Nt**2, np.ones(north.sum()))
+    S, dOmega = utils.surface_integral_binned(
+        ibin[north], 2 * Nt**2, np.ones(north.sum()), min_coverage=0
+    )
+    assert np.isclose(S, 4 * np.pi) and dOmega == 0.5
+    return
+
+
+def test_unstructured_normalisation(make_grid, star):
+    g = _cloud(make_grid)
+    g.add_mag(star, rmi=2.2, rmo=3.0, V0=1e3)
+    assert np.any(g._laccr)
+    shell = g._inner_shell()
+    rhovr = -g.rho[shell] * g.v[0][shell]
+    mass_flux = g._shell_integral(rhovr)[0] * star.R_m**2
+    assert np.isclose(mass_flux, 1e-8 * Msun_per_year_to_SI, rtol=1e-8)
+
+    # the shell is cached for the last width only
+    assert np.count_nonzero(g._inner_shell(dr=0.5)) > np.count_nonzero(shell)
+    assert np.array_equal(g._inner_shell(), shell)
+    return
+
+
+def test_unstructured_sparse_shell(make_grid, star):
+    # points in the northern hemisphere only: the normalisation is refused
+    g = _cloud(make_grid, make_grid(40, 60, 32).theta.ravel() < np.pi / 2)
+    with pytest.raises(ValueError):
+        g.add_mag(star, rmi=2.2, rmo=3.0, V0=1e3)
+    return
+
+
+def _same_model(g, cloud):
+    """
+    Same cells accreting, same velocities and temperatures, and densities equal
+    up to the normalisation, on a structured grid and on the cloud of its cells.
+    """
+    assert np.array_equal(g._laccr.ravel(), cloud._laccr)
+    assert np.any(cloud._laccr)
+    assert np.allclose(g.v.reshape(3, -1), cloud.v, rtol=1e-10, atol=0)
+    assert np.allclose(g.T.ravel(), cloud.T, rtol=1e-10, atol=0)
+    ratio = g.rho.ravel()[cloud._laccr] / cloud.rho[cloud._laccr]
+    assert np.allclose(ratio, ratio[0], rtol=1e-10)
+    return
+
+
+def test_axisymmetric_fast_path(make_grid, star):
+    # theta not symmetric about the midplane: the fast path in phi only
+    rr = np.geomspace(1.0, 10.0, 24)
+    tt = np.linspace(1e-5, np.pi - 0.05, 47)
+    pp = np.linspace(0, 2 * np.pi, 32, endpoint=False)
+    g = ctts_env.Grid(*np.meshgrid(rr, tt, pp, indexing="ij"))
+    g.add_mag(star, V0=1e3)
+    cloud = ctts_env.Grid(g.r.ravel(), g.theta.ravel(), g.phi.ravel())
+    cloud.add_mag(star, V0=1e3)
+    _same_model(g, cloud)
+    # the model does not depend on phi
+    assert np.all(g.rho == g.rho[:, :, :1])
+    return
+
+
+def test_hemisphere_mirror(make_grid, star):
+    # theta symmetric about the midplane: the northern half is mirrored
+    g = make_grid(24, 48, 32)
+    assert g._equatorial_symmetry()
+    cloud = ctts_env.Grid(g.r.ravel(), g.theta.ravel(), g.phi.ravel())
+    g.add_mag(star, V0=1e3)
+    cloud.add_mag(star, V0=1e3)
+    _same_model(g, cloud)
+
+    g = make_grid(24, 48, 32)
+    cloud = ctts_env.Grid(g.r.ravel(), g.theta.ravel(), g.phi.ravel())
+    g.add_disc_wind_knigge95(star, Rin=4, Rout=8)
+    cloud.add_disc_wind_knigge95(star, Rin=4, Rout=8)
+    assert np.array_equal(g.regions.ravel(), cloud.regions)
+    assert np.any(cloud.regions == 2)
+    for name in ["rho", "T"]:
+        q = getattr(g, name).ravel()
+        assert np.allclose(q, getattr(cloud, name), rtol=1e-8, atol=0)
+    assert np.allclose(g.v.reshape(3, -1), cloud.v, rtol=1e-8, atol=1e-6)
+    return
+
+
+def test_dead_zone(make_grid, star):
+    g = make_grid(24, 24, 16)
+    with pytest.raises(RuntimeError):
+        g.setup_dead_zone(star, 1e-12, 8000)
+    g.add_mag(star, rmi=2.2, rmo=3.0, V0=1e3)
+    # closed field lines inside rmi (beta = 0: r0 = r / sin(theta)**2)
+    assert np.array_equal(g._ldead_zone, g.r / np.sin(g.theta) ** 2 < 2.2)
+    g.setup_dead_zone(star, 1e-12, 8000)
+    assert np.array_equal(g.regions == 4, g._ldead_zone)
+    assert np.all(g.rho[g.regions == 4] == 1e-12)
+
+    # oblique dipole, foot radii of the last obliquity only
+    g.setup_dead_zone(star, 1e-12, 8000, rmi=2.0, beta=20)
+    r0, _ = utils.dipole_foot_point(g.r, g._st, g._ct, g._sp, g._cp, 20)
+    assert np.array_equal(g._ldead_zone, r0 < 2.0)
+    assert list(g._foot_cache) == [(20, 0.0)]
+    return
+
+
+def test_surface_normalisation(make_grid, star):
+    # aligned dipole: analytic mass flux (eta = 1) and shock area
+    mass_flux, f_shock = utils.dipole_surface_flux(star, 2.2, 3.0, V0=1e3, Nt=4000)
+    assert np.isclose(mass_flux, 4 * np.pi * star._m0 * (1 / 2.2 - 1 / 3.0), rtol=2e-3)
+    assert np.isclose(f_shock, np.sqrt(1 - 1 / 3.0) - np.sqrt(1 - 1 / 2.2), rtol=2e-3)
+
+    # the density of the grid is normalised on the surface, whatever the grid
+    g = make_grid(16, 16, 8)
+    g.add_mag(star, rmi=2.2, rmo=3.0, V0=1e3, Nsurf=4000)
+    assert g._f_shock == f_shock
+    lc = g._laccr
+    B = g.get_B_module()[lc]
+    v = np.sqrt(g.v[0] ** 2 + g.v[1] ** 2 + (g.v[2] - star._veq * g.R) ** 2)[lc]
+    eta = g.rho[lc] * v / B * mass_flux * star.R_m**2
+    assert np.allclose(eta, 1e-8 * Msun_per_year_to_SI, rtol=1e-10)
+
+    # the inner shell of a coarse grid gives another normalisation
+    h = make_grid(16, 16, 8)
+    h.add_mag(star, rmi=2.2, rmo=3.0, V0=1e3)
+    assert np.array_equal(h._laccr, lc)
+    ratio = h.rho[lc] / g.rho[lc]
+    assert np.allclose(ratio, ratio[0], rtol=1e-10) and abs(ratio[0] - 1) > 0.1
+    return
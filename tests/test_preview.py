@@ -0,0 +1,83 @@
+"""
+Quick looks at a model: 3d preview points and projected maps.
+"""
+
+import ctts_env
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+def test_preview_points(make_grid):
+    g = make_grid(16, 16, 8)
+    g.rho[g.r < 3] = 1.0
+    g.T[:] = g.r
+    ncells = np.count_nonzero(g.rho)
+    x, y, z, T = g._preview_points("T")
+    assert x.size == ncells and np.all(T < 3)
+
+    # random subset of the cells, reproducible
+    sub = g._preview_points("T", max_points=100, seed=1)
+    assert sub[0].size == 100
+    assert np.all(np.isin(sub[0], x))
+    assert all(
+        np.array_equal(a, b) for a, b in zip(sub, g._preview_points("T", 100, seed=1))
+    )
+
+    # one voxel: the mean of the field at the centre
+    vx, vy, vz, vT = g._preview_points("T", voxels=1)
+    assert (vx, vy, vz) == ([0.0], [0.0], [0.0])
+    assert np.isclose(vT[0], g.T[g.rho > 0].mean())
+    return
+
+
+def test_cartesian_volume(make_grid):
+    g = make_grid(16, 16, 8, rmax=4.0)
+    g.rho[:] = 1.0
+    X, Y, Z, values = g._cartesian_volume("rho", 9, 6.0)
+    assert g._cartesian_volume("rho", 9, 6.0)[3] is values
+    R = np.sqrt(X**2 + Y**2 + Z**2)
+    assert np.allclose(values[(R > 1) & (R < 4)], 1.0, rtol=1e-12)
+    assert np.all(values[(R < 1) | (R > 4)] == 0)
+    return
+
+
+def test_projected_map(make_grid):
+    g = make_grid(32, 32, 16, rmax=4.0)
+    g.rho[:] = 1.0
+    image, extent = g.projected_map(incl=0, quantity="rho", Npix=16)
+    assert extent == (-4.0, 4.0, -4.0, 4.0)
+    u = (np.arange(16) + 0.5) / 16 * 8 - 4
+    b = np.sqrt(u[None, :] ** 2 + u[:, None] ** 2)
+    # uniform shell between 1 and 4 Rstar, the back half hidden by the star
+    front = np.sqrt(np.maximum(0, 16 - b**2))
+    expected = np.where(b < 1, front - np.sqrt(np.maximum(0, 1 - b**2)), 2 * front)
+    ring = (b < 3.5) & (abs(b - 1) > 0.2)
+    assert np.allclose(image[ring], expected[ring], rtol=0.03)
+    assert np.all(image[b > 4] == 0)
+
+    threaded, _ = g.projected_map(
+        incl=60, phase=0.3, quantity="rho2", Npix=16, chunk_size=2**12, nthreads=3
+    )
+    assert np.array_equal(
+        threaded, g.projected_map(incl=60, phase=0.3, quantity="rho2", Npix=16)[0]
+    )
+    with pytest.raises(ValueError):
+        g.projected_map(quantity="T")
+    return
+
+
+def test_projected_map_hemisphere(make_grid):
+    # 2d grids covering theta <= pi/2 are mirrored below the midplane
+    rr = np.geomspace(1.0, 4.0, 24)
+    full = make_grid(24, 48, 1, rmax=4.0)
+    tt = full.grid[1][:24]
+    north = ctts_env.Grid(*np.meshgrid(rr, tt, [0.0], indexing="ij"))
+    for g in (full, north):
+        g.rho[:] = np.cos(g.theta) ** 2 / g.r**2
+    a = full.projected_map(incl=70, quantity="rho", Npix=16, Ns=400)[0]
+    b = north.projected_map(incl=70, quantity="rho", Npix=16, Ns=400)[0]
+    assert np.allclose(a, b, rtol=1e-10, atol=0)
+    return
@@ -0,0 +1,60 @@
+"""
+Opt-in instrumentation of the Grid() methods (ctts_env.profiling).
+"""
+
+import ctts_env
+from ctts_env import profiling
+
+import json
+import threading
+
+##########################################################################################
+
+
+def test_profile(make_grid, star, tmp_path):
+    add_mag = ctts_env.Grid.add_mag
+    g = make_grid(24, 24, 16)
+    with profiling.profile():
+        assert ctts_env.Grid.add_mag is not add_mag
+        g.add_mag(star, V0=1e3)
+        g.add_mag(star, V0=1e3)
+    # the methods are restored
+    assert ctts_env.Grid.add_mag is add_mag
+    p = g._profile["add_mag"]
+    assert p["calls"] == 2 and p["time_s"] > 0 and p["alloc_peak_B"] > 0
+    # cells not counted by default, surface_integral charged to the grid
+    assert p["cells"] == 0
+    assert g._profile["surface_integral"]["cells"] > 0
+
+    path = tmp_path / "profile.json"
+    g.write_profile(path)
+    assert json.load(open(path)) == g._profile
+    return
+
+
+def test_count_cells(make_grid, star):
+    g = make_grid(24, 24, 16)
+    with profiling.profile(count_cells=True):
+        g.add_mag(star, V0=1e3)
+    assert g._profile["add_mag"]["cells"] == (g.regions == 1).sum()
+    return
+
+
+def test_threads(make_grid, star):
+    # the calls made from each thread are charged to the grid of that thread
+    grids = [make_grid(24, 24, 16) for _ in range(4)]
+    with profiling.profile():
+        grids[0].add_mag(star, V0=1e3)
+        threads = [
+            threading.Thread(target=g.add_mag, args=(star,), kwargs={"V0": 1e3})
+            for g in grids[1:]
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    ncalls = grids[0]._profile["surface_integral"]["calls"]
+    for g in grids:
+        assert g._profile["add_mag"]["calls"] == 1
+        assert g._profile["surface_integral"]["calls"] == ncalls
+    return
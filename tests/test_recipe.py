@@ -0,0 +1,58 @@
+"""
+Recipes of the models: recording, writing and replaying the builder calls.
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+def _build(g, star):
+    g.add_mag(star, rmi=2.2, rmo=3.0, beta=10, V0=1e3)
+    g.setup_dead_zone(star, 1e-12, 8000)
+    g.add_dark_disc(5.0)
+    return g
+
+
+def test_get_recipe(make_grid, star):
+    g = _build(make_grid(), star)
+    recipe = g.get_recipe()
+    assert [c["method"] for c in recipe] == [
+        "add_mag",
+        "setup_dead_zone",
+        "add_dark_disc",
+    ]
+    # all the arguments, defaults included, and the stars by their parameters
+    args = recipe[0]["args"]
+    assert args["beta"] == 10 and args["Mdot"] == 1e-8
+    assert args["star"] == {"Star": star._params()}
+    assert json.loads(json.dumps(recipe)) == recipe
+    # a copy
+    recipe.clear()
+    assert len(g._recipe) == 3
+    return
+
+
+def test_replay(tmp_path, make_grid, star):
+    g = _build(make_grid(), star)
+    path = str(tmp_path / "recipe.json")
+    g.write_recipe(path)
+    for recipe in [g.get_recipe(), path]:
+        h = make_grid()
+        h.replay(recipe)
+        for name in ["rho", "T", "v", "B", "regions"]:
+            assert np.array_equal(getattr(h, name), getattr(g, name))
+        assert h.get_recipe() == g.get_recipe()
+
+    # same model at another resolution
+    h = make_grid(24, 24, 12)
+    h.replay(path)
+    assert h.get_recipe() == g.get_recipe()
+    assert np.any(h.regions == 4)
+
+    with pytest.raises(ValueError):
+        make_grid().replay([{"method": "check_finite", "args": {}}])
+    return
@@ -0,0 +1,56 @@
+"""
+Nested radial patches: refine and project.
+"""
+
+import ctts_env
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+def test_refine(make_grid):
+    g = make_grid(16, 16, 8)
+    p = g.refine(factor=(2, 3, 2), rmax=4.0)
+    n = np.count_nonzero(g.grid[0] <= 4.0)
+    # the centres of the covered cells, and of the first cell not covered
+    assert np.array_equal(p.grid[0][::2], g.grid[0][: n + 1])
+    assert np.array_equal(p.grid[1][::3], g.grid[1])
+    assert np.allclose(p.grid[2][::2], g.grid[2], rtol=0, atol=1e-14)
+    assert p.shape == (2 * n + 1, 3 * 15 + 1, 16)
+    assert make_grid(16, 16, 1).refine(2).shape[2] == 1
+
+    rr, tt, pp = g.grid
+    h = ctts_env.Grid(*np.meshgrid(rr[::-1], tt, pp, indexing="ij"))
+    with pytest.raises(ValueError):
+        h.refine()
+    return
+
+
+def test_project(make_grid, star):
+    g = make_grid(16, 16, 8)
+    g.rho[:] = 5.0
+    g.T[:] = 100.0
+    p = g.refine(2, rmax=4.0)
+    p.rho[:] = 2.0
+    p.T[:] = 1e4
+    p.regions[:] = 1
+    g.project(p)
+    cover = g.r <= 4.0
+    assert np.allclose(g.rho[cover], 2.0) and np.allclose(g.T[cover], 1e4)
+    assert np.all(g.regions[cover] == 1)
+    assert np.all(g.rho[~cover] == 5.0) and np.all(g.regions[~cover] == 0)
+    with pytest.raises(ValueError):
+        make_grid(12, 16, 8).project(p)
+
+    # a model built on the patch, mass approximately conserved (the cells of
+    # the patch do not exactly tile those of the grid)
+    p = g.refine(2, rmax=4.0)
+    p.add_mag(star, rmi=2.2, rmo=3.0, V0=1e3)
+    lpatch = (p._parent[1] >= 0)[:, None, None]
+    mass = np.sum(p.rho * p.volume * lpatch)
+    g.project(p)
+    assert np.isclose(np.sum((g.rho * g.volume)[cover]), mass, rtol=0.15)
+    assert np.any(g.regions[cover] == 1)
+    return
@@ -0,0 +1,66 @@
+"""
+Resampling between grids (resample_to) and the cached interpolators.
+"""
+
+import ctts_env
+
+import numpy as np
+
+##########################################################################################
+
+
+def test_interpolator_cache(make_grid):
+    g = make_grid()
+    g.rho[:] = g.r
+    interp = g._get_interpolator("rho")
+    assert g._get_interpolator("rho") is interp
+
+    # direct edits of the fields invalidate the cached interpolators
+    other = make_grid(8, 8, 4)
+    g.rho[:] = 2.0
+    g.resample_to(other, fields=["rho"])
+    assert g._get_interpolator("rho") is not interp
+    assert np.allclose(other.rho, 2.0)
+    g.rho = g.rho + 1.0
+    g.resample_to(other, fields=["rho"])
+    assert np.allclose(other.rho, 3.0)
+
+    image, _ = g.projected_map(quantity="rho", Npix=8)
+    g.rho[:] = 0.0
+    assert np.all(g.projected_map(quantity="rho", Npix=8)[0] == 0)
+    assert np.any(image > 0)
+    return
+
+
+def test_resample_structured(make_grid):
+    g = make_grid(16, 16, 8, rmax=5.0)
+    g.rho[:] = 3.0 * g.r - 1.0
+    g.v[0] = g.r
+    g.regions[g.r > 2] = 2
+    other = make_grid(11, 7, 5, rmax=8.0)
+    g.resample_to(other, fields=["rho", "v", "regions"])
+    inside = other.r <= 5.0
+    # linear in r: exact inside, transparent outside
+    assert np.allclose(other.rho[inside], 3.0 * other.r[inside] - 1.0, rtol=1e-12)
+    assert np.all(other.rho[~inside] == 0) and np.all(other.v[:, ~inside] == 0)
+    assert np.allclose(other.v[0][inside], other.r[inside], rtol=1e-12)
+    assert other.regions.dtype == g.regions.dtype
+    assert set(np.unique(other.regions)) == {0, 2}
+
+    threaded = make_grid(11, 7, 5, rmax=8.0)
+    g.resample_to(threaded, fields=["rho", "v", "regions"], chunk_size=50, nthreads=3)
+    for f in ["rho", "v", "regions"]:
+        assert np.array_equal(getattr(threaded, f), getattr(other, f))
+    return
+
+
+def test_resample_unstructured(make_grid):
+    s = make_grid(8, 8, 4)
+    cloud = ctts_env.Grid(s.r.ravel(), s.theta.ravel(), s.phi.ravel())
+    cloud.rho[:] = np.arange(cloud.Ncells)
+    cloud.v[2] = cloud.r
+    # the cells of s are the points of the cloud: nearest is exact
+    cloud.resample_to(s, fields=["rho", "v"])
+    assert np.array_equal(s.rho.ravel(), cloud.rho)
+    assert np.array_equal(s.v[2].ravel(), cloud.v[2])
+    return
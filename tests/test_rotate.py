@@ -0,0 +1,83 @@
+"""
+Grid.rotate_phase and the models built at a non-zero rotational phase.
+"""
+
+import numpy as np
+
+##########################################################################################
+
+
+def test_build_after_rotation(make_grid, star):
+    # built at phase pi/2, or built at phase 0 then rotated by pi/2 (exact shift)
+    a = make_grid(24, 24, 16)
+    a.rotate_phase(np.pi / 2)
+    a.add_mag(star, rmi=2.2, rmo=3.0, beta=30)
+    a.setup_dead_zone(star, 1e-12, 5000)
+    b = make_grid(24, 24, 16)
+    b.add_mag(star, rmi=2.2, rmo=3.0, beta=30)
+    b.setup_dead_zone(star, 1e-12, 5000)
+    b.rotate_phase(np.pi / 2)
+
+    assert np.any(a._laccr)
+    assert not np.any(a._laccr & (a._ldead_zone > 0))
+    for attr in ["regions", "_laccr", "_ldead_zone"]:
+        assert np.array_equal(getattr(a, attr), getattr(b, attr))
+    for attr in ["T", "v", "B", "_v2_dead_zone"]:
+        assert np.allclose(getattr(a, attr), getattr(b, attr), rtol=1e-10, atol=0)
+    # the density is normalised by a quadrature in phi that is not periodic,
+    # it differs by a constant factor only
+    col = a._laccr
+    ratio = a.rho[col] / b.rho[col]
+    assert np.allclose(ratio, ratio[0], rtol=1e-10)
+    # the foot radii are computed once, at the phase of the model
+    assert list(a._foot_cache) == [(30, np.pi / 2)]
+    return
+
+
+def test_rotate_masks(make_grid, star):
+    g = make_grid(24, 24, 16)
+    g.add_mag(star, rmi=2.2, rmo=3.0, beta=30)
+    g.rotate_phase(0.3)
+    assert g._ldead_zone.dtype == bool and g._laccr.dtype == bool
+    assert set(np.unique(g.regions)) <= {0, 1}
+
+    # all the arrays of add_magnetosphere_v1 are rotated
+    a = make_grid(24, 24, 16)
+    a.add_magnetosphere_v1(star, beta=30)
+    b = make_grid(24, 24, 16)
+    b.rotate_phase(np.pi / 2)
+    b.add_magnetosphere_v1(star, beta=30)
+    a.rotate_phase(np.pi / 2)
+    for attr in ["regions", "_lmag", "_mcol", "_scol"]:
+        assert np.array_equal(getattr(a, attr), getattr(b, attr))
+    for attr in ["_rho_axi", "B", "_xp", "_yp", "_zp"]:
+        assert np.allclose(getattr(a, attr), getattr(b, attr), rtol=1e-10, atol=1e-12)
+    return
+
+
+def test_rotate_shift_and_interpolation(make_grid):
+    g = make_grid(4, 6, 16)
+    g.rho[:] = np.cos(g.phi)
+    g.regions[:] = np.arange(16)
+    rho = g.rho.copy()
+    # multiple of the step: exact cyclic shift
+    g.rotate_phase(2 * np.pi / 16 * 3)
+    assert np.array_equal(g.rho, np.roll(rho, 3, axis=2))
+    assert np.array_equal(g.regions[0, 0], np.roll(np.arange(16), 3))
+    # half a step: linear interpolation of rho, nearest for the regions
+    g.rotate_phase(np.pi / 16)
+    expected = 0.5 * (np.roll(rho, 3, axis=2) + np.roll(rho, 4, axis=2))
+    assert np.allclose(g.rho, expected, rtol=0, atol=1e-12)
+    assert g.regions.dtype.kind == "i"
+    assert np.isclose(g._phase, 7 * np.pi / 16)
+    return
+
+
+def test_rotate_2d(make_grid):
+    g = make_grid(8, 8, 1)
+    g.rho[:] = g.r * g.theta
+    rho = g.rho.copy()
+    g.rotate_phase(0.3)
+    assert g._phase == 0
+    assert np.array_equal(g.rho, rho)
+    return
@@ -0,0 +1,30 @@
+"""
+Shock footprint of a dipole over arrays of parameters (ctts_env.shock).
+"""
+
+from ctts_env import shock, utils
+
+import numpy as np
+
+##########################################################################################
+
+
+def test_shock_table(star):
+    beta = np.array([0.0, 10.0, 45.0])[:, None]
+    rmi = np.array([2.0, 2.2, 4.0])
+    table = shock.shock_table(beta, rmi, rmi + 1, Nt=60, Np=120, star=star, V0=1e3)
+    assert table["area"].shape == (3, 3) and np.all(table["rmo"] == rmi + 1)
+    for i, j in np.ndindex(3, 3):
+        mass_flux, f_shock = utils.dipole_surface_flux(
+            star, rmi[j], rmi[j] + 1, beta[i, 0], 1e3, Nt=60, Np=120
+        )
+        assert np.isclose(table["area"][i, j], f_shock, rtol=1e-12)
+        assert np.isclose(table["mass_flux"][i, j], mass_flux, rtol=1e-10)
+
+    # aligned dipole, every line accreting: the axisymmetric area
+    table = shock.shock_table(0, np.linspace(2, 6, 5), 8.0, Nt=40000)
+    assert np.allclose(table["area"], table["area_axisym"], rtol=1e-3)
+    assert np.allclose(table["area_axisym"], table["area_kulkarni"])
+    # beyond every foot point
+    assert shock.shock_table(0, 1e5, 2e5)["area"] == 0
+    return
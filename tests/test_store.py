@@ -0,0 +1,72 @@
+"""
+HDF5 store of models (ctts_env.store).
+"""
+
+import ctts_env
+from ctts_env import store
+
+import numpy as np
+import pytest
+
+pytest.importorskip("h5py")
+
+##########################################################################################
+
+
+def _model(make_grid, star):
+    g = make_grid(16, 16, 8)
+    g.add_mag(star, rmi=2.2, rmo=3.0, V0=1e3)
+    g.setup_dead_zone(star, 1e-12, 8000)
+    return g
+
+
+def test_round_trip(tmp_path, make_grid, star):
+    g = _model(make_grid, star)
+    path = tmp_path / "model.h5"
+    store.save(g, path, star=star)
+    h = store.load(path)
+    for name in store.grid_fields + ["_laccr", "_ldead_zone"]:
+        assert np.array_equal(getattr(h, name), getattr(g, name))
+    assert h.grid[0].shape == g.grid[0].shape
+    assert h._recipe == g._recipe
+    assert h._beta == g._beta and h._dr == g._dr and h.structured
+
+    # a single field, the others left to 0 and the builder arrays not read
+    h = store.load(path, fields=["T"])
+    assert np.array_equal(h.T, g.T)
+    assert not np.any(h.rho) and not hasattr(h, "_laccr")
+    return
+
+
+def test_subvolume(tmp_path, make_grid, star):
+    g = _model(make_grid, star)
+    path = tmp_path / "model.h5"
+    store.save(g, path, chunks=(4, 4, 4))
+    box = (slice(2, 9), slice(None), slice(1, 5))
+    h = store.load(path, subvolume=box)
+    assert h.rho.shape == (7, 16, 4)
+    assert np.array_equal(h.r, g.r[box])
+    assert np.array_equal(h.rho, g.rho[box])
+    assert np.array_equal(h.v, g.v[(slice(None),) + box])
+
+    cloud = ctts_env.Grid(g.r.ravel(), g.theta.ravel(), g.phi.ravel())
+    cloud.rho[:] = g.rho.ravel()
+    store.save(cloud, path)
+    h = store.load(path, subvolume=slice(100, 200))
+    assert np.array_equal(h.rho, cloud.rho[100:200])
+    assert np.array_equal(h.r, cloud.r[100:200])
+    return
+
+
+def test_load_region(tmp_path, make_grid, star):
+    g = _model(make_grid, star)
+    path = tmp_path / "model.h5"
+    store.save(g, path)
+    out = store.load_region(path, 1, fields=["rho", "v"])
+    mask = g.regions == 1
+    assert np.array_equal(out["r"], g.r[mask])
+    assert np.array_equal(out["rho"], g.rho[mask])
+    assert np.array_equal(out["v"], g.v[:, mask])
+    with pytest.raises(KeyError):
+        store.load_region(path, 7)
+    return
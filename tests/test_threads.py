@@ -0,0 +1,36 @@
+"""
+Thread-parallel builders: the models do not depend on the number of threads.
+"""
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+@pytest.mark.parametrize("nthreads", [3, 8])
+def test_threads(make_grid, star, nthreads):
+    models = []
+    for n in [1, nthreads]:
+        g = make_grid(24, 24, 16, nthreads=n)
+        assert g.nthreads == n
+        g.add_conical_stellar_wind(star, Rej=4, thetao=20)
+        g.add_disc_wind_knigge95(star, Rin=4, Rout=8)
+        models.append(g)
+    a, b = models
+    for name in ["x", "y", "z", "R", "_st", "_sp", "rho", "T", "v", "regions"]:
+        assert np.array_equal(getattr(a, name), getattr(b, name))
+    assert np.any(a.regions == 2)
+    return
+
+
+def test_parallel(make_grid):
+    g = make_grid(nthreads=4)
+    out = np.zeros(101)
+
+    def func(sl):
+        out[sl] = np.arange(101)[sl] ** 2
+
+    g._parallel(func, 101)
+    assert np.array_equal(out, np.arange(101) ** 2)
+    return
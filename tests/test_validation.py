@@ -0,0 +1,70 @@
+"""
+Statistics per region (region_stats) and validation of the fields (check_finite).
+"""
+
+import io
+import numpy as np
+import pytest
+import tracemalloc
+
+##########################################################################################
+
+
+def test_region_stats(make_grid, star):
+    g = make_grid(24, 24, 16)
+    g.add_mag(star, beta=10, V0=1e3)
+    g.setup_dead_zone(star, 1e-12, 8000)
+    stats = g.region_stats()
+    assert sorted(stats) == [0, 1, 4]
+    vx = g.get_v_cart()[0]
+    for ir, st in stats.items():
+        mask = g.regions == ir
+        lrho = mask & (g.rho > 0)
+        assert st["Ncells"] == np.count_nonzero(mask)
+        assert st["rmax"] == g.r[mask].max()
+        assert st["rho_mean"] == pytest.approx(g.rho[mask].mean(), rel=1e-12)
+        assert st["vx_max"] == pytest.approx(abs(vx[mask]).max(), rel=1e-12)
+        if ir > 0:
+            assert st["rmin"] == g.r[lrho].min()
+            assert st["T_min"] == g.T[lrho].min()
+            T_avg = (g.T * g.rho)[mask].sum() / g.rho[mask].sum()
+            assert st["T_avg_rho"] == pytest.approx(T_avg, rel=1e-12)
+    assert list(g.region_stats(regions=[4])) == [4]
+    out = io.StringIO()
+    g._pinfo(fout=out)
+    assert "Accr. Col" in out.getvalue() and "Dead zone" in out.getvalue()
+    return
+
+
+@pytest.mark.parametrize("order", ["C", "F"])
+def test_check_finite(make_grid, order):
+    g = make_grid(order=order)
+    assert g.check_finite() == {}
+    g.regions[2, 3, :] = 1
+    g.rho[2, 3, 1] = np.nan
+    g.rho[5, 5, 5] = np.inf
+    g.v[1, 2, 3, 4] = np.nan
+    g.T[2, 3, :] = np.nan
+    bad = g.check_finite(Nfirst=2, chunk_size=100, verbose=False)
+    assert bad["rho"] == {
+        0: {"count": 1, "first": [[5, 5, 5]]},
+        1: {"count": 1, "first": [[2, 3, 1]]},
+    }
+    assert bad["v"] == {1: {"count": 1, "first": [[2, 3, 4]]}}
+    assert bad["T"][1]["count"] == 8 and len(bad["T"][1]["first"]) == 2
+    assert "B" not in bad
+    with pytest.raises(ValueError):
+        g.check_finite(raise_error=True, verbose=False)
+    return
+
+
+def test_check_finite_no_copy(make_grid):
+    # on both layouts, the fields are swept without copying them
+    for order in ["C", "F"]:
+        g = make_grid(64, 64, 32, order=order)
+        tracemalloc.start()
+        g.check_finite(chunk_size=2**12, verbose=False)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert peak < g.rho.nbytes / 4
+    return
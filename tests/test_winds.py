@@ -0,0 +1,37 @@
+"""
+Stellar and disc winds.
+"""
+
+import ctts_env
+from ctts_env.constants import Msun_per_year_to_SI
+
+import numpy as np
+import pytest
+
+##########################################################################################
+
+
+def test_stellar_wind_shadow(make_grid, star):
+    g = make_grid(24, 24, 16)
+    g.add_mag(star, beta=20, V0=1e3)
+    regions0 = g.regions.copy()
+    g.add_stellar_wind(star, Rmin=1.5)
+
+    # reference: column by column
+    expected = np.zeros(g.shape, dtype=bool)
+    for j in range(g.shape[1]):
+        for k in range(g.shape[2]):
+            if np.any(regions0[:, j, k] > 0) or np.any(g._ldead_zone[:, j, k]):
+                continue
+            expected[:, j, k] = (regions0[:, j, k] == 0) & (g.grid[0] >= 1.5)
+    assert np.array_equal(g.regions == 5, expected)
+    assert 0 < expected.sum() < g.Ncells
+    # the wind carries the mass loss rate through each sphere of a free column
+    iw = np.nonzero(expected)
+    flux = g.rho[iw] * g.v[0][iw] * 4 * np.pi * (g.r[iw] * star.R_m) ** 2
+    assert np.allclose(flux, 1e-14 * Msun_per_year_to_SI, rtol=1e-12)
+
+    cloud = ctts_env.Grid(g.r.ravel(), g.theta.ravel(), g.phi.ravel())
+    with pytest.raises(NotImplementedError):
+        cloud.add_stellar_wind(star)
+    return